@@ -0,0 +1,271 @@
+"""
+AsyncPublisher
+--------------
+Background batching for the in-process Kafka producer (KafkaAdapter).
+
+- publish() only appends to a bounded in-memory queue; a dispatcher thread
+  groups messages per topic and hands a batch to send_batch(topic, payloads)
+  once it reaches batch_size or its oldest message has waited linger_ms.
+- Batches are sent on a small set of single-thread sender pools, one picked
+  per topic, so messages of one topic keep their order. Only a few batches
+  per sender are in flight; beyond that messages wait in the bounded queue.
+- When the queue is full the policy decides: BLOCK waits up to block_timeout
+  and then raises, DROP_NEWEST rejects the message, DROP_OLDEST evicts the
+  oldest queued message, CALLER_RUNS sends on the caller thread.
+- flush() sends everything accepted so far and waits for it. shutdown() does
+  the same and stops the dispatcher; messages published after shutdown are
+  sent synchronously. Flush and stop requests travel on their own channel,
+  so DROP_OLDEST only ever evicts messages.
+- A failed batch is logged and counted in stats(); it is not retried here.
+"""
+
+import collections
+import threading
+import time
+
+try:  # Python 2 / Jython
+    import Queue as queue
+except ImportError:  # Python 3
+    import queue
+
+from common.concurrency.Executor import code as Executor
+from common.exceptions import MessagingException as mex
+from common.logging.LogFactory import code as LogFactory
+
+log = LogFactory.get_logger("AsyncPublisher")
+
+BLOCK = "BLOCK"
+DROP_NEWEST = "DROP_NEWEST"
+DROP_OLDEST = "DROP_OLDEST"
+CALLER_RUNS = "CALLER_RUNS"
+POLICIES = (BLOCK, DROP_NEWEST, DROP_OLDEST, CALLER_RUNS)
+
+DEFAULT_MAX_QUEUE = 10000
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_LINGER_MS = 20
+DEFAULT_SENDERS = 4
+DEFAULT_BLOCK_TIMEOUT = 2.0
+MAX_IN_FLIGHT_PER_SENDER = 2  # batches handed to a sender pool and not yet sent
+
+_IDLE_POLL_SECONDS = 1.0
+_STOP = object()
+_WAKE = object()  # nudges the dispatcher to look at its control channel
+
+
+class _Flush(object):
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class AsyncPublisher(object):
+    def __init__(self, send_batch, name="async-publisher", max_queue=DEFAULT_MAX_QUEUE,
+                 batch_size=DEFAULT_BATCH_SIZE, linger_ms=DEFAULT_LINGER_MS, senders=DEFAULT_SENDERS,
+                 policy=BLOCK, block_timeout=DEFAULT_BLOCK_TIMEOUT):
+        policy = (policy or BLOCK).upper()
+        if policy not in POLICIES:
+            raise ValueError("Unknown backpressure policy: %s" % policy)
+        self.send_batch = send_batch
+        self.name = name
+        self.batch_size = max(1, int(batch_size))
+        self.linger = max(0.0, float(linger_ms) / 1000.0)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(max(1, int(max_queue)))
+        self._control = collections.deque()  # _Flush markers and _STOP, never evicted
+        self._senders = [Executor.shared("%s-sender-%d" % (name, i), 1) for i in range(max(1, int(senders)))]
+        self._in_flight = threading.Semaphore(len(self._senders) * MAX_IN_FLIGHT_PER_SENDER)
+        self._lock = threading.Condition(threading.Lock())
+        self._pending = 0  # accepted and not yet sent or failed
+        self._stats = {"accepted": 0, "sent": 0, "failed": 0, "dropped": 0, "batches": 0}
+        self._thread = None
+        self._closed = False
+
+    # ------------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------------
+    def publish(self, topic, payload):
+        """True when the message was accepted (or sent), False when the policy dropped it."""
+        if self._closed:
+            return self._send_now(topic, payload)
+        self._ensure_started()
+        self._track(accepted=1)
+        try:
+            self._queue.put_nowait((topic, payload))
+            return True
+        except queue.Full:
+            return self._overflow(topic, payload)
+
+    def _overflow(self, topic, payload):
+        if self.policy == BLOCK:
+            try:
+                self._queue.put((topic, payload), True, self.block_timeout)
+                return True
+            except queue.Full:
+                self._track(accepted=-1, dropped=1)
+                raise mex.MessagingException(
+                    "Publish queue %s is full" % self.name, code="PUBLISH_QUEUE_FULL"
+                )
+        if self.policy == DROP_OLDEST:
+            while True:
+                try:
+                    if isinstance(self._queue.get_nowait(), tuple):
+                        self._track(dropped=1, done=1)
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait((topic, payload))
+                    return True
+                except queue.Full:
+                    continue
+        self._track(accepted=-1)
+        if self.policy == CALLER_RUNS:
+            return self._send_now(topic, payload)
+        self._track(dropped=1)
+        log.warn("Publish queue %s is full; dropped message for %s" % (self.name, topic))
+        return False
+
+    def _send_now(self, topic, payload):
+        self._track(accepted=1)
+        return self._deliver(topic, [payload])
+
+    # ------------------------------------------------------------------
+    # Dispatcher
+    # ------------------------------------------------------------------
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name="%s-dispatcher" % self.name)
+                thread.daemon = True
+                thread.start()
+                self._thread = thread
+
+    def _run(self):
+        batches = {}  # {topic: (deadline, [payloads])}
+        while True:
+            timeout = _IDLE_POLL_SECONDS
+            if batches:
+                timeout = max(0.0, min(deadline for deadline, _ in batches.values()) - time.time())
+            try:
+                item = self._queue.get(True, timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, tuple):
+                self._add(batches, item)
+            while self._control:
+                marker = self._control.popleft()
+                self._drain(batches)
+                self._dispatch_all(batches)
+                if marker is _STOP:
+                    return
+                marker.done.set()
+            now = time.time()
+            for topic in [t for t, (deadline, _) in batches.items() if deadline <= now]:
+                self._dispatch(topic, batches.pop(topic)[1])
+
+    def _add(self, batches, item):
+        topic, payload = item
+        entry = batches.get(topic)
+        if entry is None:
+            entry = (time.time() + self.linger, [])
+            batches[topic] = entry
+        entry[1].append(payload)
+        if len(entry[1]) >= self.batch_size:
+            self._dispatch(topic, batches.pop(topic)[1])
+
+    def _drain(self, batches):
+        # Everything queued before the marker was posted is in the queue now
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, tuple):
+                self._add(batches, item)
+
+    def _signal(self, marker):
+        self._control.append(marker)
+        try:
+            self._queue.put_nowait(_WAKE)
+        except queue.Full:
+            pass  # the dispatcher has messages to take and checks the channel after each
+
+    def _dispatch_all(self, batches):
+        for topic in list(batches):
+            self._dispatch(topic, batches.pop(topic)[1])
+
+    def _dispatch(self, topic, payloads):
+        # Waits while too many batches are in flight, so a slow broker backs up
+        # into the bounded queue instead of the sender pools.
+        self._in_flight.acquire()
+        sender = self._senders[hash(topic) % len(self._senders)]
+        try:
+            sender.submit(self._deliver_batch, topic, payloads)
+        except RuntimeError:
+            self._deliver_batch(topic, payloads)  # sender pool already shut down
+
+    def _deliver_batch(self, topic, payloads):
+        try:
+            return self._deliver(topic, payloads)
+        finally:
+            self._in_flight.release()
+
+    def _deliver(self, topic, payloads):
+        try:
+            result = self.send_batch(topic, payloads)
+            self._track(sent=len(payloads), batches=1, done=len(payloads))
+            return result
+        except Exception as ex:
+            self._track(failed=len(payloads), batches=1, done=len(payloads))
+            log.error("Failed to publish %s message(s) to %s: %s" % (len(payloads), topic, ex))
+            return False
+
+    # ------------------------------------------------------------------
+    # Bookkeeping
+    # ------------------------------------------------------------------
+    def _track(self, accepted=0, sent=0, failed=0, dropped=0, batches=0, done=0):
+        with self._lock:
+            self._stats["accepted"] += accepted
+            self._stats["sent"] += sent
+            self._stats["failed"] += failed
+            self._stats["dropped"] += dropped
+            self._stats["batches"] += batches
+            self._pending += accepted - done
+            if self._pending <= 0:
+                self._lock.notify_all()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = self._pending
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+    def flush(self, timeout=None):
+        """Send every message accepted so far; True when all of them were handed to send_batch."""
+        if self._thread is not None and self._thread.is_alive():
+            marker = _Flush()
+            self._signal(marker)
+            marker.done.wait(timeout)
+        return self._wait_idle(timeout)
+
+    def _wait_idle(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while self._pending > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._lock.wait(remaining if remaining is not None else _IDLE_POLL_SECONDS)
+        return True
+
+    def shutdown(self, timeout=None):
+        """Flush and stop the dispatcher; later publishes are sent synchronously."""
+        self._closed = True
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._signal(_STOP)
+            thread.join(timeout)
+        return self._wait_idle(timeout)
+
@@ -0,0 +1,355 @@
+"""
+ChangeFeed
+----------
+Pushes read-model changes to Perspective sessions instead of letting their
+screens poll.
+
+    # view (session startup / onStartup of the screen), renewed on a slow timer
+    ChangeFeed.subscribe(session.props.id, "material-catalog", [datasource], page_id=page.props.pageId)
+    # write side, after the commit
+    ChangeFeed.publish("material-catalog", datasource, changed=[material_id])
+    # screen message handler "mes-change": payload {"model", "key", "added",
+    # "changed", "removed", "reset", "sequence"}; refetch only those rows
+
+- Subscribers are (session id, page id) pairs, page id None meaning the whole
+  session, so two pages of one session each get their own pushes. They
+  subscribe to (model, key) pairs, key None meaning every key of the model;
+  publish() finds the subscribers with two dict lookups. A publish with key
+  None reaches every subscriber of the model.
+- Deltas are merged per subscriber until it may be pushed again (max_rate_ms):
+  added then removed cancels out, removed then added becomes changed. The
+  first change after a quiet period is pushed at once.
+- A delta with more than max_ids rows, or published with reset=True, is sent
+  as {"reset": True}; the screen reloads the whole read model.
+- Subscriptions expire after lease_seconds unless subscribe() is called
+  again, so closed pages and sessions stop receiving pushes without a
+  shutdown hook; unsubscribe_session() drops every page of a session at once.
+- Pushes go out on one background thread through
+  system.perspective.sendMessage; on_message() accepts a delta forwarded from
+  another gateway over the message bus.
+"""
+
+import threading
+import time
+
+from common.logging.LogFactory import code as LogFactory
+from infrastructure import MessagingConfig as cfg
+
+log = LogFactory.get_logger("ChangeFeed")
+
+ADDED = "added"
+CHANGED = "changed"
+REMOVED = "removed"
+
+DEFAULT_MAX_RATE_MS = 1000
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_IDS = 500
+DEFAULT_MESSAGE_TYPE = "mes-change"
+
+_IDLE_POLL_SECONDS = 5.0
+_ANY_PAGE = object()
+
+
+def _perspective_send(message_type, payload, session_id, page_id=None):
+    from system.perspective import sendMessage
+
+    if page_id:
+        sendMessage(message_type, payload, scope="page", sessionId=session_id, pageId=page_id)
+    else:
+        sendMessage(message_type, payload, scope="session", sessionId=session_id)
+
+
+class _Delta(object):
+    __slots__ = ("states", "reset")
+
+    def __init__(self):
+        self.states = {}  # {row id: ADDED | CHANGED | REMOVED}
+        self.reset = False
+
+    def merge(self, added, changed, removed, reset):
+        if reset or self.reset:
+            self.reset = True
+            self.states = {}
+            return
+        states = self.states
+        for row_id in added:
+            states[row_id] = CHANGED if states.get(row_id) in (REMOVED, CHANGED) else ADDED
+        for row_id in changed:
+            if states.get(row_id) != ADDED:
+                states[row_id] = CHANGED
+        for row_id in removed:
+            if states.pop(row_id, None) != ADDED:
+                states[row_id] = REMOVED
+
+    def payload(self, model, key, max_ids):
+        payload = {"model": model, "key": key, ADDED: [], CHANGED: [], REMOVED: [], "reset": self.reset}
+        if self.reset or len(self.states) > max_ids:
+            payload["reset"] = True
+            return payload
+        for row_id, state in self.states.items():
+            payload[state].append(row_id)
+        return payload
+
+
+class _Session(object):
+    __slots__ = ("session_id", "page_id", "message_type", "interval", "leases", "pending", "next_push", "sequence")
+
+    def __init__(self, session_id, page_id, message_type, interval):
+        self.session_id = session_id
+        self.page_id = page_id
+        self.message_type = message_type
+        self.interval = interval
+        self.leases = {}  # {(model, key): expiry time}
+        self.pending = {}  # {(model, key): _Delta}
+        self.next_push = 0.0
+        self.sequence = 0
+
+
+class ChangeFeed(object):
+    def __init__(self, sender=None, max_rate_ms=DEFAULT_MAX_RATE_MS, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 max_ids=DEFAULT_MAX_IDS, message_type=DEFAULT_MESSAGE_TYPE):
+        self.sender = sender or _perspective_send
+        self.interval = max(0.0, float(max_rate_ms) / 1000.0)
+        self.lease = max(1.0, float(lease_seconds))
+        self.max_ids = max(0, int(max_ids))
+        self.message_type = message_type
+        self._sessions = {}  # {(session id, page id): _Session}
+        self._index = {}  # {model: {key: set((session id, page id))}}
+        self._lock = threading.Condition(threading.Lock())
+        self._thread = None
+        self._closed = False
+        self._stats = {"published": 0, "pushes": 0, "resets": 0, "failed": 0, "expired": 0}
+
+    # ------------------------------------------------------------------
+    # Subscriptions
+    # ------------------------------------------------------------------
+    def subscribe(self, session_id, model, keys=None, page_id=None, max_rate_ms=None, message_type=None):
+        """Register or renew interest in model for keys (None: every key); returns the lease expiry."""
+        keys = [None] if keys is None else list(keys)
+        interval = self.interval if max_rate_ms is None else max(0.0, float(max_rate_ms) / 1000.0)
+        expires = time.time() + self.lease
+        subscriber = (session_id, page_id)
+        with self._lock:
+            session = self._sessions.get(subscriber)
+            if session is None:
+                session = _Session(session_id, page_id, message_type or self.message_type, interval)
+                self._sessions[subscriber] = session
+            else:
+                session.interval = interval
+                if message_type:
+                    session.message_type = message_type
+            by_key = self._index.setdefault(model, {})
+            for key in keys:
+                session.leases[(model, key)] = expires
+                by_key.setdefault(key, set()).add(subscriber)
+        self._ensure_started()
+        return expires
+
+    def unsubscribe(self, session_id, model=None, keys=None, page_id=_ANY_PAGE):
+        """Drop subscriptions of one page of the session (every page by default)."""
+        with self._lock:
+            sessions = [s for s in self._sessions.values() if s.session_id == session_id
+                        and (page_id is _ANY_PAGE or s.page_id == page_id)]
+            for session in sessions:
+                for model_key in list(session.leases):
+                    if (model is None or model_key[0] == model) and (keys is None or model_key[1] in keys):
+                        self._drop(session, model_key)
+                if not session.leases:
+                    del self._sessions[(session.session_id, session.page_id)]
+        return bool(sessions)
+
+    def unsubscribe_session(self, session_id):
+        return self.unsubscribe(session_id)
+
+    def _drop(self, session, model_key):
+        # caller holds the lock
+        model, key = model_key
+        session.leases.pop(model_key, None)
+        session.pending.pop(model_key, None)
+        by_key = self._index.get(model) or {}
+        subscribers = by_key.get(key)
+        if subscribers is not None:
+            subscribers.discard((session.session_id, session.page_id))
+            if not subscribers:
+                del by_key[key]
+        if not by_key:
+            self._index.pop(model, None)
+
+    def subscriptions(self, session_id=None):
+        """{(session id, page id): [(model, key)]} for one session or all of them."""
+        with self._lock:
+            return dict(((s.session_id, s.page_id), sorted(s.leases, key=str)) for s in self._sessions.values()
+                        if session_id is None or s.session_id == session_id)
+
+    # ------------------------------------------------------------------
+    # Publishing
+    # ------------------------------------------------------------------
+    def publish(self, model, key=None, added=(), changed=(), removed=(), reset=False):
+        """Queue a delta for every session subscribed to (model, key); returns how many sessions."""
+        added, changed, removed = list(added or ()), list(changed or ()), list(removed or ())
+        if not (added or changed or removed or reset):
+            return 0
+        with self._lock:
+            self._stats["published"] += 1
+            by_key = self._index.get(model)
+            if not by_key:
+                return 0
+            if key is None:
+                targets = set(subscriber for subscribers in by_key.values() for subscriber in subscribers)
+            else:
+                targets = set(by_key.get(key, ())) | set(by_key.get(None, ()))
+            notified = 0
+            for subscriber in targets:
+                session = self._sessions.get(subscriber)
+                if session is None:
+                    continue
+                delta = session.pending.get((model, key))
+                if delta is None:
+                    delta = session.pending[(model, key)] = _Delta()
+                delta.merge(added, changed, removed, reset)
+                notified += 1
+            if notified:
+                self._lock.notify()
+        return notified
+
+    def on_message(self, payload):
+        """Gateway message handler for deltas forwarded by another gateway."""
+        payload = payload or {}
+        return self.publish(payload.get("model"), payload.get("key"), payload.get(ADDED), payload.get(CHANGED),
+                            payload.get(REMOVED), bool(payload.get("reset")))
+
+    # ------------------------------------------------------------------
+    # Pusher
+    # ------------------------------------------------------------------
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._closed or (self._thread is not None and self._thread.is_alive()):
+                return
+            thread = threading.Thread(target=self._run, name="change-feed")
+            thread.daemon = True
+            thread.start()
+            self._thread = thread
+
+    def _run(self):
+        next_sweep = time.time() + self.lease / 10.0
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                now = time.time()
+                due = []
+                wait = min(_IDLE_POLL_SECONDS, max(0.0, next_sweep - now))
+                for session in self._sessions.values():
+                    if not session.pending:
+                        continue
+                    if session.next_push <= now:
+                        due.append((session, session.pending))
+                        session.pending = {}
+                        session.next_push = now + session.interval
+                    else:
+                        wait = min(wait, session.next_push - now)
+                if not due and now < next_sweep:
+                    self._lock.wait(wait)
+                    continue
+                if now >= next_sweep:
+                    self._sweep(now)
+                    next_sweep = now + self.lease / 10.0
+            for session, deltas in due:
+                self._push(session, deltas)
+
+    def _sweep(self, now):
+        # caller holds the lock
+        for session in list(self._sessions.values()):
+            for model_key, expires in list(session.leases.items()):
+                if expires <= now:
+                    self._drop(session, model_key)
+                    self._stats["expired"] += 1
+            if not session.leases:
+                del self._sessions[(session.session_id, session.page_id)]
+
+    def _push(self, session, deltas):
+        for (model, key), delta in deltas.items():
+            session.sequence += 1
+            payload = delta.payload(model, key, self.max_ids)
+            payload["sequence"] = session.sequence
+            try:
+                self.sender(session.message_type, payload, session.session_id, session.page_id)
+                self._track(pushes=1, resets=1 if payload["reset"] else 0)
+            except Exception as ex:
+                self._track(failed=1)
+                log.debug("Change push to session %s failed: %s" % (session.session_id, ex))
+
+    # ------------------------------------------------------------------
+    # Bookkeeping
+    # ------------------------------------------------------------------
+    def _track(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                self._stats[name] += count
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sessions"] = len(self._sessions)
+            stats["pending"] = sum(len(s.pending) for s in self._sessions.values())
+        return stats
+
+    def shutdown(self, timeout=None):
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return True
+
+
+_feed = None
+_feed_lock = threading.Lock()
+
+
+def get():
+    global _feed
+    if _feed is None:
+        with _feed_lock:
+            if _feed is None:
+                _feed = ChangeFeed(**cfg.change_feed_options())
+    return _feed
+
+
+def subscribe(session_id, model, keys=None, page_id=None, max_rate_ms=None, message_type=None):
+    return get().subscribe(session_id, model, keys, page_id, max_rate_ms, message_type)
+
+
+def unsubscribe(session_id, model=None, keys=None, page_id=_ANY_PAGE):
+    return get().unsubscribe(session_id, model, keys, page_id)
+
+
+def unsubscribe_session(session_id):
+    return get().unsubscribe_session(session_id)
+
+
+def publish(model, key=None, added=(), changed=(), removed=(), reset=False):
+    """Never raises: a failed notification must not fail the write that caused it."""
+    try:
+        return get().publish(model, key, added, changed, removed, reset)
+    except Exception as ex:
+        log.warn("Could not publish change of %s/%s: %s" % (model, key, ex))
+        return 0
+
+
+def on_message(payload):
+    return get().on_message(payload)
+
+
+def stats():
+    return get().stats()
+
+
+def shutdown(timeout=10):
+    global _feed
+    with _feed_lock:
+        feed, _feed = _feed, None
+    return feed.shutdown(timeout) if feed is not None else True
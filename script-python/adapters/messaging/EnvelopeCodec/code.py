@@ -0,0 +1,492 @@
+"""
+EnvelopeCodec
+-------------
+Wire encodings for ISA-95 envelopes (see ISA95Config.new_envelope).
+
+    codec = EnvelopeCodec.get("SCHEMA")
+    data = codec.encode(envelope)
+    frame = codec.encode_batch(envelopes)   # one frame for many envelopes
+    values = codec.encode_many(envelopes)   # one message per envelope
+    EnvelopeCodec.decode(data)              # any codec, detected from the first byte
+
+- JSON: compact JSON text; batches are newline-delimited.
+- PACK: MessagePack (the subset JSON-like values need), readable by any
+  msgpack library; about a third smaller than JSON.
+- SCHEMA: field names are left out. Each (noun, envelope keys, data keys)
+  combination gets a schema, learned on first use and cached, and a message
+  carries its 4-byte schema id plus the values in schema order (MessagePack).
+  Single messages need the schema on the receiving side (register_schema or
+  load_schemas(schemas())); batch frames carry the schemas they use.
+  A learned schema whose CRC32 id is taken by another shape gets the next
+  free id; loading a definition whose id is taken by another shape raises.
+  At most MAX_SCHEMAS are kept, the oldest being dropped first.
+- Values that are not JSON-like (datetimes, decimals, Java objects) are sent
+  as their str(), as json.dumps(default=str) does.
+"""
+
+import json
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+JSON = "JSON"
+PACK = "PACK"
+SCHEMA = "SCHEMA"
+
+HEADER_FIELDS = ("correlationId", "timestamp", "verb", "noun", "source", "target", "version")
+
+_SCHEMA_MESSAGE = 0x53  # "S"
+_SCHEMA_BATCH = 0x42  # "B"
+_SCHEMA_VERSION = 1
+
+MAX_SCHEMAS = 4096
+
+_TEXT = type(u"")
+_BINARY = bytes if bytes is not str else ()  # Python 2 str is text here
+try:
+    _INTEGER_TYPES = (int, long)  # type: ignore[name-defined]
+except NameError:  # pragma: no cover - Python 3
+    _INTEGER_TYPES = (int,)
+
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_U64 = struct.Struct(">Q")
+_I8 = struct.Struct(">b")
+_I16 = struct.Struct(">h")
+_I32 = struct.Struct(">i")
+_I64 = struct.Struct(">q")
+_F64 = struct.Struct(">d")
+
+
+# ----------------------------------------------------------------------
+# MessagePack
+# ----------------------------------------------------------------------
+def _pack_int(value, out):
+    if 0 <= value < 0x80:
+        out.append(value)
+    elif -32 <= value < 0:
+        out.append(value & 0xff)
+    elif 0 <= value <= 0xff:
+        out.append(0xcc)
+        out.append(value)
+    elif 0 <= value <= 0xffff:
+        out.append(0xcd)
+        out += _U16.pack(value)
+    elif 0 <= value <= 0xffffffff:
+        out.append(0xce)
+        out += _U32.pack(value)
+    elif 0 <= value <= 0xffffffffffffffff:
+        out.append(0xcf)
+        out += _U64.pack(value)
+    elif -0x80 <= value:
+        out.append(0xd0)
+        out += _I8.pack(value)
+    elif -0x8000 <= value:
+        out.append(0xd1)
+        out += _I16.pack(value)
+    elif -0x80000000 <= value:
+        out.append(0xd2)
+        out += _I32.pack(value)
+    elif -0x8000000000000000 <= value:
+        out.append(0xd3)
+        out += _I64.pack(value)
+    else:
+        _pack_text(str(value), out)
+
+
+def _pack_text(value, out):
+    raw = value.encode("utf-8") if isinstance(value, _TEXT) else value
+    size = len(raw)
+    if size < 32:
+        out.append(0xa0 | size)
+    elif size <= 0xff:
+        out.append(0xd9)
+        out.append(size)
+    elif size <= 0xffff:
+        out.append(0xda)
+        out += _U16.pack(size)
+    else:
+        out.append(0xdb)
+        out += _U32.pack(size)
+    out += raw
+
+
+def _pack_binary(value, out):
+    size = len(value)
+    if size <= 0xff:
+        out.append(0xc4)
+        out.append(size)
+    elif size <= 0xffff:
+        out.append(0xc5)
+        out += _U16.pack(size)
+    else:
+        out.append(0xc6)
+        out += _U32.pack(size)
+    out += value
+
+
+def _container_header(size, fix, small, large, out):
+    if size < 16:
+        out.append(fix | size)
+    elif size <= 0xffff:
+        out.append(small)
+        out += _U16.pack(size)
+    else:
+        out.append(large)
+        out += _U32.pack(size)
+
+
+def _pack_map(value, out):
+    _container_header(len(value), 0x80, 0xde, 0xdf, out)
+    packers = _PACKERS
+    for key, item in value.items():
+        (packers.get(key.__class__) or pack)(key, out)
+        (packers.get(item.__class__) or pack)(item, out)
+
+
+def _pack_array(value, out):
+    _container_header(len(value), 0x90, 0xdc, 0xdd, out)
+    packers = _PACKERS
+    for item in value:
+        (packers.get(item.__class__) or pack)(item, out)
+
+
+def _pack_none(value, out):
+    out.append(0xc0)
+
+
+def _pack_bool(value, out):
+    out.append(0xc3 if value else 0xc2)
+
+
+def _pack_float(value, out):
+    out.append(0xcb)
+    out += _F64.pack(value)
+
+
+_PACKERS = {type(None): _pack_none, bool: _pack_bool, float: _pack_float, _TEXT: _pack_text, str: _pack_text,
+            dict: _pack_map, list: _pack_array, tuple: _pack_array}
+for _type in _INTEGER_TYPES:
+    _PACKERS[_type] = _pack_int
+if _BINARY:
+    _PACKERS[bytes] = _pack_binary
+
+
+def pack(value, out):
+    """Append the MessagePack encoding of value to the bytearray out."""
+    packer = _PACKERS.get(value.__class__)
+    if packer is not None:
+        return packer(value, out)
+    if isinstance(value, bool):
+        return _pack_bool(value, out)
+    if isinstance(value, _INTEGER_TYPES):
+        return _pack_int(value, out)
+    if isinstance(value, float):
+        return _pack_float(value, out)
+    if isinstance(value, dict):
+        return _pack_map(value, out)
+    if isinstance(value, (list, tuple)):
+        return _pack_array(value, out)
+    return _pack_text(_TEXT(value), out)
+
+
+def unpack(data, position=0):
+    """(value, next position) for the MessagePack value at position of a bytearray."""
+    byte = data[position]
+    position += 1
+    if byte < 0x80:
+        return byte, position
+    if byte >= 0xe0:
+        return byte - 0x100, position
+    if 0xa0 <= byte <= 0xbf:
+        return _text(data, position, byte & 0x1f)
+    if 0x80 <= byte <= 0x8f:
+        return _unpack_map(data, position, byte & 0x0f)
+    if 0x90 <= byte <= 0x9f:
+        return _unpack_array(data, position, byte & 0x0f)
+    if byte == 0xc0:
+        return None, position
+    if byte == 0xc2:
+        return False, position
+    if byte == 0xc3:
+        return True, position
+    if byte == 0xcb:
+        return _F64.unpack_from(data, position)[0], position + 8
+    fixed = _FIXED.get(byte)
+    if fixed is not None:
+        return fixed.unpack_from(data, position)[0], position + fixed.size
+    sized = _SIZED.get(byte)
+    if sized is not None:
+        length_format, reader = sized
+        size = data[position] if length_format is None else length_format.unpack_from(data, position)[0]
+        position += 1 if length_format is None else length_format.size
+        return reader(data, position, size)
+    raise ValueError("Unsupported MessagePack type 0x%02x" % byte)
+
+
+def _text(data, position, size):
+    end = position + size
+    return bytes(data[position:end]).decode("utf-8"), end
+
+
+def _binary(data, position, size):
+    end = position + size
+    return bytes(data[position:end]), end
+
+
+def _unpack_map(data, position, size):
+    result = {}
+    for _ in range(size):
+        key, position = unpack(data, position)
+        result[key], position = unpack(data, position)
+    return result, position
+
+
+def _unpack_array(data, position, size):
+    result = []
+    for _ in range(size):
+        item, position = unpack(data, position)
+        result.append(item)
+    return result, position
+
+
+_FIXED = {0xcc: struct.Struct(">B"), 0xcd: _U16, 0xce: _U32, 0xcf: _U64,
+          0xd0: _I8, 0xd1: _I16, 0xd2: _I32, 0xd3: _I64, 0xca: struct.Struct(">f")}
+_SIZED = {0xd9: (None, _text), 0xda: (_U16, _text), 0xdb: (_U32, _text),
+          0xc4: (None, _binary), 0xc5: (_U16, _binary), 0xc6: (_U32, _binary),
+          0xdc: (_U16, _unpack_array), 0xdd: (_U32, _unpack_array),
+          0xde: (_U16, _unpack_map), 0xdf: (_U32, _unpack_map)}
+
+
+# ----------------------------------------------------------------------
+# Codecs
+# ----------------------------------------------------------------------
+class JsonCodec(object):
+    name = JSON
+    content_type = "application/json"
+
+    def encode(self, envelope):
+        return json.dumps(envelope, separators=(",", ":"), default=str).encode("utf-8")
+
+    def decode(self, data):
+        return json.loads(data.decode("utf-8") if isinstance(data, (bytes, bytearray)) else data)
+
+    def encode_many(self, envelopes):
+        return [self.encode(envelope) for envelope in envelopes]
+
+    def encode_batch(self, envelopes):
+        return b"\n".join(self.encode_many(envelopes))
+
+    def decode_batch(self, data):
+        return [self.decode(line) for line in bytes(data).splitlines() if line.strip()]
+
+
+class PackCodec(object):
+    name = PACK
+    content_type = "application/msgpack"
+
+    def encode(self, envelope):
+        out = bytearray()
+        pack(envelope, out)
+        return bytes(out)
+
+    def decode(self, data):
+        return unpack(bytearray(data))[0]
+
+    def encode_many(self, envelopes):
+        return [self.encode(envelope) for envelope in envelopes]
+
+    def encode_batch(self, envelopes):
+        out = bytearray()
+        _pack_array(list(envelopes), out)
+        return bytes(out)
+
+    def decode_batch(self, data):
+        return unpack(bytearray(data))[0]
+
+
+class Schema(object):
+    """Field order for one envelope shape; data_fields is None when data is not a dict."""
+
+    def __init__(self, noun, fields, data_fields, schema_id=None):
+        self.noun = noun
+        self.fields = tuple(fields)
+        self.data_fields = tuple(data_fields) if data_fields is not None else None
+        if schema_id is None:
+            definition = json.dumps([noun, self.fields, self.data_fields])
+            schema_id = zlib.crc32(definition.encode("utf-8")) & 0xffffffff
+        self.set_id(schema_id)
+
+    def set_id(self, schema_id):
+        self.id = schema_id
+        self._id = _U32.pack(schema_id)
+
+    def same_shape(self, other):
+        return (self.noun, self.fields, self.data_fields) == (other.noun, other.fields, other.data_fields)
+
+    def definition(self):
+        return [self.id, self.noun, list(self.fields),
+                list(self.data_fields) if self.data_fields is not None else None]
+
+    def encode(self, envelope, out):
+        out += self._id
+        packers = _PACKERS
+        for field in self.fields:
+            value = envelope.get(field)
+            if field == "data" and self.data_fields is not None:
+                for name in self.data_fields:
+                    item = value.get(name)
+                    (packers.get(item.__class__) or pack)(item, out)
+            else:
+                (packers.get(value.__class__) or pack)(value, out)
+
+    def decode(self, data, position):
+        envelope = {}
+        for field in self.fields:
+            if field == "data" and self.data_fields is not None:
+                values = {}
+                for name in self.data_fields:
+                    values[name], position = unpack(data, position)
+                envelope["data"] = values
+            else:
+                envelope[field], position = unpack(data, position)
+        return envelope, position
+
+
+class SchemaCodec(object):
+    name = SCHEMA
+    content_type = "application/x-isa95-schema"
+
+    def __init__(self, max_schemas=MAX_SCHEMAS):
+        self.max_schemas = max(1, int(max_schemas))
+        self._by_shape = {}  # {(noun, envelope keys, data keys): Schema}
+        self._by_id = OrderedDict()  # oldest first
+        self._lock = threading.Lock()
+
+    def register_schema(self, noun, data_fields, fields=HEADER_FIELDS + ("data",)):
+        """Declare a noun's field order up front (consumers decoding single messages)."""
+        return self._add(Schema(noun, fields, data_fields), None)
+
+    def schemas(self):
+        with self._lock:
+            return [schema.definition() for schema in self._by_id.values()]
+
+    def load_schemas(self, definitions):
+        """Register definitions from schemas() of the producer, keeping their ids."""
+        for schema_id, noun, fields, data_fields in definitions:
+            self._add(Schema(noun, fields, data_fields, schema_id), None, keep_id=True)
+
+    def _add(self, schema, shape, keep_id=False):
+        with self._lock:
+            existing = self._by_id.get(schema.id)
+            while existing is not None and not existing.same_shape(schema):
+                if keep_id:
+                    raise ValueError("Envelope schema id %08x is already used by another shape" % schema.id)
+                schema.set_id((schema.id + 1) & 0xffffffff)  # CRC32 collision
+                existing = self._by_id.get(schema.id)
+            if existing is not None:
+                schema = existing
+            else:
+                self._by_id[schema.id] = schema
+                if len(self._by_id) > self.max_schemas:
+                    self._evict(self._by_id.popitem(last=False)[1])
+            if shape is not None:
+                self._by_shape[shape] = schema
+        return schema
+
+    def _evict(self, schema):
+        for shape in [shape for shape, known in self._by_shape.items() if known is schema]:
+            del self._by_shape[shape]
+
+    def schema_for(self, envelope):
+        data = envelope.get("data")
+        data_keys = tuple(data) if isinstance(data, dict) else None
+        shape = (envelope.get("noun"), tuple(envelope), data_keys)
+        schema = self._by_shape.get(shape)
+        if schema is None:
+            schema = self._add(Schema(shape[0], shape[1], data_keys), shape)
+        return schema
+
+    def encode(self, envelope):
+        out = bytearray((_SCHEMA_MESSAGE, _SCHEMA_VERSION))
+        self.schema_for(envelope).encode(envelope, out)
+        return bytes(out)
+
+    def encode_many(self, envelopes):
+        return [self.encode(envelope) for envelope in envelopes]
+
+    def encode_batch(self, envelopes):
+        schemas = [self.schema_for(envelope) for envelope in envelopes]
+        used = dict((schema.id, schema) for schema in schemas)
+        out = bytearray((_SCHEMA_BATCH, _SCHEMA_VERSION))
+        _pack_array([schema.definition() for schema in used.values()], out)
+        _pack_int(len(schemas), out)
+        for schema, envelope in zip(schemas, envelopes):
+            schema.encode(envelope, out)
+        return bytes(out)
+
+    def _record(self, data, position, schemas):
+        schema_id = _U32.unpack_from(data, position)[0]
+        schema = schemas.get(schema_id) if schemas else None
+        schema = schema or self._by_id.get(schema_id)
+        if schema is None:
+            raise ValueError("Unknown envelope schema %08x; load_schemas() first" % schema_id)
+        return schema.decode(data, position + 4)
+
+    def decode(self, data):
+        data = bytearray(data)
+        if data[0] != _SCHEMA_MESSAGE:
+            raise ValueError("Not a schema-encoded envelope")
+        return self._record(data, 2, None)[0]
+
+    def decode_batch(self, data):
+        data = bytearray(data)
+        if data[0] != _SCHEMA_BATCH:
+            raise ValueError("Not a schema-encoded envelope batch")
+        definitions, position = unpack(data, 2)
+        schemas = dict((d[0], Schema(d[1], d[2], d[3], d[0])) for d in definitions)
+        count, position = unpack(data, position)
+        envelopes = []
+        for _ in range(count):
+            envelope, position = self._record(data, position, schemas)
+            envelopes.append(envelope)
+        return envelopes
+
+
+_codecs = {JSON: JsonCodec(), PACK: PackCodec(), SCHEMA: SchemaCodec()}
+
+
+def register(codec):
+    """Add or replace a codec (any object with name, encode/decode and batch methods)."""
+    _codecs[codec.name.upper()] = codec
+    return codec
+
+
+def get(name=None):
+    if name is None:
+        from infrastructure import MessagingConfig as cfg
+
+        name = cfg.envelope_codec()
+    codec = _codecs.get((name or JSON).upper())
+    if codec is None:
+        raise ValueError("Unknown envelope codec: %s" % name)
+    return codec
+
+
+def detect(data):
+    """Codec that produced data (a single message or a batch frame)."""
+    first = bytearray(data[:1])[0] if data else 0
+    if first in (_SCHEMA_MESSAGE, _SCHEMA_BATCH):
+        return _codecs[SCHEMA]
+    if first in (0x7b, 0x5b, 0x20, 0x0a):  # { [ whitespace
+        return _codecs[JSON]
+    return _codecs[PACK]
+
+
+def decode(data):
+    return detect(data).decode(data)
+
+
+def decode_batch(data):
+    return detect(data).decode_batch(data)
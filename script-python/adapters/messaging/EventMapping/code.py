@@ -0,0 +1,103 @@
+"""
+EventMapping
+------------
+Domain event class -> ISA-95 envelope and broker topic.
+
+    registry = EventMapping.Registry()
+    registry.register(events.MaterialCreated, "MaterialDefinition", "SyncAdd",
+                      [("MaterialID", "material_id"), ("Name", "name")])
+    topic, envelope = registry.map(events.MaterialCreated(7, "Bolt"))
+    # "mes/MaterialDefinition", {"verb": "SyncAdd", "data": {"MaterialID": 7, ...}, ...}
+
+- A mapping is compiled on the first event of its class: its topic, the envelope
+  header values and one attribute getter for all data fields, so mapping an
+  event costs a dict lookup on its class and one getter call.
+- Topics come from MessagingConfig.event_topic_template() ("mes/{noun}"): all
+  verbs of a noun share a topic, so the events of one entity stay in order;
+  subscribers route on the envelope's verb (InboundDispatcher).
+- map() also accepts an envelope dict built elsewhere and returns its topic.
+- An event class without a mapping is sent as noun <class name>, verb
+  "Notify", with all its attributes; it is logged once so the gap gets noticed.
+"""
+
+import operator
+
+from common.logging.LogFactory import code as LogFactory
+from infrastructure import ISA95Config as isa95
+from infrastructure import MessagingConfig as cfg
+
+log = LogFactory.get_logger("EventMapping")
+
+UNMAPPED_VERB = "Notify"
+
+
+class Mapping(object):
+    def __init__(self, noun, verb, fields, topic, source, target, version):
+        self.noun = noun
+        self.verb = verb
+        self.topic = topic
+        self.source = source
+        self.target = target
+        self.version = version
+        self.event_type = "%s.%s" % (noun, verb)
+        self._names = tuple(name for name, _ in fields)
+        attributes = [attribute for _, attribute in fields]
+        if len(attributes) > 1:
+            self._values = operator.attrgetter(*attributes)
+        elif attributes:
+            getter = operator.attrgetter(attributes[0])
+            self._values = lambda event: (getter(event),)
+        else:
+            self._values = lambda event: ()
+
+    def data(self, event):
+        return dict(zip(self._names, self._values(event)))
+
+    def envelope(self, event):
+        return isa95.new_envelope(self.verb, self.noun, self.data(event), self.source, self.target, self.version)
+
+
+class _Unmapped(Mapping):
+    def data(self, event):
+        return dict(vars(event))
+
+
+class Registry(object):
+    def __init__(self, source="MES_Project", target="External", version="1.0", topic_template=None):
+        self.source = source
+        self.target = target
+        self.version = version
+        self.topic_template = topic_template
+        self._declared = {}  # {event class: (noun, verb, fields)}
+        self._mappings = {}  # {event class: Mapping}, compiled on first use
+
+    def topic(self, noun, verb):
+        if self.topic_template is None:
+            self.topic_template = cfg.event_topic_template()
+        return self.topic_template.format(noun=noun, verb=verb)
+
+    def register(self, event_class, noun, verb, fields):
+        """fields: [(data key, event attribute)] in the order they appear in the envelope."""
+        self._declared[event_class] = (noun, verb, list(fields))
+        self._mappings.pop(event_class, None)
+
+    def mapping_for(self, event_class):
+        mapping = self._mappings.get(event_class)
+        if mapping is None and event_class in self._declared:
+            noun, verb, fields = self._declared[event_class]
+            mapping = Mapping(noun, verb, fields, self.topic(noun, verb), self.source, self.target, self.version)
+            self._mappings[event_class] = mapping
+        elif mapping is None:
+            noun = event_class.__name__
+            log.warn("No envelope mapping for %s; publishing it as %s.%s" % (noun, noun, UNMAPPED_VERB))
+            mapping = _Unmapped(noun, UNMAPPED_VERB, [], self.topic(noun, UNMAPPED_VERB),
+                                self.source, self.target, self.version)
+            self._mappings[event_class] = mapping
+        return mapping
+
+    def map(self, event):
+        """(topic, envelope) for a domain event object or an envelope dict."""
+        if isinstance(event, dict):
+            return self.topic(event.get("noun", "event"), event.get("verb", UNMAPPED_VERB)), event
+        mapping = self.mapping_for(event.__class__)
+        return mapping.topic, mapping.envelope(event)
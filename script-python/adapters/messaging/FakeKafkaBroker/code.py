@@ -0,0 +1,170 @@
+"""
+FakeKafkaBroker
+---------------
+In-process stand-in for a Kafka cluster, for integration and throughput tests
+of KafkaAdapter without a network.
+
+    broker = FakeKafkaBroker.get("perf", partitions=6)
+    # MessagingConfig.kafka_options()["bootstrap_servers"] = "fake://perf"
+    records = broker.fetch("material", partition=0)
+
+- Topics are created on first produce with the broker's default partition
+  count; each partition is an append-only list of records with offsets.
+- produce() takes one compressed batch, as the producer sends it, and counts
+  the bytes received, so compression and batching show up in stats().
+- latency_ms delays every produce call; fail_next(n) makes the next n
+  produce calls raise, to exercise delivery callbacks and retries.
+"""
+
+import gzip
+import io
+import json
+import struct
+import threading
+import time
+
+NONE = "none"
+GZIP = "gzip"
+CODECS = (NONE, GZIP)
+
+_FRAME = struct.Struct(">II")  # key size, value size
+_NO_KEY = 0xffffffff
+
+
+class BrokerError(Exception):
+    pass
+
+
+class Record(object):
+    __slots__ = ("topic", "partition", "offset", "key", "value", "timestamp")
+
+    def __init__(self, topic, partition, offset, key, value, timestamp):
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+        self.key = key
+        self.value = value
+        self.timestamp = timestamp
+
+    def json(self):
+        return json.loads(self.value.decode("utf-8"))
+
+
+def encode_batch(records, codec=NONE):
+    """[(key, value bytes)] -> one length-prefixed frame, as sent by the in-process producer."""
+    out = bytearray()
+    for key, value in records:
+        raw_key = key.encode("utf-8") if key is not None else b""
+        out += _FRAME.pack(len(raw_key) if key is not None else _NO_KEY, len(value))
+        out += raw_key
+        out += value
+    data = bytes(out)
+    if codec == GZIP:
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=1) as stream:
+            stream.write(data)
+        return buffer.getvalue()
+    return data
+
+
+def decode_batch(data, codec=NONE):
+    if codec == GZIP:
+        with gzip.GzipFile(fileobj=io.BytesIO(data), mode="rb") as stream:
+            data = stream.read()
+    records = []
+    position = 0
+    while position < len(data):
+        key_size, value_size = _FRAME.unpack_from(data, position)
+        position += _FRAME.size
+        key = None
+        if key_size != _NO_KEY:
+            key = data[position:position + key_size].decode("utf-8")
+            position += key_size
+        records.append((key, data[position:position + value_size]))
+        position += value_size
+    return records
+
+
+class FakeKafkaBroker(object):
+    def __init__(self, partitions=3, latency_ms=0):
+        self.default_partitions = max(1, int(partitions))
+        self.latency = max(0.0, float(latency_ms) / 1000.0)
+        self._topics = {}  # {topic: [[Record], ...]}
+        self._lock = threading.Lock()
+        self._failures = []
+        self._stats = {"batches": 0, "records": 0, "bytes": 0, "errors": 0}
+
+    def create_topic(self, topic, partitions=None):
+        with self._lock:
+            if topic not in self._topics:
+                self._topics[topic] = [[] for _ in range(max(1, int(partitions or self.default_partitions)))]
+            return len(self._topics[topic])
+
+    def partitions(self, topic):
+        """Partition count of topic, creating it like auto.create.topics.enable."""
+        log = self._topics.get(topic)
+        return len(log) if log is not None else self.create_topic(topic)
+
+    def fail_next(self, count=1, error="broker unavailable"):
+        with self._lock:
+            self._failures.extend([error] * count)
+
+    def produce(self, topic, partition, data, codec=NONE):
+        """Append one batch; returns the offset of its first record."""
+        if self.latency:
+            time.sleep(self.latency)
+        records = decode_batch(data, codec)
+        now = time.time()
+        with self._lock:
+            if self._failures:
+                self._stats["errors"] += 1
+                raise BrokerError(self._failures.pop(0))
+            if topic not in self._topics:
+                self._topics[topic] = [[] for _ in range(self.default_partitions)]
+            log = self._topics[topic][partition]
+            base = len(log)
+            for i, (key, value) in enumerate(records):
+                log.append(Record(topic, partition, base + i, key, value, now))
+            self._stats["batches"] += 1
+            self._stats["records"] += len(records)
+            self._stats["bytes"] += len(data)
+        return base
+
+    def fetch(self, topic, partition=None, offset=0, max_records=None):
+        """Records of one partition from offset, or of every partition when partition is None."""
+        with self._lock:
+            logs = self._topics.get(topic) or []
+            if partition is not None:
+                logs = [logs[partition]] if partition < len(logs) else []
+            records = []
+            for log in logs:
+                records.extend(log[offset:])
+        return records[:max_records] if max_records else records
+
+    def end_offsets(self, topic):
+        with self._lock:
+            return [len(log) for log in self._topics.get(topic) or []]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def reset(self):
+        with self._lock:
+            self._topics.clear()
+            self._failures = []
+            self._stats = {"batches": 0, "records": 0, "bytes": 0, "errors": 0}
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get(name="default", **options):
+    """Broker registered under name (the host part of a fake:// address), created on first use."""
+    with _brokers_lock:
+        broker = _brokers.get(name)
+        if broker is None:
+            broker = FakeKafkaBroker(**options)
+            _brokers[name] = broker
+        return broker
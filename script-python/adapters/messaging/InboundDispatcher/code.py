@@ -0,0 +1,369 @@
+"""
+InboundDispatcher
+-----------------
+Applies inbound envelopes (MQTT / Kafka consumers, gateway message handlers)
+on worker threads, so the receiving thread only decodes and enqueues.
+
+    dispatcher = InboundDispatcher.Dispatcher("material-inbound", workers=4)
+    dispatcher.route(apply_add, noun="MaterialDefinition", verb="SyncAdd")
+    dispatcher.route(apply_any, noun="MaterialDefinition")
+    dispatcher.submit(envelope_or_bytes, topic)
+
+- Routes are looked up by exact topic, then (noun, verb), noun, verb and the
+  catch-all route; the answer is cached per (topic, noun, verb), so routing a
+  message is one dict lookup.
+- Each message gets a key (route key function, else the first key_fields
+  value on its "data" or the envelope). Messages of one key always go to the
+  same worker lane and are applied in arrival order; unkeyed messages are
+  spread round-robin.
+- Lanes have bounded queues. When a lane stays full for block_timeout the
+  message is dead-lettered (QUEUE_FULL) instead of blocking the caller.
+- A correlationId seen within the last dedupe_window messages is skipped as a
+  duplicate; it is forgotten again when its message fails, so a redelivery
+  can apply it.
+- A failing handler is retried in its lane up to max_attempts times (the
+  lane waits, so later messages of that key stay behind it); then the message
+  goes to the dead-letter buffer, which keeps the last dead_letter_size
+  entries for inspection and replay_dead_letters().
+- Envelopes from ignore_sources (our own outbound events on a shared broker)
+  and envelopes without a route are counted and dropped.
+"""
+
+import collections
+import threading
+import time
+
+try:  # Python 2 / Jython
+    import Queue as queue
+except ImportError:  # Python 3
+    import queue
+
+from adapters.messaging.EnvelopeCodec import code as envelope_codec
+from common.logging.LogFactory import code as LogFactory
+
+log = LogFactory.get_logger("InboundDispatcher")
+
+try:
+    text_types = (unicode,)  # type: ignore[name-defined]
+except NameError:  # pragma: no cover - Python 3
+    text_types = (str,)
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_QUEUE = 10000
+DEFAULT_BLOCK_TIMEOUT = 0.5
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_BACKOFF = 0.2
+DEFAULT_DEDUPE_WINDOW = 50000
+DEFAULT_DEAD_LETTER_SIZE = 1000
+
+QUEUE_FULL = "QUEUE_FULL"
+DECODE_ERROR = "DECODE_ERROR"
+HANDLER_ERROR = "HANDLER_ERROR"
+
+_RESOLVED_CACHE_SIZE = 1024
+_MISSING = object()
+_STOP = object()
+
+
+class Route(object):
+    __slots__ = ("handler", "key", "name")
+
+    def __init__(self, handler, key=None, name=None):
+        self.handler = handler
+        self.key = key
+        self.name = name or getattr(handler, "__name__", "handler")
+
+
+class Dispatcher(object):
+    def __init__(self, name="inbound", workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE,
+                 block_timeout=DEFAULT_BLOCK_TIMEOUT, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 retry_backoff_seconds=DEFAULT_RETRY_BACKOFF, dedupe_window=DEFAULT_DEDUPE_WINDOW,
+                 dead_letter_size=DEFAULT_DEAD_LETTER_SIZE, key_fields=(), ignore_sources=()):
+        self.name = name
+        self.block_timeout = block_timeout
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_backoff = max(0.0, float(retry_backoff_seconds))
+        self.dedupe_window = max(0, int(dedupe_window))
+        self.key_fields = tuple(key_fields or ())
+        self.ignore_sources = frozenset(ignore_sources or ())
+        workers = max(1, int(workers))
+        capacity = max(1, int(max_queue) // workers)
+        self._lanes = [queue.Queue(capacity) for _ in range(workers)]
+        self._threads = [None] * workers
+        self._next_lane = 0
+        self._routes = {}  # {("topic", topic) | (noun, verb): Route}; None is a wildcard
+        self._resolved = {}  # {(topic, noun, verb): Route or None}
+        self._seen = {}  # {correlationId: claim number}
+        self._seen_order = collections.deque()  # (correlationId, claim number), oldest first
+        self._claims = 0
+        self._dead_letters = collections.deque(maxlen=max(1, int(dead_letter_size)))
+        self._lock = threading.Condition(threading.Lock())
+        self._pending = 0
+        self._stats = {"received": 0, "processed": 0, "retried": 0, "duplicates": 0,
+                       "unrouted": 0, "ignored": 0, "dead_lettered": 0}
+
+    # ------------------------------------------------------------------
+    # Routing table
+    # ------------------------------------------------------------------
+    def route(self, handler, noun=None, verb=None, topic=None, key=None):
+        """Register handler(envelope); key(envelope) overrides the key_fields lookup."""
+        entry = Route(handler, key)
+        with self._lock:
+            if topic is not None:
+                self._routes[("topic", topic)] = entry
+            else:
+                self._routes[(noun, verb)] = entry
+            self._resolved = {}
+        return entry
+
+    def resolve(self, topic, noun, verb):
+        cache_key = (topic, noun, verb)
+        entry = self._resolved.get(cache_key, _MISSING)
+        if entry is _MISSING:
+            routes = self._routes
+            entry = routes.get(("topic", topic))
+            for candidate in ((noun, verb), (noun, None), (None, verb), (None, None)):
+                if entry is not None:
+                    break
+                entry = routes.get(candidate)
+            if len(self._resolved) >= _RESOLVED_CACHE_SIZE:
+                self._resolved = {}
+            self._resolved[cache_key] = entry
+        return entry
+
+    # ------------------------------------------------------------------
+    # Intake (caller thread)
+    # ------------------------------------------------------------------
+    def submit(self, message, topic=None):
+        """Queue one envelope (dict, JSON text or encoded bytes); True when it was queued."""
+        self._track(received=1)
+        try:
+            envelope = _decode(message)
+        except Exception as ex:
+            self._dead_letter(message, topic, DECODE_ERROR, ex, 0)
+            return False
+        if envelope.get("source") in self.ignore_sources:
+            self._track(ignored=1)
+            return False
+        entry = self.resolve(topic, envelope.get("noun"), envelope.get("verb"))
+        if entry is None:
+            self._track(unrouted=1)
+            log.debug("No inbound route for %s %s.%s" % (topic, envelope.get("noun"), envelope.get("verb")))
+            return False
+        correlation_id = envelope.get("correlationId")
+        claim = self._claim(correlation_id)
+        if claim is None:
+            self._track(duplicates=1)
+            return False
+        lane = self._lane_for(self._key(entry, envelope))
+        self._track(pending=1)
+        try:
+            self._lanes[lane].put((entry, envelope, topic, claim), True, self.block_timeout)
+        except queue.Full:
+            self._track(pending=-1)
+            self._release(correlation_id, claim)
+            self._dead_letter(envelope, topic, QUEUE_FULL, None, 0)
+            return False
+        self._ensure_started(lane)
+        return True
+
+    def submit_batch(self, data, topic=None):
+        """Queue every envelope of an EnvelopeCodec batch frame; returns how many were queued."""
+        try:
+            envelopes = envelope_codec.decode_batch(data)
+        except Exception as ex:
+            self._track(received=1)
+            self._dead_letter(data, topic, DECODE_ERROR, ex, 0)
+            return 0
+        return len([envelope for envelope in envelopes if self.submit(envelope, topic)])
+
+    def _key(self, entry, envelope):
+        if entry.key is not None:
+            return entry.key(envelope)
+        data = envelope.get("data")
+        for source in (data, envelope):
+            if not isinstance(source, dict):
+                continue
+            for field in self.key_fields:
+                value = source.get(field)
+                if value is not None and value != "":
+                    return value
+        return None
+
+    def _lane_for(self, key):
+        if key is None:
+            with self._lock:
+                self._next_lane = (self._next_lane + 1) % len(self._lanes)
+                return self._next_lane
+        return hash(str(key)) % len(self._lanes)
+
+    def _claim(self, correlation_id):
+        """Claim number for a new correlationId, None for a duplicate (0 when there is no id)."""
+        if not correlation_id or not self.dedupe_window:
+            return 0
+        with self._lock:
+            if correlation_id in self._seen:
+                return None
+            self._claims += 1
+            self._seen[correlation_id] = self._claims
+            self._seen_order.append((correlation_id, self._claims))
+            while len(self._seen_order) > self.dedupe_window:
+                old_id, old_claim = self._seen_order.popleft()
+                if self._seen.get(old_id) == old_claim:
+                    del self._seen[old_id]
+            return self._claims
+
+    def _release(self, correlation_id, claim):
+        if not claim:
+            return
+        with self._lock:
+            if self._seen.get(correlation_id) == claim:
+                del self._seen[correlation_id]
+
+    # ------------------------------------------------------------------
+    # Worker lanes
+    # ------------------------------------------------------------------
+    def _ensure_started(self, lane):
+        if self._threads[lane] is not None:
+            return
+        with self._lock:
+            if self._threads[lane] is None:
+                thread = threading.Thread(target=self._work, args=(lane,), name="%s-%d" % (self.name, lane + 1))
+                thread.daemon = True
+                thread.start()
+                self._threads[lane] = thread
+
+    def _work(self, lane):
+        lane_queue = self._lanes[lane]
+        while True:
+            item = lane_queue.get()
+            if item is _STOP:
+                return
+            entry, envelope, topic, claim = item
+            try:
+                self._apply(entry, envelope, topic, claim)
+            finally:
+                self._track(pending=-1)
+
+    def _apply(self, entry, envelope, topic, claim):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                entry.handler(envelope)
+                self._track(processed=1)
+                return
+            except Exception as ex:
+                if attempt >= self.max_attempts:
+                    self._release(envelope.get("correlationId"), claim)
+                    self._dead_letter(envelope, topic, HANDLER_ERROR, ex, attempt)
+                    return
+                self._track(retried=1)
+                log.warn("Inbound %s failed (attempt %d of %d): %s"
+                         % (entry.name, attempt, self.max_attempts, ex))
+                time.sleep(self.retry_backoff * attempt)
+
+    # ------------------------------------------------------------------
+    # Dead letters
+    # ------------------------------------------------------------------
+    def _dead_letter(self, message, topic, reason, error, attempts):
+        letter = {
+            "topic": topic,
+            "message": message,
+            "reason": reason,
+            "error": str(error) if error is not None else None,
+            "attempts": attempts,
+            "timestamp": time.time(),
+        }
+        with self._lock:
+            self._dead_letters.append(letter)
+            self._stats["dead_lettered"] += 1
+        log.error("Inbound message dead-lettered (%s) on %s: %s" % (reason, topic, letter["error"]))
+
+    def dead_letters(self, clear=False):
+        with self._lock:
+            letters = list(self._dead_letters)
+            if clear:
+                self._dead_letters.clear()
+        return letters
+
+    def replay_dead_letters(self):
+        """Resubmit and clear the dead-letter buffer; returns how many were queued again."""
+        return len([letter for letter in self.dead_letters(clear=True)
+                    if self.submit(letter["message"], letter["topic"])])
+
+    # ------------------------------------------------------------------
+    # Bookkeeping
+    # ------------------------------------------------------------------
+    def _track(self, pending=0, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                self._stats[name] += count
+            self._pending += pending
+            if self._pending <= 0:
+                self._lock.notify_all()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = self._pending
+            stats["dead_letter_buffer"] = len(self._dead_letters)
+        stats["queued"] = sum(lane.qsize() for lane in self._lanes)
+        return stats
+
+    def drain(self, timeout=None):
+        """Wait until every queued message was applied or dead-lettered."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while self._pending > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._lock.wait(remaining if remaining is not None else 1.0)
+        return True
+
+    def shutdown(self, timeout=None):
+        """Apply what is queued and stop the lanes; a later submit() starts them again."""
+        drained = self.drain(timeout)
+        with self._lock:
+            threads = [(lane, thread) for lane, thread in enumerate(self._threads) if thread is not None]
+            self._threads = [None] * len(self._lanes)
+        for lane, thread in threads:
+            self._lanes[lane].put(_STOP)
+            thread.join(timeout)
+        return drained
+
+
+def _decode(message):
+    if isinstance(message, dict):
+        return message
+    if isinstance(message, text_types):
+        message = message.encode("utf-8")
+    envelope = envelope_codec.decode(message)
+    if not isinstance(envelope, dict):
+        raise ValueError("Inbound message is not an envelope")
+    return envelope
+
+
+_dispatchers = {}
+_dispatchers_lock = threading.Lock()
+
+
+def shared(name, **options):
+    """Process-wide dispatcher registered under name, created on first use."""
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.get(name)
+        if dispatcher is None:
+            dispatcher = Dispatcher(name=name, **options)
+            _dispatchers[name] = dispatcher
+        return dispatcher
+
+
+def shutdown_all(timeout=10):
+    with _dispatchers_lock:
+        dispatchers = list(_dispatchers.values())
+        _dispatchers.clear()
+    drained = True
+    for dispatcher in dispatchers:
+        drained = dispatcher.shutdown(timeout) and drained
+    return drained
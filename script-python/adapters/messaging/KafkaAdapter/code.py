@@ -1,10 +1,270 @@
+"""
+KafkaAdapter
+------------
+Kafka producer behind MessageRouter.
+
+- publish() hands the message to the producer and returns at once; the
+  optional callback(metadata, error) runs when the broker acknowledges or
+  rejects it. publish_batch() sends a batch and waits for every
+  acknowledgement, so callers that mark messages delivered (the outbox relay)
+  only do so once the broker has them.
+- Values are encoded with the configured EnvelopeCodec (JSON by default);
+  router topics are sent with '/' replaced by '.'.
+- Messages are keyed by the first of kafka_options()["key_fields"] found on
+  the payload or its "data" (tenant, then equipment / machine / material), so
+  the events of one key land on one partition and stay in order.
+- On the gateway the Kafka Java client (kafka-clients jar in the gateway lib
+  folder) does the batching (linger_ms, batch_size) and compression.
+  bootstrap_servers "fake://<name>" uses FakeKafkaBroker through an in-process
+  producer that batches per partition and gzips each batch.
+- Without either, publishing raises MessagingException(code="KAFKA_UNAVAILABLE").
+"""
+
+import threading
+import time
+import zlib
+
+from adapters.messaging.AsyncPublisher import code as async_publisher
+from adapters.messaging.EnvelopeCodec import code as envelope_codec
+from adapters.messaging.FakeKafkaBroker import code as fake_broker
 from common.exceptions import MessagingException as mex
+from common.logging.LogFactory import code as LogFactory
+from infrastructure import MessagingConfig as cfg
 
-def publish(topic, payload):
-    try:
-        # If Kafka client jars available, integrate here.
-        # Fallback: simulate success to keep flows functional in default env.
-        _ = (topic, payload)
+log = LogFactory.get_logger("KafkaAdapter")
+
+FAKE_SCHEME = "fake://"
+
+_producer = None
+_lock = threading.Lock()
+_stats = {"sent": 0, "acked": 0, "failed": 0}
+
+
+class Delivery(object):
+    """Outcome of one send; wait() returns the record metadata or raises the broker error."""
+
+    def __init__(self, topic, callback=None):
+        self.topic = topic
+        self.callback = callback
+        self.metadata = None
+        self.error = None
+        self._done = threading.Event()
+
+    def complete(self, partition, offset, error=None):
+        if error is None:
+            self.metadata = {"topic": self.topic, "partition": partition, "offset": offset}
+            _track("acked")
+        else:
+            self.error = error
+            _track("failed")
+        self._done.set()
+        if self.callback is not None:
+            try:
+                self.callback(self.metadata, self.error)
+            except Exception as ex:
+                log.warn("Kafka delivery callback failed: %s" % ex)
+        elif error is not None:
+            log.error("Kafka delivery to %s failed: %s" % (self.topic, error))
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout) and not self._done.is_set():
+            raise mex.MessagingException("Kafka delivery to %s timed out" % self.topic, code="KAFKA_TIMEOUT")
+        if self.error is not None:
+            raise mex.MessagingException("Kafka delivery failed: %s" % self.error, code="KAFKA_ERROR")
+        return self.metadata
+
+
+def _track(name, count=1):
+    with _lock:
+        _stats[name] += count
+
+
+def partition_for(key, partitions):
+    return (zlib.crc32(key.encode("utf-8")) & 0x7fffffff) % partitions
+
+
+def message_key(payload, fields=None):
+    """Partition key: the first key field set on payload, then on payload["data"]."""
+    if fields is None:
+        fields = cfg.kafka_options().get("key_fields") or ()
+    sources = [payload]
+    if isinstance(payload, dict) and isinstance(payload.get("data"), dict):
+        sources.append(payload["data"])
+    for source in sources:
+        if not isinstance(source, dict):
+            continue
+        for field in fields:
+            value = source.get(field)
+            if value is not None and value != "":
+                return str(value)
+    return None
+
+
+class _InProcessProducer(object):
+    """Per-partition batching and gzip for FakeKafkaBroker."""
+
+    def __init__(self, broker, options):
+        self.broker = broker
+        compression = (options.get("compression") or fake_broker.NONE).lower()
+        self.codec = fake_broker.NONE if compression == fake_broker.NONE else fake_broker.GZIP
+        self._next = {}  # {topic: round-robin partition for unkeyed messages}
+        self._publisher = async_publisher.AsyncPublisher(
+            self._send_batch,
+            name="kafka-producer",
+            max_queue=options.get("max_queue", async_publisher.DEFAULT_MAX_QUEUE),
+            batch_size=options.get("batch_records", async_publisher.DEFAULT_BATCH_SIZE),
+            linger_ms=options.get("linger_ms", async_publisher.DEFAULT_LINGER_MS),
+            senders=options.get("senders", async_publisher.DEFAULT_SENDERS),
+            block_timeout=options.get("block_timeout", async_publisher.DEFAULT_BLOCK_TIMEOUT),
+        )
+
+    def send(self, topic, key, value, delivery):
+        partitions = self.broker.partitions(topic)
+        if key is None:
+            partition = self._next.get(topic, 0) % partitions
+            self._next[topic] = partition + 1
+        else:
+            partition = partition_for(key, partitions)
+        self._publisher.publish((topic, partition), (key, value, delivery))
+
+    def _send_batch(self, topic_partition, items):
+        topic, partition = topic_partition
+        data = fake_broker.encode_batch([(key, value) for key, value, _ in items], self.codec)
+        try:
+            base = self.broker.produce(topic, partition, data, self.codec)
+        except Exception as ex:
+            for _, _, delivery in items:
+                delivery.complete(partition, None, ex)
+            raise
+        for i, (_, _, delivery) in enumerate(items):
+            delivery.complete(partition, base + i)
+        return True
+
+    def flush(self, timeout=None):
+        return self._publisher.flush(timeout)
+
+    def close(self, timeout=None):
+        return self._publisher.shutdown(timeout)
+
+
+class _JavaProducer(object):
+    """org.apache.kafka KafkaProducer; batching and compression happen in the client."""
+
+    def __init__(self, options):
+        from java.util import Properties
+        from org.apache.kafka.clients.producer import Callback, KafkaProducer, ProducerRecord
+        from org.python.core.util import StringUtil
+
+        props = Properties()
+        props.put("bootstrap.servers", options["bootstrap_servers"])
+        props.put("client.id", options.get("client_id") or "ignition-mes")
+        props.put("acks", str(options.get("acks", "all")))
+        props.put("linger.ms", str(int(options.get("linger_ms", 20))))
+        props.put("batch.size", str(int(options.get("batch_size", 65536))))
+        props.put("compression.type", options.get("compression") or "none")
+        props.put("key.serializer", "org.apache.kafka.common.serialization.StringSerializer")
+        props.put("value.serializer", "org.apache.kafka.common.serialization.ByteArraySerializer")
+        self._producer = KafkaProducer(props)
+        self._record = ProducerRecord
+        self._to_bytes = StringUtil.toBytes
+
+        class _Callback(Callback):
+            def __init__(self, delivery):
+                self.delivery = delivery
+
+            def onCompletion(self, metadata, exception):
+                if exception is not None:
+                    self.delivery.complete(None, None, exception)
+                else:
+                    self.delivery.complete(metadata.partition(), metadata.offset())
+
+        self._callback = _Callback
+
+    def send(self, topic, key, value, delivery):
+        self._producer.send(self._record(topic, key, self._to_bytes(value)), self._callback(delivery))
+
+    def flush(self, timeout=None):
+        self._producer.flush()
+        return True
+
+    def close(self, timeout=None):
+        self._producer.close()
         return True
+
+
+def _create(options):
+    servers = options.get("bootstrap_servers") or ""
+    if servers.startswith(FAKE_SCHEME):
+        broker = fake_broker.get(servers[len(FAKE_SCHEME):] or "default")
+        return _InProcessProducer(broker, options)
+    try:
+        return _JavaProducer(options)
+    except ImportError:
+        raise mex.MessagingException("Kafka client is not available on this gateway", code="KAFKA_UNAVAILABLE")
+
+
+def _get_producer():
+    global _producer
+    if _producer is None:
+        with _lock:
+            if _producer is None:
+                _producer = _create(cfg.kafka_options())
+    return _producer
+
+
+def topic_name(topic):
+    """Kafka topic for a router topic; Kafka names allow [a-zA-Z0-9._-] only."""
+    return topic.replace("/", ".")
+
+
+def send(topic, payload, key=None, callback=None, value=None):
+    """Queue payload for topic (value: payload already encoded); returns its Delivery."""
+    topic = topic_name(topic)
+    delivery = Delivery(topic, callback)
+    if key is None:
+        key = message_key(payload)
+    try:
+        if value is None:
+            value = envelope_codec.get().encode(payload)
+        _get_producer().send(topic, key, value, delivery)
+    except mex.MessagingException:
+        raise
     except Exception as ex:
         raise mex.MessagingException("Kafka publish failed: %s" % str(ex), code="KAFKA_ERROR")
+    _track("sent")
+    return delivery
+
+
+def publish(topic, payload, key=None, callback=None):
+    send(topic, payload, key, callback)
+    return True
+
+
+def publish_batch(topic, payloads, timeout=None):
+    """Send payloads and wait until the broker acknowledged all of them."""
+    if timeout is None:
+        timeout = cfg.kafka_options().get("delivery_timeout_seconds", 30)
+    deadline = time.time() + timeout
+    values = envelope_codec.get().encode_many(payloads)
+    deliveries = [send(topic, payload, value=value) for payload, value in zip(payloads, values)]
+    _get_producer().flush(timeout)
+    for delivery in deliveries:
+        delivery.wait(max(0.0, deadline - time.time()))
+    return True
+
+
+def flush(timeout=None):
+    return _producer.flush(timeout) if _producer is not None else True
+
+
+def close(timeout=10):
+    """Flush and close the producer; the next publish opens a new one (config reload, shutdown)."""
+    global _producer
+    with _lock:
+        producer, _producer = _producer, None
+    return producer.close(timeout) if producer is not None else True
+
+
+def stats():
+    with _lock:
+        return dict(_stats)
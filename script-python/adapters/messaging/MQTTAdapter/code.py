@@ -1,11 +1,439 @@
+"""
+MQTTAdapter
+-----------
+Persistent-connection MQTT publisher behind MessageRouter.
+
+- One connection per gateway, opened on first publish and reused. QoS 1
+  messages stay in an in-flight window (window messages awaiting PUBACK);
+  a full window makes publish wait up to block_timeout, then raise.
+- When the connection drops, or a PUBACK is overdue by ack_timeout, the
+  publisher reconnects with the same client id and clean_start=False, so the
+  broker resumes the session (kept for session_expiry_seconds after a drop),
+  and resends the unacknowledged messages in their original order. paho
+  numbers packets per client, so a resend is a new PUBLISH rather than a DUP
+  of the old packet id; consumers drop the repeat by its correlationId.
+- Topic aliases (MQTT v5) replace repeated topic names with a small integer,
+  up to the broker's topic_alias_maximum; they are reset on every connect.
+- Payloads use the configured EnvelopeCodec (JSON by default), or the
+  compact MetricPayload binary for topics matching binary_topic_prefixes
+  (high-frequency plant events).
+- url picks the connection: "tcp://host:port" (paho-mqtt, MQTT v5),
+  "engine://<server>" (Cirrus Link MQTT Engine, which keeps its own
+  connection; no aliases) or "loopback://<name>" (MQTTLoopback, for tests).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from adapters.messaging.EnvelopeCodec import code as envelope_codec
+from adapters.messaging.MetricPayload import code as metric_payload
+from adapters.messaging.MQTTLoopback import code as loopback
 from common.exceptions import MessagingException as mex
+from common.logging.LogFactory import code as LogFactory
+from infrastructure import MessagingConfig as cfg
+
+log = LogFactory.get_logger("MQTTAdapter")
+
+JSON = "JSON"
+BINARY = "BINARY"
+
+MAX_PACKET_ID = 65535
+
+
+class ConnectionLost(Exception):
+    pass
+
+
+class Publisher(object):
+    def __init__(self, connection_factory, window=32, ack_timeout=10.0, reconnect_attempts=5,
+                 reconnect_backoff=0.5, block_timeout=5.0):
+        self.window = max(1, int(window))
+        self.ack_timeout = ack_timeout
+        self.reconnect_attempts = max(1, int(reconnect_attempts))
+        self.reconnect_backoff = reconnect_backoff
+        self.block_timeout = block_timeout
+        self._connection = connection_factory(self._on_ack, self._on_lost)
+        self._send_lock = threading.RLock()  # one writer; packet ids go out in order
+        self._cond = threading.Condition(threading.Lock())
+        self._inflight = OrderedDict()  # {packet_id: [topic, data, retain, sent_at]}
+        self._next_id = 0
+        self._connected = False
+        self._aliases = {}
+        self._alias_max = 0
+        self._stats = {"published": 0, "acked": 0, "resent": 0, "dropped": 0, "connects": 0, "resumed": 0}
+
+    # ------------------------------------------------------------------
+    # Publishing
+    # ------------------------------------------------------------------
+    def publish(self, topic, data, qos=1, retain=False):
+        with self._send_lock:
+            if not self._connected:
+                self._reconnect()
+            if not qos:
+                try:
+                    self._send(None, topic, data, 0, retain)
+                except Exception as ex:
+                    self._lost(ex)
+                    self._track("dropped")  # at most once
+                    return False
+                self._track("published")
+                return True
+            packet_id = self._reserve(topic, data, retain)
+            try:
+                self._send(packet_id, topic, data, 1, retain)
+            except Exception as ex:
+                self._lost(ex)
+                self._reconnect()  # resends packet_id with the rest of the window
+            self._track("published")
+            return True
+
+    def _reserve(self, topic, data, retain):
+        deadline = time.time() + self.block_timeout
+        while True:
+            with self._cond:
+                if len(self._inflight) < self.window:
+                    packet_id = self._allocate()
+                    self._inflight[packet_id] = [topic, data, retain, time.time()]
+                    return packet_id
+                if self._connected and not self._overdue():
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise mex.MessagingException(
+                            "MQTT in-flight window full (%s awaiting PUBACK)" % len(self._inflight),
+                            code="MQTT_WINDOW_FULL",
+                        )
+                    self._cond.wait(min(remaining, 0.5))
+                    continue
+            self._lost("PUBACK overdue" if self._connected else "connection lost")
+            self._reconnect()
+
+    def _allocate(self):
+        while True:
+            self._next_id = self._next_id % MAX_PACKET_ID + 1
+            if self._next_id not in self._inflight:
+                return self._next_id
+
+    def _overdue(self):
+        if not self._inflight or not self.ack_timeout:
+            return False
+        oldest = next(iter(self._inflight.values()))
+        return time.time() - oldest[3] > self.ack_timeout
+
+    def _send(self, packet_id, topic, data, qos, retain):
+        alias, name = None, topic
+        if self._alias_max:
+            alias = self._aliases.get(topic)
+            if alias is not None:
+                name = ""
+            elif len(self._aliases) < self._alias_max:
+                alias = self._aliases[topic] = len(self._aliases) + 1
+        self._connection.publish(packet_id, name, alias, data, qos, retain)
+
+    # ------------------------------------------------------------------
+    # Connection
+    # ------------------------------------------------------------------
+    def _reconnect(self):
+        """(Re)connect with session resume and resend the window; raises MQTT_UNAVAILABLE."""
+        with self._send_lock:
+            last = None
+            for attempt in range(self.reconnect_attempts):
+                if attempt:
+                    time.sleep(self.reconnect_backoff * (2 ** (attempt - 1)))
+                try:
+                    info = self._connection.connect(clean_start=False)
+                    with self._cond:
+                        self._connected = True
+                        self._aliases = {}
+                        self._alias_max = int(info.get("topic_alias_maximum") or 0)
+                        pending = [(pid, entry) for pid, entry in self._inflight.items()]
+                    self._track("connects")
+                    if info.get("session_present"):
+                        self._track("resumed")
+                    for packet_id, entry in pending:
+                        entry[3] = time.time()
+                        self._send(packet_id, entry[0], entry[1], 1, entry[2])
+                        self._track("resent")
+                    return True
+                except Exception as ex:
+                    last = ex
+                    self._lost(ex)
+            raise mex.MessagingException("MQTT broker unreachable: %s" % last, code="MQTT_UNAVAILABLE")
+
+    def _lost(self, reason):
+        with self._cond:
+            was_connected, self._connected = self._connected, False
+            self._cond.notify_all()
+        if was_connected:
+            log.warn("MQTT connection lost: %s" % reason)
+
+    def _on_lost(self, reason):
+        self._lost(reason)
+
+    def _on_ack(self, packet_id):
+        with self._cond:
+            if self._inflight.pop(packet_id, None) is None:
+                return  # ack for a resent duplicate
+            self._stats["acked"] += 1
+            self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # Control
+    # ------------------------------------------------------------------
+    def flush(self, timeout=None):
+        """Wait until every QoS 1 message is acknowledged; False on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._cond:
+                if not self._inflight:
+                    return True
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                healthy = self._connected and not self._overdue()
+                if healthy:
+                    self._cond.wait(min(remaining, 0.5) if remaining is not None else 0.5)
+                    continue
+            self._lost("PUBACK overdue")
+            try:
+                self._reconnect()
+            except mex.MessagingException as ex:
+                log.error("MQTT flush could not reconnect: %s" % ex)
+                return False
+
+    def close(self, timeout=None):
+        drained = self.flush(timeout)
+        with self._send_lock:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._lost("closed")
+        return drained
+
+    def _track(self, name):
+        with self._cond:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["inflight"] = len(self._inflight)
+            stats["connected"] = self._connected
+            stats["aliases"] = len(self._aliases)
+        return stats
+
+
+class _PahoConnection(object):
+    """paho-mqtt client, MQTT v5; a new client per connect so resends stay with the Publisher."""
+
+    def __init__(self, host, port, client_id, keepalive, connect_timeout, session_expiry, on_ack, on_lost):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.session_expiry = session_expiry
+        self.on_ack = on_ack
+        self.on_lost = on_lost
+        self._client = None
+        self._lock = threading.Lock()
+        self._mids = {}
+        self._early = set()
+
+    def connect(self, clean_start=False):
+        import paho.mqtt.client as paho
+        from paho.mqtt.packettypes import PacketTypes
+        from paho.mqtt.properties import Properties
+
+        self.close()
+        if hasattr(paho, "CallbackAPIVersion"):  # paho-mqtt 2.x
+            client = paho.Client(paho.CallbackAPIVersion.VERSION1, client_id=self.client_id, protocol=paho.MQTTv5)
+        else:
+            client = paho.Client(client_id=self.client_id, protocol=paho.MQTTv5)
+        connected = threading.Event()
+        info = {}
+
+        def on_connect(client, userdata, flags, rc, properties=None):
+            info["session_present"] = bool(flags.get("session present"))
+            info["topic_alias_maximum"] = getattr(properties, "TopicAliasMaximum", 0) if properties else 0
+            info["rc"] = rc
+            connected.set()
+
+        def on_disconnect(client, userdata, rc, properties=None):
+            client.loop_stop()  # the Publisher reconnects with a fresh client
+            if self._client is client:
+                self.on_lost("disconnected (rc=%s)" % rc)
+
+        client.on_connect = on_connect
+        client.on_disconnect = on_disconnect
+        client.on_publish = self._on_publish
+        with self._lock:
+            self._mids = {}
+            self._early = set()
+        self._client = client
+        # MQTT v5 ends the session with the connection unless an expiry is sent
+        properties = Properties(PacketTypes.CONNECT)
+        properties.SessionExpiryInterval = int(self.session_expiry)
+        client.connect(self.host, self.port, self.keepalive, clean_start=clean_start, properties=properties)
+        client.loop_start()
+        if not connected.wait(self.connect_timeout) or info.get("rc"):
+            self.close()
+            raise ConnectionLost("MQTT connect to %s:%s failed (%s)" % (self.host, self.port, info.get("rc")))
+        return info
 
-def publish(topic, payload):
+    def publish(self, packet_id, topic, alias, payload, qos=1, retain=False):
+        client = self._client
+        if client is None:
+            raise ConnectionLost("not connected")
+        properties = None
+        if alias:
+            from paho.mqtt.packettypes import PacketTypes
+            from paho.mqtt.properties import Properties
+
+            properties = Properties(PacketTypes.PUBLISH)
+            properties.TopicAlias = alias
+        with self._lock:
+            result = client.publish(topic, payload, qos, retain, properties)
+            if result.rc != 0:
+                raise ConnectionLost("publish rejected (rc=%s)" % result.rc)
+            if qos:
+                if result.mid in self._early:
+                    self._early.discard(result.mid)
+                    acked = True
+                else:
+                    self._mids[result.mid] = packet_id
+                    acked = False
+        if qos and acked:
+            self.on_ack(packet_id)
+
+    def _on_publish(self, client, userdata, mid):
+        with self._lock:
+            packet_id = self._mids.pop(mid, None)
+            if packet_id is None:
+                self._early.add(mid)
+                return
+        self.on_ack(packet_id)
+
+    def close(self):
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                client.disconnect()
+                client.loop_stop()
+            except Exception:
+                pass
+
+
+class _EngineConnection(object):
+    """Cirrus Link MQTT Engine server; the module owns the broker connection."""
+
+    def __init__(self, server, on_ack, on_lost):
+        self.server = server
+        self.on_ack = on_ack
+        self.on_lost = on_lost
+
+    def connect(self, clean_start=False):
+        import system.cirruslink.engine  # noqa: F401 - fails outside a gateway with the module
+
+        return {"session_present": True, "topic_alias_maximum": 0}
+
+    def publish(self, packet_id, topic, alias, payload, qos=1, retain=False):
+        import system.cirruslink.engine
+
+        try:
+            system.cirruslink.engine.publish(self.server, topic, payload, qos, retain)
+        except Exception as ex:
+            raise ConnectionLost(str(ex))
+        if qos:
+            self.on_ack(packet_id)
+
+    def close(self):
+        pass
+
+
+def _connection_factory(options):
+    url = options.get("url") or ""
+    scheme, _, rest = url.partition("://")
+    client_id = options.get("client_id") or "ignition-mes"
+    if scheme == "loopback":
+        broker = loopback.get(rest or "default")
+        return lambda on_ack, on_lost: broker.connection(client_id, on_ack, on_lost)
+    if scheme == "engine":
+        return lambda on_ack, on_lost: _EngineConnection(rest, on_ack, on_lost)
+    host, _, port = rest.partition(":")
+    return lambda on_ack, on_lost: _PahoConnection(
+        host, int(port or 1883), client_id, options.get("keepalive_seconds", 30),
+        options.get("connect_timeout_seconds", 10), options.get("session_expiry_seconds", 3600), on_ack, on_lost,
+    )
+
+
+_publisher = None
+_lock = threading.Lock()
+_seq = {}  # {topic: last MetricPayload sequence number}
+
+
+def _get_publisher():
+    global _publisher
+    if _publisher is None:
+        with _lock:
+            if _publisher is None:
+                options = cfg.mqtt_options()
+                _publisher = Publisher(
+                    _connection_factory(options),
+                    window=options.get("window", 32),
+                    ack_timeout=options.get("ack_timeout_seconds", 10),
+                    reconnect_attempts=options.get("reconnect_attempts", 5),
+                    reconnect_backoff=options.get("reconnect_backoff_seconds", 0.5),
+                    block_timeout=options.get("block_timeout", 5.0),
+                )
+    return _publisher
+
+
+def payload_format(topic):
+    prefixes = cfg.mqtt_options().get("binary_topic_prefixes") or ()
+    return BINARY if any(topic.startswith(prefix) for prefix in prefixes) else JSON
+
+
+def encode(topic, payload, fmt=None):
+    if (fmt or payload_format(topic)) == BINARY:
+        with _lock:
+            seq = _seq[topic] = (_seq.get(topic, -1) + 1) % 256
+        return metric_payload.encode(payload, seq=seq, aliases=cfg.mqtt_options().get("metric_aliases"))
+    return envelope_codec.get().encode(payload)
+
+
+def publish(topic, payload, qos=None, retain=False, fmt=None):
+    if qos is None:
+        qos = cfg.mqtt_options().get("qos", 1)
     try:
-        # Example if Cirrus Link MQTT modules installed:
-        # system.cirruslink.engine.publish("myEngine", topic, json.dumps(payload), 0, False)
-        # To keep functional without module, we just return True (simulated publish)
-        _ = (topic, payload)
-        return True
+        return _get_publisher().publish(topic, encode(topic, payload, fmt), qos, retain)
+    except mex.MessagingException:
+        raise
     except Exception as ex:
         raise mex.MessagingException("MQTT publish failed: %s" % str(ex), code="MQTT_ERROR")
+
+
+def publish_batch(topic, payloads, timeout=None):
+    """Publish payloads and wait for their PUBACKs; False when some are still unacknowledged."""
+    for payload in payloads:
+        publish(topic, payload)
+    if timeout is None:
+        timeout = cfg.mqtt_options().get("ack_timeout_seconds", 10)
+    return _get_publisher().flush(timeout)
+
+
+def flush(timeout=None):
+    return _publisher.flush(timeout) if _publisher is not None else True
+
+
+def close(timeout=10):
+    """Flush and disconnect; the next publish connects again (config reload, shutdown)."""
+    global _publisher
+    with _lock:
+        publisher, _publisher = _publisher, None
+    return publisher.close(timeout) if publisher is not None else True
+
+
+def stats():
+    return _publisher.stats() if _publisher is not None else {}
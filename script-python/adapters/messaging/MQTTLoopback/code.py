@@ -0,0 +1,183 @@
+"""
+MQTTLoopback
+------------
+In-process MQTT v5 broker for testing MQTTAdapter without a real broker.
+
+    broker = MQTTLoopback.get("test", topic_alias_maximum=8)
+    # MessagingConfig.mqtt_options()["url"] = "loopback://test"
+    broker.drop("ignition-mes")          # connection lost; publisher resumes
+    broker.messages("plant/line1")
+
+- Sessions are kept per client id: a connect with clean_start=False finds its
+  session again and reports session_present, as a persistent session would.
+- Topic aliases are per connection, up to topic_alias_maximum; an unknown
+  alias drops the connection, like a protocol error on a real broker.
+- QoS 1 publishes are acknowledged inline, or held while hold_acks() is on
+  (a slow broker) until release_acks().
+- A QoS 1 packet id received but not yet acknowledged (its PUBACK was held
+  or lost with the connection) is recorded as a duplicate (Message.dup) when
+  it arrives again.
+"""
+
+import threading
+
+
+class ConnectionLost(Exception):
+    pass
+
+
+class Message(object):
+    __slots__ = ("client_id", "packet_id", "topic", "payload", "qos", "retain", "dup")
+
+    def __init__(self, client_id, packet_id, topic, payload, qos, retain, dup):
+        self.client_id = client_id
+        self.packet_id = packet_id
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.dup = dup
+
+
+class LoopbackConnection(object):
+    def __init__(self, broker, client_id, on_ack, on_lost):
+        self.broker = broker
+        self.client_id = client_id
+        self.on_ack = on_ack
+        self.on_lost = on_lost
+        self.aliases = {}
+        self.open = False
+
+    def connect(self, clean_start=False):
+        return self.broker._connect(self, clean_start)
+
+    def publish(self, packet_id, topic, alias, payload, qos=1, retain=False):
+        if not self.open:
+            raise ConnectionLost("connection to loopback broker is closed")
+        self.broker._publish(self, packet_id, topic, alias, payload, qos, retain)
+
+    def close(self):
+        self.broker._disconnect(self, notify=False)
+
+
+class LoopbackBroker(object):
+    def __init__(self, topic_alias_maximum=16):
+        self.topic_alias_maximum = topic_alias_maximum
+        self._lock = threading.RLock()
+        self._sessions = {}  # {client_id: set(packet ids received and not acknowledged)}
+        self._connections = {}
+        self._messages = []
+        self._retained = {}
+        self._held = []
+        self._holding = False
+        self._stats = {"connects": 0, "resumed": 0, "received": 0, "duplicates": 0, "bytes": 0, "aliased": 0}
+
+    def connection(self, client_id, on_ack, on_lost):
+        return LoopbackConnection(self, client_id, on_ack, on_lost)
+
+    def _connect(self, connection, clean_start):
+        with self._lock:
+            previous = self._connections.get(connection.client_id)
+            if previous is not None and previous is not connection:
+                self._disconnect(previous)  # session takeover
+            present = connection.client_id in self._sessions and not clean_start
+            if not present:
+                self._sessions[connection.client_id] = set()
+            connection.aliases = {}
+            connection.open = True
+            self._connections[connection.client_id] = connection
+            self._stats["connects"] += 1
+            self._stats["resumed"] += int(present)
+        return {"session_present": present, "topic_alias_maximum": self.topic_alias_maximum}
+
+    def _publish(self, connection, packet_id, topic, alias, payload, qos, retain):
+        with self._lock:
+            if alias:
+                if alias > self.topic_alias_maximum:
+                    self._disconnect(connection)
+                    raise ConnectionLost("topic alias %s above maximum" % alias)
+                if topic:
+                    connection.aliases[alias] = topic
+                else:
+                    topic = connection.aliases.get(alias)
+                    if topic is None:
+                        self._disconnect(connection)
+                        raise ConnectionLost("unknown topic alias %s" % alias)
+                    self._stats["aliased"] += 1
+            received = self._sessions[connection.client_id]
+            dup = bool(qos) and packet_id in received
+            if dup:
+                self._stats["duplicates"] += 1
+            if qos:
+                received.add(packet_id)
+            message = Message(connection.client_id, packet_id, topic, payload, qos, retain, dup)
+            self._messages.append(message)
+            if retain:
+                self._retained[topic] = message
+            self._stats["received"] += 1
+            self._stats["bytes"] += len(payload)
+            if qos and self._holding:
+                self._held.append((connection, packet_id))
+                return
+            if qos:
+                received.discard(packet_id)
+        if qos:
+            connection.on_ack(packet_id)
+
+    def _disconnect(self, connection, notify=True):
+        with self._lock:
+            if not connection.open:
+                return
+            connection.open = False
+            if self._connections.get(connection.client_id) is connection:
+                del self._connections[connection.client_id]
+            self._held = [(c, p) for c, p in self._held if c is not connection]  # acks lost with the connection
+        if notify and connection.on_lost is not None:
+            connection.on_lost("disconnected by broker")
+
+    def drop(self, client_id):
+        """Close the client's connection from the broker side; its session stays."""
+        connection = self._connections.get(client_id)
+        if connection is not None:
+            self._disconnect(connection)
+
+    def hold_acks(self, hold=True):
+        with self._lock:
+            self._holding = hold
+
+    def release_acks(self):
+        with self._lock:
+            held, self._held = self._held, []
+            self._holding = False
+            for connection, packet_id in held:
+                self._sessions.get(connection.client_id, set()).discard(packet_id)
+        for connection, packet_id in held:
+            connection.on_ack(packet_id)
+        return len(held)
+
+    def messages(self, topic=None):
+        with self._lock:
+            return [m for m in self._messages if topic is None or m.topic == topic]
+
+    def retained(self, topic):
+        return self._retained.get(topic)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["held"] = len(self._held)
+            return stats
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get(name="default", **options):
+    """Broker registered under name (the host part of a loopback:// url), created on first use."""
+    with _brokers_lock:
+        broker = _brokers.get(name)
+        if broker is None:
+            broker = LoopbackBroker(**options)
+            _brokers[name] = broker
+        return broker
@@ -1,13 +1,44 @@
 from infrastructure import MessagingConfig as cfg
+from infrastructure.ConfigService import code as config
 from adapters.messaging import MQTTAdapter as mqtt
 from adapters.messaging import KafkaAdapter as kafka
 from adapters.messaging import InternalBusAdapter as internal
+from adapters.messaging.ChangeFeed import code as feed
+from adapters.messaging.InboundDispatcher import code as inbound
 
-def publish(topic, payload):
-    b = cfg.backend().upper()
+
+def _backend():
+    # Served from memory; ConfigService reloads it on tag change
+    return config.get("messaging.backend")
+
+
+def _adapter():
+    b = _backend()
     if b == "MQTT":
-        return mqtt.publish(topic, payload)
+        return mqtt
     elif b == "KAFKA":
-        return kafka.publish(topic, payload)
+        return kafka
     else:
-        return internal.publish(topic, payload)
+        return internal
+
+
+def publish(topic, payload):
+    return _adapter().publish(topic, payload)
+
+
+def publish_batch(topic, payloads):
+    adapter = _adapter()
+    if hasattr(adapter, "publish_batch"):
+        return adapter.publish_batch(topic, payloads)
+    result = True
+    for payload in payloads:
+        result = adapter.publish(topic, payload) and result
+    return result
+
+
+def shutdown(timeout=10):
+    # Call from the gateway shutdown script so queued events are not lost
+    drained = inbound.shutdown_all(timeout)
+    drained = kafka.close(timeout) and drained
+    drained = mqtt.close(timeout) and drained
+    return feed.shutdown(timeout) and drained
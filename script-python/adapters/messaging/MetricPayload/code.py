@@ -0,0 +1,161 @@
+"""
+MetricPayload
+-------------
+Compact binary payload for high-frequency plant events, modelled on Sparkplug:
+a timestamp, a sequence number and a list of typed metrics.
+
+    data = encode({"machine_id": 12, "state": "RUN", "counts": {"good": 40}}, seq=7)
+    decode(data)
+    # {"timestamp": ..., "seq": 7, "metrics": {"machine_id": 12, "state": "RUN", "counts/good": 40}}
+
+- Nested dicts are flattened into "a/b" metric names; a payload with a
+  "metrics" dict encodes that dict and takes timestamp / seq from the payload.
+- Metric names in aliases ({name: int}, agreed with the subscriber like a
+  Sparkplug birth certificate) are sent as small integers instead of text.
+- Integers are zigzag varints, floats 8 bytes, strings length-prefixed UTF-8;
+  lists and other values are sent as JSON text.
+
+Layout: version byte, timestamp ms (8 bytes), seq byte, metric count
+(varint), then per metric: name or alias (varint, low bit set for an alias),
+type byte, value.
+"""
+
+import json
+import struct
+import time
+
+VERSION = 1
+
+T_NULL = 0
+T_FALSE = 1
+T_TRUE = 2
+T_INT = 3
+T_FLOAT = 4
+T_STRING = 5
+T_JSON = 6
+
+_INT64 = 1 << 63
+_HEADER = struct.Struct(">BQB")
+_DOUBLE = struct.Struct(">d")
+_RESERVED = ("timestamp", "seq")
+
+try:
+    _INTEGER_TYPES = (int, long)  # type: ignore[name-defined]
+except NameError:  # pragma: no cover - Python 3
+    _INTEGER_TYPES = (int,)
+
+
+def _varint(value, out):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, position):
+    shift = result = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def _text(value, out):
+    raw = value.encode("utf-8") if not isinstance(value, bytes) else value
+    _varint(len(raw), out)
+    out.extend(raw)
+
+
+def flatten(values, prefix="", into=None):
+    into = {} if into is None else into
+    for name, value in values.items():
+        path = "%s/%s" % (prefix, name) if prefix else str(name)
+        if isinstance(value, dict):
+            flatten(value, path, into)
+        else:
+            into[path] = value
+    return into
+
+
+def encode(payload, seq=0, timestamp=None, aliases=None):
+    if isinstance(payload, dict) and isinstance(payload.get("metrics"), dict):
+        metrics = flatten(payload["metrics"])
+    else:
+        metrics = flatten(dict((k, v) for k, v in (payload or {}).items() if k not in _RESERVED))
+    if timestamp is None:
+        timestamp = payload.get("timestamp") if isinstance(payload, dict) else None
+    if not isinstance(timestamp, (float,) + _INTEGER_TYPES):
+        timestamp = time.time()
+    if isinstance(payload, dict) and isinstance(payload.get("seq"), _INTEGER_TYPES):
+        seq = payload["seq"]
+
+    out = bytearray(_HEADER.pack(VERSION, int(timestamp * 1000), seq & 0xff))
+    _varint(len(metrics), out)
+    for name, value in metrics.items():
+        alias = aliases.get(name) if aliases else None
+        if alias is not None:
+            _varint((alias << 1) | 1, out)
+        else:
+            raw = name.encode("utf-8") if not isinstance(name, bytes) else name
+            _varint(len(raw) << 1, out)
+            out.extend(raw)
+        if value is None:
+            out.append(T_NULL)
+        elif value is True:
+            out.append(T_TRUE)
+        elif value is False:
+            out.append(T_FALSE)
+        elif isinstance(value, _INTEGER_TYPES) and -_INT64 <= value < _INT64:
+            out.append(T_INT)
+            _varint((value << 1) ^ (value >> 63), out)
+        elif isinstance(value, float):
+            out.append(T_FLOAT)
+            out.extend(_DOUBLE.pack(value))
+        elif isinstance(value, (type(u""), bytes)):
+            out.append(T_STRING)
+            _text(value, out)
+        else:
+            out.append(T_JSON)
+            _text(json.dumps(value, default=str), out)
+    return bytes(out)
+
+
+def decode(data, aliases=None):
+    data = bytearray(data)
+    version, millis, seq = _HEADER.unpack_from(bytes(data[:_HEADER.size]))
+    if version != VERSION:
+        raise ValueError("Unsupported metric payload version %s" % version)
+    names = dict((alias, name) for name, alias in (aliases or {}).items())
+    count, position = _read_varint(data, _HEADER.size)
+    metrics = {}
+    for _ in range(count):
+        header, position = _read_varint(data, position)
+        if header & 1:
+            name = names.get(header >> 1, "alias:%d" % (header >> 1))
+        else:
+            end = position + (header >> 1)
+            name = bytes(data[position:end]).decode("utf-8")
+            position = end
+        kind = data[position]
+        position += 1
+        if kind == T_NULL:
+            value = None
+        elif kind in (T_TRUE, T_FALSE):
+            value = kind == T_TRUE
+        elif kind == T_INT:
+            raw, position = _read_varint(data, position)
+            value = (raw >> 1) ^ -(raw & 1)
+        elif kind == T_FLOAT:
+            value = _DOUBLE.unpack_from(bytes(data[position:position + 8]))[0]
+            position += 8
+        else:
+            length, position = _read_varint(data, position)
+            value = bytes(data[position:position + length]).decode("utf-8")
+            position += length
+            if kind == T_JSON:
+                value = json.loads(value)
+        metrics[name] = value
+    return {"timestamp": millis / 1000.0, "seq": seq, "metrics": metrics}
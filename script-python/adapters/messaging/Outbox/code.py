@@ -0,0 +1,492 @@
+"""
+Outbox
+------
+Transactional outbox: domain events are stored with the write that raised
+them and relayed to MessageRouter afterwards.
+
+    outbox.append("mes/MaterialDefinition", "MaterialDefinition.SyncAdd", envelope)
+
+- DatabaseOutboxStore inserts through the PersistenceGateway, so inside a
+  UnitOfWork the event row commits or rolls back with the stored-procedure
+  calls of that unit (on the datasource the unit already writes to).
+  LogOutboxStore, the default and the fallback when no database is available,
+  appends JSON lines to a local file once the unit has committed.
+- The outbox table and its procedures (SQL Server) are in SCHEMA_STATEMENTS.
+  Run install_schema(datasource) once per datasource, then set store to
+  'DATABASE' in MessagingConfig.outbox_options(); before that every write
+  that raises an event would fail on the missing procedure.
+- Every message is stored with a dedupe key: the envelope's correlationId
+  (or a generated key). The relay reads pending messages oldest first,
+  publishes the stored payloads per topic with MessageRouter.publish_batch and
+  only then marks them published: delivery is at-least-once, and consumers
+  drop a repeat by its correlationId.
+- The relay is woken after each committed append and runs in the background.
+  Call run_relay_once() from a gateway timer script as well, so events left
+  behind by a broker outage or a restart still go out.
+- metrics() reports appended / published / failed counts, the pending count,
+  lag (age of the oldest pending message) and the throughput of the last drain.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from adapters.messaging import MessageRouter as router
+from adapters.persistence.PersistenceGateway import code as gateway
+from adapters.persistence.UnitOfWork import code as UnitOfWork
+from common.concurrency.Executor import code as Executor
+from common.logging.LogFactory import code as LogFactory
+from infrastructure import MessagingConfig as cfg
+from infrastructure.ConfigService import code as config
+
+log = LogFactory.get_logger("Outbox")
+
+DATABASE = "DATABASE"
+LOG = "LOG"
+
+SP_INSERT_EVENT = "usp_I_InsertOutboxEvent"
+SP_GET_PENDING = "usp_S_GetPendingOutboxEvents"
+SP_MARK_PUBLISHED = "usp_U_MarkOutboxEventsPublished"
+SP_GET_STATS = "usp_S_GetOutboxStats"
+
+# Every procedure returns a result set: PersistenceGateway.call runs them with
+# runPrepQuery. Times are epoch seconds, as written by _message().
+SCHEMA_STATEMENTS = (
+    """
+    IF OBJECT_ID('dbo.OutboxEvent', 'U') IS NULL
+    CREATE TABLE dbo.OutboxEvent (
+        OutboxEventID BIGINT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+        DedupeKey NVARCHAR(64) NOT NULL,
+        Topic NVARCHAR(256) NOT NULL,
+        EventType NVARCHAR(128) NOT NULL,
+        Payload NVARCHAR(MAX) NULL,
+        CreatedAt FLOAT NOT NULL,
+        PublishedAt FLOAT NULL,
+        CONSTRAINT UQ_OutboxEvent_DedupeKey UNIQUE (DedupeKey)
+    )
+    """,
+    """
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_OutboxEvent_Pending')
+    CREATE INDEX IX_OutboxEvent_Pending ON dbo.OutboxEvent (OutboxEventID)
+        INCLUDE (CreatedAt) WHERE PublishedAt IS NULL
+    """,
+    """
+    CREATE OR ALTER PROCEDURE dbo.%s
+        @DedupeKey NVARCHAR(64), @Topic NVARCHAR(256), @EventType NVARCHAR(128),
+        @Payload NVARCHAR(MAX), @CreatedAt FLOAT
+    AS
+    BEGIN
+        SET NOCOUNT ON;
+        IF NOT EXISTS (SELECT 1 FROM dbo.OutboxEvent WHERE DedupeKey = @DedupeKey)
+            INSERT INTO dbo.OutboxEvent (DedupeKey, Topic, EventType, Payload, CreatedAt)
+            VALUES (@DedupeKey, @Topic, @EventType, @Payload, @CreatedAt);
+        SELECT @@ROWCOUNT AS Inserted;
+    END
+    """ % SP_INSERT_EVENT,
+    """
+    CREATE OR ALTER PROCEDURE dbo.%s
+        @Limit INT
+    AS
+    BEGIN
+        SET NOCOUNT ON;
+        SELECT TOP (@Limit) DedupeKey, Topic, EventType, Payload, CreatedAt
+        FROM dbo.OutboxEvent
+        WHERE PublishedAt IS NULL
+        ORDER BY OutboxEventID;
+    END
+    """ % SP_GET_PENDING,
+    """
+    CREATE OR ALTER PROCEDURE dbo.%s
+        @DedupeKeys NVARCHAR(MAX), @PublishedAt FLOAT
+    AS
+    BEGIN
+        SET NOCOUNT ON;
+        UPDATE dbo.OutboxEvent SET PublishedAt = @PublishedAt
+        WHERE PublishedAt IS NULL
+          AND DedupeKey IN (SELECT value FROM STRING_SPLIT(@DedupeKeys, ','));
+        SELECT @@ROWCOUNT AS Updated;
+    END
+    """ % SP_MARK_PUBLISHED,
+    """
+    CREATE OR ALTER PROCEDURE dbo.%s
+    AS
+    BEGIN
+        SET NOCOUNT ON;
+        SELECT COUNT(*) AS PendingCount, MIN(CreatedAt) AS OldestCreatedAt
+        FROM dbo.OutboxEvent
+        WHERE PublishedAt IS NULL;
+    END
+    """ % SP_GET_STATS,
+)
+
+DEFAULT_BATCH_SIZE = 200
+RECENT_KEYS = 10000  # published keys remembered in case marking them failed
+RELAY_POOL = "outbox-relay"
+
+
+def _message(topic, event_type, data, dedupe_key=None):
+    if dedupe_key is None and isinstance(data, dict):
+        dedupe_key = data.get("correlationId")
+    return {
+        "dedupeKey": dedupe_key or uuid.uuid4().hex,
+        "topic": topic,
+        "type": event_type,
+        "data": data,
+        "timestamp": time.time(),
+    }
+
+
+def _dumps(value):
+    return json.dumps(value, default=str)
+
+
+# ----------------------------------------------------------------------
+# Stores
+# ----------------------------------------------------------------------
+class DatabaseOutboxStore(object):
+    """Outbox table behind stored procedures; appends join the ambient UnitOfWork."""
+
+    def __init__(self, datasource=None):
+        self.datasource = datasource
+        self._seen = set()  # datasources appended to by this gateway
+        self._lock = threading.Lock()
+
+    def _target(self):
+        uow = UnitOfWork.current()
+        written = uow.datasources() if uow is not None else []
+        return written[0] if written else self._default()
+
+    def _default(self):
+        if self.datasource:
+            return self.datasource
+        return config.get("database.datasource")
+
+    def datasources(self):
+        with self._lock:
+            return sorted(self._seen | set([self._default()]))
+
+    def append(self, message):
+        datasource = self._target()
+        gateway.call(
+            SP_INSERT_EVENT,
+            [
+                ("@DedupeKey", message["dedupeKey"]),
+                ("@Topic", message["topic"]),
+                ("@EventType", message["type"]),
+                ("@Payload", _dumps(message["data"])),
+                ("@CreatedAt", message["timestamp"]),
+            ],
+            datasource,
+        )
+        with self._lock:
+            self._seen.add(datasource)
+
+    def pending(self, limit, datasource=None):
+        rows = gateway.call(SP_GET_PENDING, [("@Limit", limit)], datasource)
+        return [self._from_row(row) for row in _rows(rows)]
+
+    def mark_published(self, keys, datasource=None):
+        gateway.call(SP_MARK_PUBLISHED, [("@DedupeKeys", ",".join(keys)), ("@PublishedAt", time.time())],
+                     datasource)
+
+    def stats(self, datasource=None):
+        rows = _rows(gateway.call(SP_GET_STATS, [], datasource))
+        row = rows[0] if rows else {}
+        return {"pending": int(row.get("PendingCount") or 0), "oldest": row.get("OldestCreatedAt")}
+
+    @staticmethod
+    def _from_row(row):
+        payload = row.get("Payload")
+        try:
+            data = json.loads(payload) if payload else None
+        except ValueError:
+            data = payload
+        return {
+            "dedupeKey": row.get("DedupeKey"),
+            "topic": row.get("Topic"),
+            "type": row.get("EventType"),
+            "data": data,
+            "timestamp": row.get("CreatedAt"),
+        }
+
+
+def _rows(dataset):
+    if dataset is None:
+        return []
+    if isinstance(dataset, list):
+        return dataset
+    columns = list(dataset.getColumnNames())
+    return [
+        dict((col, dataset.getValueAt(i, col)) for col in columns)
+        for i in range(dataset.getRowCount())
+    ]
+
+
+class LogOutboxStore(object):
+    """
+    Append-only JSON-lines file plus a file of published keys. Appends inside
+    a UnitOfWork are written once it commits; both files are truncated when
+    nothing is pending.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(tempfile.gettempdir(), "mes-outbox.log")
+        self.acked_path = self.path + ".published"
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()  # {dedupeKey: message} in append order
+        self._load()
+
+    def _load(self):
+        published = set()
+        if os.path.exists(self.acked_path):
+            with open(self.acked_path) as handle:
+                published = set(line.strip() for line in handle if line.strip())
+        if os.path.exists(self.path):
+            with open(self.path) as handle:
+                for line in handle:
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line after a crash
+                    if message.get("dedupeKey") not in published:
+                        self._pending[message["dedupeKey"]] = message
+
+    def datasources(self):
+        return [None]
+
+    def append(self, message):
+        uow = UnitOfWork.current()
+        if uow is not None:
+            uow.after_commit(self._write, message)
+        else:
+            self._write(message)
+
+    def _write(self, message):
+        with self._lock:
+            with open(self.path, "a") as handle:
+                handle.write(_dumps(message) + "\n")
+            self._pending[message["dedupeKey"]] = message
+
+    def pending(self, limit, datasource=None):
+        with self._lock:
+            return [dict(message) for message in list(self._pending.values())[:limit]]
+
+    def mark_published(self, keys, datasource=None):
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+            if not self._pending:
+                for path in (self.path, self.acked_path):
+                    open(path, "w").close()
+                return
+            with open(self.acked_path, "a") as handle:
+                handle.write("".join(key + "\n" for key in keys))
+
+    def stats(self, datasource=None):
+        with self._lock:
+            oldest = next(iter(self._pending.values()), None)
+            return {"pending": len(self._pending), "oldest": oldest["timestamp"] if oldest else None}
+
+
+# ----------------------------------------------------------------------
+# Relay
+# ----------------------------------------------------------------------
+class OutboxRelay(object):
+    def __init__(self, store, publish_batch, batch_size=DEFAULT_BATCH_SIZE):
+        self.store = store
+        self.publish_batch = publish_batch
+        self.batch_size = max(1, int(batch_size))
+        self._lock = threading.Lock()
+        self._again = False
+        self._recent = deque()
+        self._recent_keys = set()
+        self._stats = {"published": 0, "failed": 0, "alreadyPublished": 0, "drains": 0}
+        self._last_drain = {"messages": 0, "seconds": 0.0, "at": None}
+
+    def drain(self):
+        """Relay pending messages until none are left or a publish fails; returns messages published."""
+        if not self._lock.acquire(False):
+            self._again = True  # the running drain picks up what was just appended
+            return 0
+        started = time.time()
+        published = 0
+        try:
+            while True:
+                self._again = False
+                for datasource in self.store.datasources():
+                    published += self._drain_datasource(datasource)
+                if not self._again:
+                    break
+        finally:
+            elapsed = time.time() - started
+            self._last_drain = {"messages": published, "seconds": elapsed, "at": started}
+            self._stats["drains"] += 1
+            self._lock.release()
+        return published
+
+    def _drain_datasource(self, datasource):
+        published = 0
+        while True:
+            batch = self.store.pending(self.batch_size, datasource)
+            if not batch:
+                return published
+            done = []
+            failed = False
+            for topic, messages in self._by_topic(batch):
+                fresh = [m for m in messages if m["dedupeKey"] not in self._recent_keys]
+                self._stats["alreadyPublished"] += len(messages) - len(fresh)
+                if fresh and not self._send(topic, fresh):
+                    failed = True
+                    continue  # other nouns may still go out; this one keeps its order
+                done.extend(m["dedupeKey"] for m in messages)
+                published += len(fresh)
+            if done:
+                self._remember(done)
+                self.store.mark_published(done, datasource)
+            if failed or len(batch) < self.batch_size:
+                return published
+
+    @staticmethod
+    def _by_topic(batch):
+        grouped = OrderedDict()
+        for message in batch:
+            grouped.setdefault(message["topic"], []).append(message)
+        return grouped.items()
+
+    def _send(self, topic, messages):
+        try:
+            result = self.publish_batch(topic, [m["data"] for m in messages])
+        except Exception as ex:
+            log.warn("Outbox relay could not publish %s message(s) to %s: %s" % (len(messages), topic, ex))
+            result = False
+        if result is False:
+            self._stats["failed"] += len(messages)
+            return False
+        self._stats["published"] += len(messages)
+        return True
+
+    def _remember(self, keys):
+        for key in keys:
+            if key not in self._recent_keys:
+                self._recent.append(key)
+                self._recent_keys.add(key)
+        while len(self._recent) > RECENT_KEYS:
+            self._recent_keys.discard(self._recent.popleft())
+
+    def stats(self):
+        stats = dict(self._stats)
+        last = self._last_drain
+        stats["lastDrain"] = dict(last)
+        stats["throughput"] = last["messages"] / last["seconds"] if last["seconds"] else 0.0
+        return stats
+
+
+# ----------------------------------------------------------------------
+# Outbox
+# ----------------------------------------------------------------------
+class Outbox(object):
+    def __init__(self, store, relay=None, relay_on_commit=True):
+        self.store = store
+        self.relay = relay or OutboxRelay(store, router.publish_batch)
+        self.relay_on_commit = relay_on_commit
+        self._appended = 0
+        self._scheduled = threading.Event()
+
+    def append(self, topic, event_type, data, dedupe_key=None):
+        """Store an event with the current unit of work; returns its dedupe key."""
+        message = _message(topic, event_type, data, dedupe_key)
+        self.store.append(message)
+        self._appended += 1
+        if self.relay_on_commit:
+            uow = UnitOfWork.current()
+            if uow is not None:
+                uow.after_commit(self.wake)
+            else:
+                self.wake()
+        return message["dedupeKey"]
+
+    def wake(self):
+        """Schedule a background drain unless one is already queued."""
+        if self._scheduled.is_set():
+            return
+        self._scheduled.set()
+        try:
+            Executor.shared(RELAY_POOL, 1).submit(self._scheduled_drain)
+        except RuntimeError:
+            self._scheduled.clear()  # pool shut down; the timer script drains instead
+
+    def _scheduled_drain(self):
+        self._scheduled.clear()
+        try:
+            return self.relay.drain()
+        except Exception as ex:
+            log.error("Outbox relay failed: %s" % ex)
+            return 0
+
+    def metrics(self):
+        now = time.time()
+        pending, oldest = 0, None
+        for datasource in self.store.datasources():
+            try:
+                stats = self.store.stats(datasource)
+            except Exception as ex:
+                log.warn("Outbox stats unavailable for %s: %s" % (datasource, ex))
+                continue
+            pending += stats["pending"]
+            if stats["oldest"] is not None and (oldest is None or stats["oldest"] < oldest):
+                oldest = stats["oldest"]
+        metrics = self.relay.stats()
+        metrics["appended"] = self._appended
+        metrics["pending"] = pending
+        metrics["lagSeconds"] = max(0.0, now - float(oldest)) if oldest is not None else 0.0
+        metrics["store"] = type(self.store).__name__
+        return metrics
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def install_schema(datasource=None):
+    """Create the outbox table and procedures on datasource (idempotent)."""
+    datasource = datasource or config.get("database.datasource")
+    for statement in SCHEMA_STATEMENTS:
+        gateway.run_update(statement, [], datasource)
+    return True
+
+
+def _create():
+    options = cfg.outbox_options()
+    store = None
+    if (options.get("store") or LOG).upper() == DATABASE and gateway.available():
+        store = DatabaseOutboxStore(options.get("datasource"))
+    if store is None:
+        store = LogOutboxStore(options.get("log_path"))
+    relay = OutboxRelay(store, router.publish_batch, options.get("batch_size") or DEFAULT_BATCH_SIZE)
+    return Outbox(store, relay, options.get("relay_on_commit", True))
+
+
+def get_outbox():
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = _create()
+    return _outbox
+
+
+def append(topic, event_type, data, dedupe_key=None):
+    return get_outbox().append(topic, event_type, data, dedupe_key)
+
+
+def run_relay_once():
+    # Gateway timer script: drains whatever the commit-time wake-ups left behind
+    return get_outbox().relay.drain()
+
+
+def metrics():
+    return get_outbox().metrics()
@@ -0,0 +1,158 @@
+"""
+BulkUploadEngine
+----------------
+Chunked, resumable submission of validated bulk-upload rows.
+
+- Rows already flagged by validation (Flag != 0) are passed through untouched;
+  the rest are split into chunks and handed to submit_chunk(rows), e.g. one
+  bulk-upload stored procedure call per chunk.
+- At most max_parallel chunks of one upload are in flight at a time, on the
+  shared "bulk-upload" pool, each under the caller's session context.
+- Each chunk runs in its own UnitOfWork: it commits on its own, and a database
+  error fails only that chunk instead of being swallowed by the repository.
+- Every finished chunk is checkpointed in the "bulk-upload" cache (Ignite when
+  available). Running the same rows again with the same upload id skips the
+  chunks already done, so a failed upload resumes where it stopped. The
+  checkpoint is dropped once every chunk has succeeded.
+- Without an upload id, one is derived from the rows' content (upload_key),
+  so it only resumes an unchanged grid. To resume after editing rows, pass
+  the UploadID of the failed run's report.
+- Rows of a failed chunk come back with Flag=1 and the error in Reasons, the
+  format the upload screens already render, plus UploadFailed=1. Sending the
+  returned rows again retries exactly those rows; validation failures stay
+  excluded.
+"""
+
+import hashlib
+import json
+
+from adapters.cache.IgniteAdapter import code as ignite
+from adapters.persistence.UnitOfWork import code as UnitOfWork
+from common.cache.CacheManager import code as local
+from common.concurrency.Executor import code as Executor
+from common.logging.LogFactory import code as LogFactory
+
+log = LogFactory.get_logger("BulkUploadEngine")
+
+CHECKPOINT_CACHE = "bulk-upload"
+CHECKPOINT_TTL_SECONDS = 24 * 3600
+POOL_NAME = "bulk-upload"
+POOL_SIZE = 8
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_MAX_PARALLEL = 4
+
+FAILED_STYLE = {
+    "backgroundColor": "#FF474C",
+    "font-weight": "bold",
+    "color": "#FFFFFF",
+}
+
+
+def _store():
+    cache = ignite.get(CHECKPOINT_CACHE)
+    return cache if cache else local
+
+
+def upload_key(kind, rows, chunk_size):
+    """Deterministic upload id: same rows, kind and chunking resume the same checkpoint."""
+    digest = hashlib.sha1()
+    digest.update(("%s|%s|" % (kind, chunk_size)).encode("utf-8"))
+    digest.update(json.dumps(rows, sort_keys=True, default=str).encode("utf-8"))
+    return "%s:%s" % (kind, digest.hexdigest())
+
+
+def _count(summary, field, default):
+    if isinstance(summary, dict) and summary.get(field) is not None:
+        try:
+            return int(summary.get(field))
+        except (TypeError, ValueError):
+            pass
+    return default
+
+
+class BulkUploadEngine(object):
+    def __init__(self, kind, submit_chunk, chunk_size=None, max_parallel=None):
+        self.kind = kind
+        self.submit_chunk = submit_chunk
+        self.chunk_size = max(1, int(chunk_size or DEFAULT_CHUNK_SIZE))
+        self.max_parallel = max(1, int(max_parallel or DEFAULT_MAX_PARALLEL))
+
+    def load_checkpoint(self, upload_id):
+        return _store().get(CHECKPOINT_CACHE, upload_id)
+
+    def _save_checkpoint(self, upload_id, checkpoint):
+        try:
+            _store().put(CHECKPOINT_CACHE, upload_id, checkpoint, CHECKPOINT_TTL_SECONDS)
+        except Exception as ex:
+            log.warn("Could not checkpoint %s: %s" % (upload_id, ex))
+
+    def run(self, rows, upload_id=None):
+        rows = [dict(row) for row in rows or []]
+        for row in rows:
+            if row.pop("UploadFailed", None):
+                row["Flag"] = 0
+                row["Reasons"] = {"value": "", "style": {}}
+        pending = [i for i, row in enumerate(rows) if not row.get("Flag")]
+        chunks = [pending[i:i + self.chunk_size] for i in range(0, len(pending), self.chunk_size)]
+        upload_id = upload_id or upload_key(self.kind, rows, self.chunk_size)
+
+        checkpoint = self.load_checkpoint(upload_id) or {"chunks": {}}
+        done = checkpoint["chunks"]
+        todo = [n for n in range(len(chunks)) if str(n) not in done]
+        if len(todo) < len(chunks):
+            log.info("Resuming %s: %s of %s chunks already uploaded" % (upload_id, len(chunks) - len(todo), len(chunks)))
+
+        failed = {}
+        pool = Executor.shared(POOL_NAME, POOL_SIZE)
+        in_flight = []
+        for n in todo:
+            in_flight.append((n, pool.submit_in_context(self._submit, [rows[i] for i in chunks[n]])))
+            if len(in_flight) >= self.max_parallel:
+                self._collect(in_flight.pop(0), upload_id, checkpoint, failed)
+        while in_flight:
+            self._collect(in_flight.pop(0), upload_id, checkpoint, failed)
+
+        success = failure = 0
+        for n, indexes in enumerate(chunks):
+            if n in failed:
+                failure += len(indexes)
+                reason = "Upload failed, chunk %s of %s: %s" % (n + 1, len(chunks), failed[n])
+                for i in indexes:
+                    rows[i]["Flag"] = 1
+                    rows[i]["UploadFailed"] = 1
+                    rows[i]["Reasons"] = {"value": reason, "style": dict(FAILED_STYLE)}
+            else:
+                summary = done.get(str(n))
+                success += _count(summary, "SuccessCount", len(indexes))
+                failure += _count(summary, "FailureCount", 0)
+
+        complete = not failed
+        if complete and chunks:
+            try:
+                _store().invalidate(CHECKPOINT_CACHE, upload_id)
+            except Exception:
+                pass
+        return {
+            "UploadID": upload_id,
+            "Rows": rows,
+            "SuccessCount": success,
+            "FailureCount": failure,
+            "ChunkCount": len(chunks),
+            "FailedChunks": sorted(failed),
+            "Complete": complete,
+        }
+
+    def _submit(self, chunk):
+        with UnitOfWork.UnitOfWork():
+            return self.submit_chunk(chunk)
+
+    def _collect(self, entry, upload_id, checkpoint, failed):
+        n, future = entry
+        try:
+            summary = future.result()
+        except Exception as ex:
+            log.error("Chunk %s of %s failed: %s" % (n + 1, upload_id, ex))
+            failed[n] = ex
+            return
+        checkpoint["chunks"][str(n)] = summary if isinstance(summary, dict) else {}
+        self._save_checkpoint(upload_id, checkpoint)
@@ -1,27 +1,22 @@
-from infrastructure import DatabaseConfig as dbc
+from infrastructure.ConfigService import code as config
+from adapters.persistence import PersistenceGateway as gateway
 from common.exceptions import RepositoryException as rex
 
-def query_one(sql, params=None, tx=None):
+def query_one(sql, params=None, tx=None, datasource=None):
+    if not gateway.available():
+        # outside Ignition: simulate empty result
+        return None
     try:
-        params = params or []
-        try:
-            from system.db import runPrepQuery
-            rows = runPrepQuery(sql, params, tx) if tx else runPrepQuery(sql, params)
-            return rows[0] if rows else None
-        except Exception:
-            # outside Ignition: simulate empty result
-            return None
+        rows = gateway.run_query(sql, params or [], datasource or config.get("database.datasource"), tx)
+        return rows[0] if rows else None
     except Exception as ex:
         raise rex.RepositoryException("DB query failed: %s" % str(ex))
 
-def execute(sql, params=None, tx=None):
+def execute(sql, params=None, tx=None, datasource=None):
+    if not gateway.available():
+        # outside Ignition: simulate success
+        return 1
     try:
-        params = params or []
-        try:
-            from system.db import runPrepUpdate
-            return runPrepUpdate(sql, params, tx) if tx else runPrepUpdate(sql, params)
-        except Exception:
-            # outside Ignition: simulate success
-            return 1
+        return gateway.run_update(sql, params or [], datasource or config.get("database.datasource"), tx)
     except Exception as ex:
         raise rex.RepositoryException("DB execute failed: %s" % str(ex))
@@ -0,0 +1,218 @@
+"""
+PersistenceGateway
+------------------
+Single entry point for system.db calls made by adapters and repositories.
+
+- Resolves system.db functions once and reuses them (no import per call).
+- Caches pre-built "EXEC proc @A=?, @B=?" strings per datasource together with
+  their parameter order, so repositories only supply values.
+- Optionally caps concurrent queries per datasource (DatabaseConfig) so bursts
+  queue here instead of exhausting the Ignition connection pool.
+- Calls made without a tx inside an active scope (UnitOfWork) run on the
+  scope's transaction for their datasource.
+"""
+
+import threading
+import time
+
+from common.exceptions import RepositoryException as rex
+from infrastructure.ConfigService import code as config
+from infrastructure.DatabaseConfig import code as dbc
+
+_functions = {}
+_statements = {}  # {(datasource, procedure, names): PreparedCall}
+_limiters = {}
+_lock = threading.Lock()
+_scopes = threading.local()
+
+BUSY = "DB_BUSY"  # code of the RepositoryException raised when the concurrency wait runs out
+
+
+class Unavailable(Exception):
+    """Raised when system.db is not importable (outside Ignition)."""
+
+
+class PreparedCall(object):
+    def __init__(self, procedure, names):
+        self.procedure = procedure
+        self.names = tuple(names)
+        if self.names:
+            self.statement = "EXEC %s %s" % (procedure, ", ".join(["%s=?" % n for n in self.names]))
+        else:
+            self.statement = "EXEC %s" % procedure
+
+    def values(self, params):
+        """Order values for this call; params is a dict or [(name, value)]."""
+        lookup = params if isinstance(params, dict) else dict(params or [])
+        return [lookup.get(name) for name in self.names]
+
+
+class _Limiter(object):
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout):
+        deadline = time.time() + timeout
+        with self._cond:
+            while self.active >= self.limit:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+def db_function(name):
+    fn = _functions.get(name)
+    if fn is None:
+        try:
+            import system.db
+            fn = getattr(system.db, name)
+        except Exception:
+            raise Unavailable("system.db.%s is not available" % name)
+        _functions[name] = fn
+    return fn
+
+
+def available():
+    try:
+        db_function("runPrepQuery")
+        return True
+    except Unavailable:
+        return False
+
+
+def prepare(procedure, names, datasource=None):
+    key = (datasource, procedure, tuple(names))
+    prepared = _statements.get(key)
+    if prepared is None:
+        prepared = PreparedCall(procedure, names)
+        _statements[key] = prepared
+    return prepared
+
+
+def set_limit(datasource, limit):
+    """Override the concurrency cap for datasource at runtime; None removes it."""
+    with _lock:
+        _limiters[datasource] = _Limiter(int(limit)) if limit else None
+    return True
+
+
+def _limiter(datasource):
+    try:
+        return _limiters[datasource]
+    except KeyError:
+        pass
+    with _lock:
+        if datasource not in _limiters:
+            limit = dbc.max_concurrent_queries(datasource)
+            _limiters[datasource] = _Limiter(int(limit)) if limit else None
+        return _limiters[datasource]
+
+
+def _scope_stack():
+    stack = getattr(_scopes, "stack", None)
+    if stack is None:
+        stack = _scopes.stack = []
+    return stack
+
+
+def push_scope(scope):
+    """Make scope the ambient transaction source for this thread."""
+    _scope_stack().append(scope)
+
+
+def pop_scope(scope):
+    stack = _scope_stack()
+    if scope in stack:
+        stack.remove(scope)
+
+
+def current_scope():
+    stack = _scope_stack()
+    return stack[-1] if stack else None
+
+
+def _invoke(name, statement, params, datasource, tx):
+    fn = db_function(name)
+    if tx is None:
+        scope = current_scope()
+        if scope is not None:
+            tx = scope.transaction(datasource)
+    args = [statement, list(params or [])]
+    if datasource or tx:
+        args.append(datasource or "")
+    if tx:
+        args.append(tx)
+    limiter = _limiter(datasource)
+    if limiter is None:
+        return fn(*args)
+    if not limiter.acquire(config.get("database.concurrency_wait_seconds")):
+        raise rex.RepositoryException(
+            "Datasource %s busy: %s queries in flight" % (datasource, limiter.limit),
+            code=BUSY,
+        )
+    try:
+        return fn(*args)
+    finally:
+        limiter.release()
+
+
+def is_busy(error):
+    """True for the error raised when a datasource stayed at its concurrency cap."""
+    return getattr(error, "code", None) == BUSY
+
+
+def run_query(statement, params=None, datasource=None, tx=None):
+    return _invoke("runPrepQuery", statement, params, datasource, tx)
+
+
+def run_update(statement, params=None, datasource=None, tx=None):
+    return _invoke("runPrepUpdate", statement, params, datasource, tx)
+
+
+def begin(datasource=None):
+    return db_function("beginTransaction")(datasource or "")
+
+
+def commit(tx):
+    return db_function("commitTransaction")(tx)
+
+
+def rollback(tx):
+    return db_function("rollbackTransaction")(tx)
+
+
+def close(tx):
+    return db_function("closeTransaction")(tx)
+
+
+def call(procedure, params=None, datasource=None, tx=None):
+    """Run a stored procedure with params as [(name, value)] using the cached statement."""
+    params = list(params or [])
+    prepared = prepare(procedure, [name for name, _ in params], datasource)
+    return run_query(prepared.statement, [value for _, value in params], datasource, tx)
+
+
+def call_with(runner, procedure, params=None, datasource=None):
+    """call() through runner(statement, values, datasource), e.g. a repository's error-tolerant _run_query."""
+    params = list(params or [])
+    prepared = prepare(procedure, [name for name, _ in params], datasource)
+    return runner(prepared.statement, [value for _, value in params], datasource)
+
+
+def reset():
+    """Drop cached functions, statements and limiters (tests / project reload)."""
+    with _lock:
+        _functions.clear()
+        _statements.clear()
+        _limiters.clear()
+    return True
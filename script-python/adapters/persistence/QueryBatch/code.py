@@ -0,0 +1,50 @@
+# Batched stored-procedure execution for view loads.
+# Independent calls run on a shared worker pool, so a screen that needs several
+# read models waits for the slowest call instead of the sum of all of them.
+# Ignition's runPrepQuery only surfaces the first result set of a statement, so
+# calls are fanned out rather than concatenated into one multi-statement batch.
+# Inside a unit of work the calls run in turn on the caller thread, so they use
+# its transaction and see its uncommitted writes.
+from adapters.persistence.PersistenceGateway import code as gateway
+from common.concurrency.Executor import code as Executor
+
+POOL_NAME = "persistence-batch"
+POOL_SIZE = 8
+
+
+class BatchCall(object):
+    def __init__(self, key, procedure, params=None, mapper=None):
+        self.key = key
+        self.procedure = procedure
+        self.params = list(params or [])  # [(name, value)] in procedure order
+        self.mapper = mapper
+
+    def statement(self, datasource=None):
+        return gateway.prepare(self.procedure, [name for name, _ in self.params], datasource).statement
+
+    def values(self):
+        return [value for _, value in self.params]
+
+
+def _execute(call, runner, datasource):
+    raw = runner(call.statement(datasource), call.values(), datasource)
+    return call.mapper(raw) if call.mapper else raw
+
+
+def run(calls, runner, datasource, timeout=None):
+    """
+    Execute calls with runner(statement, values, datasource) and return {key: result}.
+    A single call, or any call inside a unit of work, runs inline on the caller
+    thread. Otherwise timeout is one deadline for the whole batch; the first
+    failure cancels the calls that have not started and is re-raised.
+    """
+    calls = list(calls or [])
+    if len(calls) == 1 or gateway.current_scope() is not None:
+        return dict((call.key, _execute(call, runner, datasource)) for call in calls)
+    pool = Executor.shared(POOL_NAME, POOL_SIZE)
+    legs = dict((call.key, _leg(call, runner, datasource)) for call in calls)
+    return Executor.gather(legs, timeout=timeout, pool=pool)
+
+
+def _leg(call, runner, datasource):
+    return lambda: _execute(call, runner, datasource)
@@ -0,0 +1,203 @@
+"""
+UnitOfWork
+----------
+One database transaction per datasource across several repository calls.
+
+    with UnitOfWork() as uow:
+        cache_port = uow.cache(controller.cache_port)
+        messenger = uow.events(controller.messenger)
+        ch.handle_update_material(cmd, repository, cache_port, messenger)
+        ch.handle_update_default_route(route_cmd, repository, messenger)
+
+- Transactions begin lazily on the first statement for a datasource; the
+  PersistenceGateway picks them up, so repositories need no tx argument.
+- Messenger calls are held until every transaction has committed and are
+  dropped on rollback, except the methods a messenger lists in TRANSACTIONAL
+  (e.g. an outbox append), which run at once inside the unit.
+- Cache invalidations are deduplicated and applied once at the end, after a
+  commit or a rollback (a read inside the unit may have cached uncommitted rows).
+  Cache updates registered with after_commit() on the cache port run after the
+  commit only.
+- A unit opened inside another joins the outer one; an error in the inner
+  unit marks the outer one rollback-only.
+- Outside Ignition no transaction is opened and the body runs as-is.
+"""
+
+from adapters.persistence.PersistenceGateway import code as gateway
+from common.logging.LogFactory import code as LogFactory
+
+log = LogFactory.get_logger("UnitOfWork")
+
+_NO_TX = object()
+
+
+class UnitOfWork(object):
+    def __init__(self):
+        self._outer = None
+        self._transactions = []  # [(datasource, tx)] in begin order
+        self._by_datasource = {}
+        self._invalidations = []
+        self._after_commit = []
+        self._rollback_only = False
+        self._active = False
+
+    # ------------------------------------------------------------------
+    # Scope
+    # ------------------------------------------------------------------
+    def __enter__(self):
+        self._outer = gateway.current_scope()
+        if self._outer is None:
+            gateway.push_scope(self)
+        self._active = True
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._active = False
+        if self._outer is not None:
+            if exc_type is not None:
+                self._outer.set_rollback_only()
+            return False
+        gateway.pop_scope(self)
+        if exc_type is None and not self._rollback_only:
+            self._commit()
+        else:
+            self._rollback()
+        return False
+
+    def set_rollback_only(self):
+        if self._outer is not None:
+            return self._outer.set_rollback_only()
+        self._rollback_only = True
+        return True
+
+    def transaction(self, datasource=None):
+        """Transaction handle for datasource, begun on first use; None outside Ignition."""
+        if self._outer is not None:
+            return self._outer.transaction(datasource)
+        key = datasource or ""
+        tx = self._by_datasource.get(key)
+        if tx is None:
+            try:
+                tx = gateway.begin(key)
+                self._transactions.append((key, tx))
+            except gateway.Unavailable:
+                tx = _NO_TX
+            self._by_datasource[key] = tx
+        return None if tx is _NO_TX else tx
+
+    def datasources(self):
+        """Datasources with a transaction begun in this unit, in begin order."""
+        if self._outer is not None:
+            return self._outer.datasources()
+        return [datasource for datasource, _ in self._transactions]
+
+    # ------------------------------------------------------------------
+    # Deferred side effects
+    # ------------------------------------------------------------------
+    def cache(self, cache_port):
+        """cache_port whose invalidate() is held until the unit ends."""
+        return _DeferredCache(self, cache_port) if cache_port else cache_port
+
+    def events(self, messenger):
+        """messenger whose calls are held until the unit commits."""
+        return _DeferredMessenger(self, messenger) if messenger else messenger
+
+    def invalidate(self, cache_port, key=None):
+        if self._outer is not None:
+            return self._outer.invalidate(cache_port, key)
+        for port, pending in self._invalidations:
+            if port is cache_port and (pending is None or pending == key):
+                return
+        if key is None:
+            self._invalidations = [(p, k) for p, k in self._invalidations if p is not cache_port]
+        self._invalidations.append((cache_port, key))
+
+    def after_commit(self, fn, *args, **kwargs):
+        if self._outer is not None:
+            return self._outer.after_commit(fn, *args, **kwargs)
+        self._after_commit.append((fn, args, kwargs))
+
+    # ------------------------------------------------------------------
+    # Completion
+    # ------------------------------------------------------------------
+    def _commit(self):
+        committed = []
+        try:
+            for datasource, tx in self._transactions:
+                gateway.commit(tx)
+                committed.append(datasource)
+        except Exception:
+            log.error("Commit failed after %s of %s datasource(s); rolling back the rest"
+                      % (len(committed), len(self._transactions)))
+            self._finish(committed)
+            raise
+        self._finish(committed)
+        for fn, args, kwargs in self._after_commit:
+            try:
+                fn(*args, **kwargs)
+            except Exception as ex:
+                log.warn("After-commit action failed: %s" % ex)
+
+    def _rollback(self):
+        self._finish([])
+
+    def _finish(self, committed):
+        for datasource, tx in self._transactions:
+            if datasource not in committed:
+                try:
+                    gateway.rollback(tx)
+                except Exception:
+                    pass
+            try:
+                gateway.close(tx)
+            except Exception:
+                pass
+        self._transactions = []
+        self._by_datasource = {}
+        for cache_port, key in self._invalidations:
+            try:
+                cache_port.invalidate(key)
+            except Exception:
+                pass
+        self._invalidations = []
+
+
+class _DeferredCache(object):
+    def __init__(self, uow, cache_port):
+        self._uow = uow
+        self._port = cache_port
+
+    def get(self, key):
+        return self._port.get(key)
+
+    def put(self, key, value, ttl_seconds=60):
+        return self._port.put(key, value, ttl_seconds)
+
+    def invalidate(self, key=None):
+        self._uow.invalidate(self._port, key)
+        return True
+
+    def after_commit(self, fn, *args, **kwargs):
+        """Run fn(cache_port, *args) on the wrapped port once the unit has committed."""
+        self._uow.after_commit(fn, self._port, *args, **kwargs)
+
+
+class _DeferredMessenger(object):
+    def __init__(self, uow, messenger):
+        self._uow = uow
+        self._messenger = messenger
+
+    def __getattr__(self, name):
+        target = getattr(self._messenger, name)
+        if not callable(target) or name in getattr(self._messenger, "TRANSACTIONAL", ()):
+            return target
+
+        def deferred(*args, **kwargs):
+            self._uow.after_commit(target, *args, **kwargs)
+
+        return deferred
+
+
+def current():
+    """The unit of work active on this thread, if any."""
+    return gateway.current_scope()
@@ -0,0 +1,246 @@
+"""
+Executor
+--------
+Bounded worker pools returning futures.
+
+- Works under Jython (real JVM threads) and CPython; no concurrent.futures needed.
+- Named pools are process-wide singletons; call shutdown_all() from the
+  gateway shutdown script so project saves do not leak worker threads.
+- submit_in_context()/gather() carry the caller's SessionContext binding and
+  trace span onto the worker thread.
+- Cancellation only stops tasks that have not started; a running task is left
+  to finish and its result is discarded.
+"""
+
+import threading
+import time
+
+try:  # Python 2 / Jython
+    import Queue as queue
+except ImportError:  # Python 3
+    import queue
+
+from common.exceptions.MESException import code as core
+from common.logging.LogFactory import code as LogFactory
+
+log = LogFactory.get_logger("Executor")
+
+_STOP = object()
+
+
+class ExecutorTimeout(core.MESException):
+    pass
+
+
+class ExecutorCancelled(core.MESException):
+    pass
+
+
+class Future(object):
+    """Result holder for a task submitted to a BoundedExecutor."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._state = "PENDING"
+        self._result = None
+        self._error = None
+
+    def done(self):
+        return self._event.is_set()
+
+    def cancelled(self):
+        return self._state == "CANCELLED"
+
+    def cancel(self):
+        """Cancel the task if it has not started; returns True when cancelled."""
+        with self._lock:
+            if self._state == "CANCELLED":
+                return True
+            if self._state != "PENDING":
+                return False
+            self._state = "CANCELLED"
+        self._error = ExecutorCancelled("Task cancelled", code="EXECUTOR_CANCELLED")
+        self._event.set()
+        return True
+
+    def set_running(self):
+        """Claim the task for a worker; False when it was cancelled first."""
+        with self._lock:
+            if self._state != "PENDING":
+                return False
+            self._state = "RUNNING"
+            return True
+
+    def set_result(self, value):
+        self._result = value
+        self._event.set()
+
+    def set_exception(self, error):
+        self._error = error
+        self._event.set()
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        return self._error
+
+    def result(self, timeout=None):
+        self._wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _wait(self, timeout):
+        self._event.wait(timeout)
+        if not self._event.is_set():
+            raise ExecutorTimeout("Task did not complete within %ss" % timeout, code="EXECUTOR_TIMEOUT")
+
+
+class BoundedExecutor(object):
+    """Fixed-size thread pool; workers are started lazily up to max_workers."""
+
+    def __init__(self, max_workers=4, name="mes-worker"):
+        self.max_workers = max(1, int(max_workers or 1))
+        self.name = name
+        self._queue = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Executor %s is shut down" % self.name)
+            self._queue.put((future, fn, args, kwargs))
+            if len(self._workers) < self.max_workers:
+                self._start_worker()
+        return future
+
+    def submit_in_context(self, fn, *args, **kwargs):
+        """submit() that runs fn under the caller's SessionContext and trace span."""
+        return self.submit(_in_context(fn, _capture_context()), *args, **kwargs)
+
+    def map(self, fn, items, timeout=None):
+        futures = [self.submit(fn, item) for item in items]
+        return [f.result(timeout) for f in futures]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            workers = list(self._workers)
+        for _ in workers:
+            self._queue.put(_STOP)
+        if wait:
+            for worker in workers:
+                worker.join()
+
+    def _start_worker(self):
+        worker = threading.Thread(
+            target=self._work,
+            name="%s-%d" % (self.name, len(self._workers) + 1),
+        )
+        worker.daemon = True
+        self._workers.append(worker)
+        worker.start()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            future, fn, args, kwargs = item
+            if not future.set_running():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as ex:
+                log.debug("Task failed on %s: %s" % (self.name, ex))
+                future.set_exception(ex)
+
+
+def _capture_context():
+    """Caller's (SessionContext, trace span); resolves the context once if unbound."""
+    try:
+        from common.context.SessionContext import code as SessionContext
+        from common.decorators.TraceDecorator import code as TraceDecorator
+
+        return SessionContext.bound() or SessionContext.current(), TraceDecorator.current_span()
+    except Exception:
+        return None
+
+
+def _in_context(fn, captured):
+    if captured is None:
+        return fn
+    ctx, span = captured
+
+    def run(*args, **kwargs):
+        from common.context.SessionContext import code as SessionContext
+        from common.decorators.TraceDecorator import code as TraceDecorator
+
+        previous_ctx = SessionContext.bind(ctx)
+        previous_span = TraceDecorator.attach_span(span)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            TraceDecorator.attach_span(previous_span)
+            SessionContext.unbind(previous_ctx)
+
+    return run
+
+
+def gather(calls, timeout=None, timeouts=None, pool=None):
+    """
+    Run independent callables concurrently and return {name: result}.
+
+    calls    -- {name: callable}; use lambdas/partials to pass arguments
+    timeout  -- per-call timeout in seconds, measured from submission
+    timeouts -- optional {name: seconds} overriding timeout per call
+    The first failure or timeout cancels the calls that have not started yet
+    and is re-raised to the caller.
+    """
+    pool = pool or shared()
+    timeouts = timeouts or {}
+    captured = _capture_context()
+    started = time.time()
+    futures = []
+    for name in calls:
+        futures.append((name, pool.submit(_in_context(calls[name], captured))))
+
+    results = {}
+    try:
+        for name, future in futures:
+            limit = timeouts.get(name, timeout)
+            remaining = None if limit is None else max(0.0, started + limit - time.time())
+            results[name] = future.result(remaining)
+    except Exception:
+        for _, future in futures:
+            future.cancel()
+        raise
+    return results
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def shared(name="default", max_workers=8):
+    """Return the process-wide pool registered under name, creating it once."""
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = BoundedExecutor(max_workers=max_workers, name=name)
+            _pools[name] = pool
+        return pool
+
+
+def shutdown_all(wait=False):
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=wait)
+    return True
@@ -11,6 +11,7 @@ Provides a unified, validated context dictionary:
 - Compliant with SEI & ISO 25010/42010/27001 for logging & context governance.
 """
 
+import threading
 import uuid
 from common.logging import LogFactory
 from common.context import TenantResolver
@@ -18,6 +19,8 @@ from common.context.ContextConfig import CONFIG
 from common.context.ContextValidator import sanitize_context
 log = LogFactory.get_logger("Context")
 
+_local = threading.local()
+
 def _uuid():
     try:
         return str(uuid.uuid4())
@@ -58,6 +61,23 @@ def _session_id(session=None):
     except Exception:
         return None
 
+def bind(ctx):
+    """
+    Bind ctx to the calling thread so nested calls (and worker threads that
+    re-bind it) share one correlationId. Returns the previous binding.
+    """
+    previous = getattr(_local, "ctx", None)
+    _local.ctx = ctx
+    return previous
+
+def unbind(previous=None):
+    """Restore the binding returned by bind()."""
+    _local.ctx = previous
+
+def bound():
+    """Context bound to the calling thread, or None."""
+    return getattr(_local, "ctx", None)
+
 def current(incoming=None):
     """
     Returns current execution context:
@@ -69,7 +89,11 @@ def current(incoming=None):
     - Perspective sessions (pass 'session' in incoming)
     - Gateway / Designer / Timer scripts (fallback)
     - Hybrid Authentication users (via TenantResolver)
+    - Worker threads (context bound via bind())
     """
+    if incoming is None and bound() is not None:
+        return dict(bound())
+
     inc = incoming or {}
     sess = inc.get("session")
     corr = inc.get("correlationId") or _uuid()
@@ -1,9 +1,21 @@
-import time, json
+import time, json, random, threading
 from functools import wraps
 from common.logging import LogFactory
 from common.logging import LogFormatter as fmt
 from common.context import SessionContext
 
+_local = threading.local()
+
+def current_span():
+    """Span id of the innermost traced call on this thread, or None."""
+    return getattr(_local, "span", None)
+
+def attach_span(span):
+    """Make span the parent of traced calls on this thread; returns the previous span."""
+    previous = current_span()
+    _local.span = span
+    return previous
+
 def traced(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -18,6 +30,8 @@ def traced(func):
         correlation_id = ctx.get("correlationId", "N/A")
         tenant = ctx.get("tenant", "N/A")
         user = ctx.get("user", "N/A")
+        parent_span = current_span()
+        span = "%016x" % random.getrandbits(64)
 
         def safe_json(data):
             try:
@@ -31,11 +45,14 @@ def traced(func):
             "ENTER",
             function=func.__name__,
             correlationId=correlation_id,
+            span=span,
+            parentSpan=parent_span or "-",
             tenant=tenant,
             user=user,
             args=safe_json(kwargs)
         ))
 
+        attach_span(span)
         start = time.time()
         status = "OK"
         result = None
@@ -47,11 +64,13 @@ def traced(func):
             status = "ERROR"
             raise
         finally:
+            attach_span(parent_span)
             duration = round((time.time() - start) * 1000, 2)
             log.debug(fmt.fmt(
                 "EXIT",
                 function=func.__name__,
                 correlationId=correlation_id,
+                span=span,
                 tenant=tenant,
                 user=user,
                 status=status,
@@ -0,0 +1,114 @@
+"""
+MultiIndex
+----------
+In-memory collection keyed by a primary field with hash indexes on
+secondary fields.
+
+- find(field, value) is a dict lookup instead of a scan over the snapshot.
+- add() upserts by primary key and remove() deletes; both keep every
+  secondary index consistent, so a cached snapshot can be patched in place
+  instead of being reloaded.
+- Values are indexed as-is (None included) unless a normalize function is
+  given, so lookups match the == comparisons they replace.
+- Records may be dicts or objects with to_record(); find() returns the
+  original items.
+"""
+
+import threading
+
+
+def _record(item):
+    if isinstance(item, dict):
+        return item
+    if hasattr(item, "to_record"):
+        return item.to_record()
+    return dict(getattr(item, "__dict__", {}))
+
+
+class MultiIndex(object):
+    def __init__(self, items=None, key="ID", indexes=None, normalize=None):
+        self.key = key
+        self._normalize = normalize
+        self._items = {}    # {pk: (item, record)}
+        self._indexes = {}  # {field: {value: [pk, ...]}}
+        self._lock = threading.RLock()
+        for field in indexes or []:
+            self._indexes[field] = {}
+        for item in items or []:
+            self.add(item)
+
+    def _value(self, record, field):
+        value = record.get(field)
+        return self._normalize(value) if self._normalize else value
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, pk):
+        return pk in self._items
+
+    def fields(self):
+        return list(self._indexes)
+
+    def items(self):
+        return [item for item, _ in self._items.values()]
+
+    def get(self, pk):
+        entry = self._items.get(pk)
+        return entry[0] if entry else None
+
+    def find(self, field, value):
+        """All items whose field equals value."""
+        if field not in self._indexes:
+            raise KeyError("No index on %s" % field)
+        if self._normalize:
+            value = self._normalize(value)
+        pks = self._indexes[field].get(value) or []
+        return [self._items[pk][0] for pk in pks if pk in self._items]
+
+    def first(self, field, value):
+        found = self.find(field, value)
+        return found[0] if found else None
+
+    def values(self, field):
+        """Distinct indexed values for field."""
+        return list(self._indexes[field])
+
+    def add(self, item):
+        """Insert or replace item by its primary key; returns the key."""
+        record = _record(item)
+        pk = record.get(self.key)
+        with self._lock:
+            if pk in self._items:
+                self._unindex(pk)
+            self._items[pk] = (item, record)
+            for field, index in self._indexes.items():
+                index.setdefault(self._value(record, field), []).append(pk)
+        return pk
+
+    def remove(self, pk):
+        with self._lock:
+            if pk not in self._items:
+                return False
+            self._unindex(pk)
+            del self._items[pk]
+            return True
+
+    def add_index(self, field):
+        with self._lock:
+            if field in self._indexes:
+                return
+            index = {}
+            for pk, (_, record) in self._items.items():
+                index.setdefault(self._value(record, field), []).append(pk)
+            self._indexes[field] = index
+
+    def _unindex(self, pk):
+        record = self._items[pk][1]
+        for field, index in self._indexes.items():
+            value = self._value(record, field)
+            pks = index.get(value)
+            if pks and pk in pks:
+                pks.remove(pk)
+                if not pks:
+                    del index[value]
@@ -0,0 +1,189 @@
+"""
+RuleEngine
+----------
+Declarative row validation for bulk imports.
+
+    validator = RuleSet([
+        required("MaterialName", "Please Enter Material Name"),
+        positive_number("IdealCycleTime", "Idle Cycle Time must be greater than 0"),
+        action_code(),
+    ]).compile()
+    messages = validator(row, {"duplicates": duplicates})
+
+- Rules are declared once with their messages. compile() returns a validator
+  that runs them in declaration order, each as a closure with its field
+  accessor, limits and lookups already resolved.
+- field may be a column name, from_context(key) for a value the caller derived
+  once per row, or a callable(row, context).
+- when=field_in(field, values) or a callable(row, context) limits a rule to
+  the rows it applies to.
+- unique() reads context["duplicates"]: a set of duplicated values or a
+  {value: count} map.
+"""
+
+import re
+
+try:
+    string_types = (basestring,)  # type: ignore[name-defined]
+except Exception:  # pragma: no cover - Python 3 fallback
+    string_types = (str,)
+
+ACTION_CODES = ("I", "U", "D")
+INVALID_ACTION_MESSAGE = "Please Enter Valid Action(I/U/D)"
+
+_PLAIN_NUMBER = re.compile(r"^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$")
+
+
+def to_float(value):
+    """float(value), or None when it does not parse; plain numbers skip the exception path."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, float):
+        return value
+    if isinstance(value, string_types) and _PLAIN_NUMBER.match(value):
+        return float(value)
+    try:
+        return float(value)
+    except Exception:
+        return None
+
+
+class ContextField(object):
+    """A value taken from the per-row context instead of the row."""
+
+    def __init__(self, key):
+        self.key = key
+
+    def __str__(self):
+        return "context.%s" % self.key
+
+
+def from_context(key):
+    return ContextField(key)
+
+
+def _getter(field):
+    """field -> get(row, context)."""
+    if isinstance(field, ContextField):
+        key = field.key
+        return lambda row, context: context[key]
+    if callable(field):
+        return field
+    return lambda row, context: row.get(field)
+
+
+def field_in(field, values):
+    """when= condition: the field's value is one of values."""
+    get = _getter(field)
+    values = frozenset(values)
+    return lambda row, context: get(row, context) in values
+
+
+class Rule(object):
+    """A declared check: check(row, context) returns the failure message or None."""
+
+    def __init__(self, name, check, when=None):
+        self.name = name
+        self.check = check
+        self.when = when
+
+
+def rule(name, check, when=None):
+    return Rule(name, check, when)
+
+
+def _field_rule(name, field, fails, message, when):
+    get = _getter(field)
+
+    def check(row, context):
+        return message if fails(get(row, context)) else None
+
+    return Rule(name, check, when)
+
+
+def required(field, message, when=None):
+    return _field_rule("required:%s" % field, field, lambda value: not value, message, when)
+
+
+def max_length(field, limit, message, when=None):
+    return _field_rule("max-length:%s" % field, field, lambda value: len(value or "") > limit, message, when)
+
+
+def one_of(field, values, message, when=None):
+    allowed = frozenset(values)
+    return _field_rule("one-of:%s" % field, field, lambda value: value not in allowed, message, when)
+
+
+def action_code(field="Action", message=INVALID_ACTION_MESSAGE, when=None):
+    """The I/U/D action column shared by every bulk-upload template."""
+    return one_of(field, ACTION_CODES, message, when)
+
+
+def unique(field, message, when=None):
+    get = _getter(field)
+
+    def check(row, context):
+        duplicates = context.get("duplicates") if context else None
+        value = get(row, context)
+        if duplicates and value in duplicates:
+            if not isinstance(duplicates, dict) or duplicates[value] > 1:
+                return message
+        return None
+
+    return Rule("unique:%s" % field, check, when)
+
+
+def member_of(field, lookup, message, optional=False, when=None):
+    """Value must be in lookup (any container); optional lets empty values through."""
+
+    def fails(value):
+        if optional and not value:
+            return False
+        return value not in lookup
+
+    return _field_rule("member-of:%s" % field, field, fails, message, when)
+
+
+def positive_number(field, message, when=None):
+    def fails(value):
+        value = to_float(value)
+        return value is None or value <= 0
+
+    return _field_rule("positive-number:%s" % field, field, fails, message, when)
+
+
+def allowed_characters(fields, disallowed, message, when=None):
+    """Fails when any of fields contains a match of the disallowed pattern."""
+    fields = list(fields)
+    getters = [_getter(field) for field in fields]
+    search = disallowed.search
+
+    def check(row, context):
+        for get in getters:
+            value = get(row, context)
+            if value is not None and search(str(value)) is not None:
+                return message
+        return None
+
+    return Rule("allowed-characters:%s" % ",".join(fields), check, when)
+
+
+class RuleSet(object):
+    def __init__(self, rules):
+        self.rules = list(rules)
+
+    def compile(self):
+        """validator(row, context=None) -> [message, ...] in declaration order."""
+        checks = [(item.when, item.check) for item in self.rules]
+
+        def validate(row, context=None):
+            messages = []
+            for when, check in checks:
+                if when is not None and not when(row, context):
+                    continue
+                message = check(row, context)
+                if message:
+                    messages.append(message)
+            return messages
+
+        return validate
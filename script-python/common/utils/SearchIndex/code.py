@@ -0,0 +1,185 @@
+"""
+SearchIndex
+-----------
+Typeahead search over one snapshot of dropdown records.
+
+- Text is normalized (lower case, accents stripped, punctuation -> space) and
+  split into tokens per field.
+- A prefix trie answers "starts with" per token; a character n-gram inverted
+  index answers "contains" for query tokens of at least n characters.
+- Every query token must match; a record scores exact > prefix > contains per
+  token, multiplied by the weight of the best matching field.
+- Records may be dicts or objects with to_record(); results are the original
+  records, best first.
+"""
+
+import heapq
+import re
+import unicodedata
+
+try:
+    text_type = unicode  # type: ignore[name-defined]
+except NameError:  # Python 3
+    text_type = str
+
+EXACT, PREFIX, CONTAINS = 3.0, 2.0, 1.0
+
+_SEPARATORS = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize(value):
+    if value is None:
+        return u""
+    if not isinstance(value, text_type):
+        try:
+            value = text_type(value)
+        except UnicodeDecodeError:
+            value = value.decode("utf-8", "ignore")
+    value = unicodedata.normalize("NFKD", value)
+    value = u"".join(ch for ch in value if not unicodedata.combining(ch))
+    return _SEPARATORS.sub(u" ", value.lower()).strip()
+
+
+def _record(item):
+    if isinstance(item, dict):
+        return item
+    if hasattr(item, "to_record"):
+        return item.to_record()
+    return dict(getattr(item, "__dict__", {}))
+
+
+class _TrieNode(object):
+    __slots__ = ("children", "postings")
+
+    def __init__(self):
+        self.children = {}
+        self.postings = None  # {doc: weight} for the token ending here
+
+
+class SearchIndex(object):
+    def __init__(self, items, fields, ngram=3):
+        """
+        items  -- records (dicts or entities with to_record())
+        fields -- list of field names, or {field: weight}
+        """
+        if not isinstance(fields, dict):
+            fields = dict((field, 1.0) for field in fields)
+        self.fields = fields
+        self.ngram = max(2, int(ngram))
+        self._items = list(items or [])
+        self._records = [_record(item) for item in self._items]
+        self._texts = []  # per doc: [(normalized field text, weight)]
+        self._trie = _TrieNode()
+        self._grams = {}
+        for doc, record in enumerate(self._records):
+            texts = []
+            for field, weight in fields.items():
+                text = normalize(record.get(field))
+                if not text:
+                    continue
+                texts.append((text, weight))
+                for token in text.split():
+                    self._add_token(token, doc, weight)
+            self._texts.append(texts)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _add_token(self, token, doc, weight):
+        node = self._trie
+        for ch in token:
+            child = node.children.get(ch)
+            if child is None:
+                child = node.children[ch] = _TrieNode()
+            node = child
+        if node.postings is None:
+            node.postings = {}
+        if node.postings.get(doc, 0) < weight:
+            node.postings[doc] = weight
+        for i in range(len(token) - self.ngram + 1):
+            self._grams.setdefault(token[i:i + self.ngram], set()).add(doc)
+
+    def _find(self, prefix):
+        node = self._trie
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def _token_scores(self, token):
+        """{doc: score} for one query token."""
+        scores = {}
+        node = self._find(token)
+        if node is not None:
+            stack = [node]
+            while stack:
+                current = stack.pop()
+                if current.postings:
+                    kind = EXACT if current is node else PREFIX
+                    for doc, weight in current.postings.items():
+                        score = kind * weight
+                        if scores.get(doc, 0) < score:
+                            scores[doc] = score
+                stack.extend(current.children.values())
+        if len(token) >= self.ngram:
+            candidates = None
+            for i in range(len(token) - self.ngram + 1):
+                postings = self._grams.get(token[i:i + self.ngram])
+                if not postings:
+                    candidates = None
+                    break
+                candidates = set(postings) if candidates is None else candidates & postings
+                if not candidates:
+                    break
+            for doc in candidates or ():
+                if doc in scores:
+                    continue
+                weight = max([w for text, w in self._texts[doc] if token in text] or [0])
+                if weight:
+                    scores[doc] = CONTAINS * weight
+        return scores
+
+    def _accepts(self, doc, filters):
+        record = self._records[doc]
+        for field, expected in filters.items():
+            if callable(expected):
+                if not expected(self._items[doc]):
+                    return False
+                continue
+            value = record.get(field)
+            if isinstance(expected, (list, tuple, set, frozenset)):
+                if value not in expected:
+                    return False
+            elif value != expected:
+                return False
+        return True
+
+    def search(self, query, limit=20, filters=None):
+        """
+        Ranked top-k records for query.
+
+        filters -- {field: value | collection of values | callable(item)}
+        An empty query returns the first `limit` records that pass filters.
+        """
+        filters = filters or {}
+        limit = int(limit) if limit else None
+        tokens = normalize(query).split()
+        if not tokens:
+            docs = [d for d in range(len(self._items)) if self._accepts(d, filters)]
+            return [self._items[d] for d in (docs[:limit] if limit else docs)]
+
+        # Longest token first: it usually has the smallest candidate set.
+        tokens.sort(key=len, reverse=True)
+        totals = None
+        for token in tokens:
+            scores = self._token_scores(token)
+            if totals is None:
+                totals = scores
+            else:
+                totals = dict((d, s + scores[d]) for d, s in totals.items() if d in scores)
+            if not totals:
+                return []
+        ranked = [(score, -doc) for doc, score in totals.items() if self._accepts(doc, filters)]
+        best = heapq.nlargest(limit, ranked) if limit else sorted(ranked, reverse=True)
+        return [self._items[-negdoc] for _, negdoc in best]
@@ -0,0 +1,118 @@
+"""
+StreamingExport
+---------------
+Incremental CSV / NDJSON export of a header list and an iterable of rows.
+
+- Rows are pulled one at a time, typically from a generator that maps
+  repository records, and written in blocks of flush_rows rows; memory holds
+  one block, not the export.
+- write() targets any binary file-like object; compress=True gzips on the fly.
+- export_file() writes to a temp file (or a given path) and returns a summary
+  with the path, so a download can be served from disk.
+"""
+
+import csv
+import gzip
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+CSV = "csv"
+NDJSON = "ndjson"
+FORMATS = (CSV, NDJSON)
+CONTENT_TYPES = {CSV: "text/csv", NDJSON: "application/x-ndjson"}
+FLUSH_ROWS = 500
+
+_TEXT = type(u"")
+
+
+def _encode(text):
+    return text.encode("utf-8") if isinstance(text, _TEXT) else text
+
+
+class _Buffer(object):
+    """csv.writer target collecting text until drained."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, text):
+        self._parts.append(text)
+
+    def drain(self):
+        text = "".join(self._parts)
+        self._parts = []
+        return text
+
+
+def iter_csv(headers, rows, flush_rows=FLUSH_ROWS):
+    buffer = _Buffer()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= flush_rows:
+            yield buffer.drain()
+            pending = 0
+    tail = buffer.drain()
+    if tail:
+        yield tail
+
+
+def iter_ndjson(headers, rows, flush_rows=FLUSH_ROWS):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(OrderedDict(zip(headers, row)), default=str))
+        if len(lines) >= flush_rows:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+_ENCODERS = {CSV: iter_csv, NDJSON: iter_ndjson}
+
+
+def write(stream, headers, rows, fmt=CSV, compress=False, flush_rows=FLUSH_ROWS):
+    """Write headers and rows to a binary stream; returns {Format, Rows, Bytes, Compressed}."""
+    if fmt not in _ENCODERS:
+        raise ValueError("Unsupported export format: %s" % fmt)
+    counter = [0]
+
+    def counted():
+        for row in rows:
+            counter[0] += 1
+            yield row
+
+    target = gzip.GzipFile(fileobj=stream, mode="wb") if compress else stream
+    written = 0
+    try:
+        for chunk in _ENCODERS[fmt](headers, counted(), flush_rows):
+            data = _encode(chunk)
+            target.write(data)
+            written += len(data)
+    finally:
+        if compress:
+            target.close()
+    return {"Format": fmt, "Rows": counter[0], "Bytes": written, "Compressed": bool(compress)}
+
+
+def file_name(base, fmt=CSV, compress=False):
+    return "%s.%s%s" % (base, fmt, ".gz" if compress else "")
+
+
+def export_file(headers, rows, fmt=CSV, compress=False, path=None, base_name="export"):
+    """Write an export to path (a new temp file by default); the summary adds Path and FileName."""
+    name = file_name(base_name, fmt, compress)
+    if path is None:
+        handle, path = tempfile.mkstemp(prefix=base_name + "-", suffix="-" + name)
+        os.close(handle)
+    with open(path, "wb") as stream:
+        summary = write(stream, headers, rows, fmt, compress)
+    summary["Path"] = path
+    summary["FileName"] = name
+    summary["ContentType"] = "application/gzip" if compress else CONTENT_TYPES[fmt]
+    return summary
@@ -0,0 +1,76 @@
+"""
+ValidationSession
+-----------------
+Re-validation of a bulk-import grid that changes a few cells at a time.
+
+- The validator, and the lookup tables it holds, is built once per session.
+- Each row's result is cached under the row's content plus its duplicate
+  status. validate() re-runs the rules only for rows whose content changed and
+  rows whose duplicate status changed because another row gained or lost the
+  same key.
+- Only results for the latest rows are kept, so memory follows the grid size.
+  Results are handed out as cached; callers must not modify them in place.
+- validate_row(row, duplicates) returns the result row, or None to drop the row;
+  duplicates maps every key that occurs more than once to its count.
+- duplicate_key(row) returns the key checked for duplicates; empty keys are
+  never duplicates.
+"""
+
+import json
+import threading
+
+
+def content_key(row):
+    """
+    Hashable snapshot of a row's fields. Rows parsed from one file share a key
+    order; a row whose keys come in another order only misses the cache.
+    """
+    items = tuple(row.items())
+    try:
+        hash(items)
+        return items
+    except TypeError:
+        return json.dumps(items, sort_keys=True, default=str)
+
+
+class ValidationSession(object):
+    def __init__(self, validate_row, duplicate_key):
+        self._validate_row = validate_row
+        self._duplicate_key = duplicate_key
+        self._results = {}  # {(content_key, is_duplicate): result}
+        self._lock = threading.Lock()
+        self.revalidated = 0  # rows run through the rules by the last validate()
+
+    def validate(self, rows):
+        rows = list(rows)
+        keys = [self._duplicate_key(row) for row in rows]
+        counts = {}
+        for key in keys:
+            if key:
+                counts[key] = counts.get(key, 0) + 1
+        duplicates = dict((key, count) for key, count in counts.items() if count > 1)
+
+        with self._lock:
+            previous = self._results
+            current = {}
+            processed = []
+            revalidated = 0
+            for row, key in zip(rows, keys):
+                cache_key = (content_key(row), key in duplicates)
+                if cache_key in current:
+                    result = current[cache_key]
+                elif cache_key in previous:
+                    result = previous[cache_key]
+                else:
+                    result = self._validate_row(row, duplicates)
+                    revalidated += 1
+                current[cache_key] = result
+                if result is not None:
+                    processed.append(result)
+            self._results = current
+            self.revalidated = revalidated
+        return processed
+
+    def clear(self):
+        with self._lock:
+            self._results = {}
@@ -0,0 +1,228 @@
+"""
+Keeps the cached material catalog (materials:<datasource>) current by applying
+material events to it instead of dropping it on every write.
+
+- MaterialCreated / MaterialUpdated replace or add the written material,
+  MaterialDeleted removes it; the snapshot is copied and swapped, so readers
+  holding the old list are not affected. MaterialRoutesLinked changes route
+  links only, which the catalog does not hold. Anything else (bulk imports,
+  an event without its material) drops the snapshot as before.
+- Inside a unit of work the update runs after the commit; a rollback leaves
+  the snapshot as it was.
+- Patching is a read-modify-write guarded by a process lock, so it only runs
+  on the gateway-local cache. When the cache port is not local (Ignite, shared
+  by several gateways) the snapshot is dropped instead.
+- usp_S_GetMaterial has no user parameter, so snapshots are per datasource
+  (feed_key()) and every user on it reads the snapshot a write patched. When
+  the datasource is unknown the snapshot falls back to the user id. refresh()
+  reloads a user's snapshot and reports the drift; the gateway timer script
+  MaterialController.check_catalog_consistency() runs it for the users
+  patched since its last run (take_patched_users()).
+- The search index is rebuilt from the patched snapshot on the next search.
+- Each applied change is announced on the ChangeFeed (FEED_MODEL, datasource)
+  as row ids, a dropped snapshot as a reset, so every open screen on the same
+  datasource refetches only what changed (get_materials_by_id(), served from
+  the patched snapshot). Without a datasource the change goes to every
+  subscriber.
+"""
+
+import threading
+
+from adapters.messaging.ChangeFeed import code as feed
+from common.logging.LogFactory import code as LogFactory
+from core.material.domain.Entities import code as EntitiesModule
+from core.material.domain.Events import code as events
+
+_LOG = LogFactory.get_logger("MaterialCatalogProjection")
+
+SNAPSHOT_KEY = "materials:%s"
+SEARCH_KEY = "materials-search:%s"
+SNAPSHOT_TTL_SECONDS = 60
+SEARCH_TTL_SECONDS = 60
+FEED_MODEL = "material-catalog"
+
+_REFRESH_IGNORED = ("InsertTime", "UpdateTime")  # formatted differently by the procedures
+
+_lock = threading.Lock()  # one read-modify-write of a snapshot at a time
+_patched_users = set()  # patched since the last consistency check
+
+
+def feed_key(repository, user_id):
+    """ChangeFeed key of user_id's catalog: the datasource, shared by every user reading the same tables."""
+    datasource_for = getattr(repository, "datasource_for", None)
+    if datasource_for is None:
+        return None
+    try:
+        return datasource_for(user_id)
+    except Exception:
+        return None
+
+
+def catalog_scope(repository, user_id):
+    """What user_id's snapshot is cached under: the datasource, or the user when it is unknown."""
+    return _scope(user_id, feed_key(repository, user_id))
+
+
+def _scope(user_id, key):
+    return key if key is not None else user_id
+
+
+def invalidate(cache_port, user_id, key=None):
+    if not cache_port:
+        return
+    for cache_key in (SNAPSHOT_KEY, SEARCH_KEY):
+        try:
+            cache_port.invalidate(cache_key % _scope(user_id, key))
+        except Exception:
+            pass
+    _announce(cache_port, key, reset=True)
+
+
+def _publish_change(cache_port, key, delta):
+    feed.publish(FEED_MODEL, key, **delta)
+
+
+def _announce(cache_port, key, **delta):
+    after_commit = getattr(cache_port, "after_commit", None)
+    if after_commit is not None:
+        after_commit(_publish_change, key, delta)
+    else:
+        _publish_change(cache_port, key, delta)
+
+
+def written(material, row=None):
+    """material as stored: ID, RowVersion, times etc. taken from the procedure's result row when it returns them."""
+    if not isinstance(row, dict) or not row:
+        return material
+    record = material.to_record()
+    for key, value in row.items():
+        if key in record and value is not None:
+            record[key] = value
+    if record.get("ID") is None and row.get("MaterialID") is not None:
+        record["ID"] = row.get("MaterialID")
+    return EntitiesModule.Material.from_record(record)
+
+
+def _is_local(cache_port):
+    is_local = getattr(cache_port, "is_local", None)
+    return is_local is None or is_local()
+
+
+def take_patched_users():
+    """User ids whose snapshot was patched since the last call."""
+    with _lock:
+        users = sorted(_patched_users)
+        _patched_users.clear()
+    return users
+
+
+def _material_id(item):
+    if isinstance(item, dict):
+        value = item.get("ID") or item.get("MaterialID")
+    else:
+        value = getattr(getattr(item, "material_id", None), "value", None)
+    return str(value) if value not in (None, "") else None
+
+
+def select(materials, material_ids):
+    """The materials with the given ids, in catalog order."""
+    wanted = set(str(material_id) for material_id in material_ids or [])
+    return [item for item in materials if _material_id(item) in wanted]
+
+
+def _patched(materials, material_id, replacement):
+    patched = []
+    found = False
+    for item in materials:
+        if _material_id(item) == material_id:
+            found = True
+            if replacement is not None:
+                patched.append(replacement)
+        else:
+            patched.append(item)
+    if not found and replacement is not None:
+        patched.append(replacement)
+    return patched
+
+
+def _change(event):
+    """(material id, replacement or None to remove, ChangeFeed state), or None when the event cannot be applied."""
+    if isinstance(event, (events.MaterialCreated, events.MaterialUpdated)):
+        material = getattr(event, "material", None)
+        material_id = _material_id(material) if material is not None else None
+        state = feed.ADDED if isinstance(event, events.MaterialCreated) else feed.CHANGED
+        return (material_id, material, state) if material_id else None
+    if isinstance(event, events.MaterialDeleted):
+        return (str(event.material_id), None, feed.REMOVED) if event.material_id not in (None, "") else None
+    return None
+
+
+def _apply(cache_port, user_id, event, key=None):
+    if isinstance(event, events.MaterialRoutesLinked):
+        return True
+    change = _change(event)
+    if change is None:
+        invalidate(cache_port, user_id, key)
+        return False
+    scope = _scope(user_id, key)
+    snapshot_key = SNAPSHOT_KEY % scope
+    try:
+        if _is_local(cache_port):
+            with _lock:
+                materials = cache_port.get(snapshot_key)
+                if materials is not None:
+                    cache_port.put(snapshot_key, _patched(materials, change[0], change[1]), SNAPSHOT_TTL_SECONDS)
+                    _patched_users.add(user_id)
+        else:
+            cache_port.invalidate(snapshot_key)
+        cache_port.invalidate(SEARCH_KEY % scope)
+    except Exception as exc:
+        _LOG.warn("Could not apply %s to the material catalog: %s" % (event.__class__.__name__, exc))
+        invalidate(cache_port, user_id, key)
+        return False
+    _publish_change(cache_port, key, {change[2]: [change[0]]})
+    return True
+
+
+def apply(cache_port, user_id, event, key=None):
+    """Apply a material event to user_id's cached catalog, after the commit inside a unit of work.
+
+    key is the datasource (feed_key()): the snapshot patched and the ChangeFeed key announced on.
+    """
+    if not cache_port:
+        return False
+    after_commit = getattr(cache_port, "after_commit", None)
+    if after_commit is not None:
+        after_commit(_apply, user_id, event, key)
+        return True
+    return _apply(cache_port, user_id, event, key)
+
+
+def refresh(repository, cache_port, user_id):
+    """Reload the catalog from the database and report how far the snapshot had drifted."""
+    materials = repository.fetch_materials(user_id)
+    key = feed_key(repository, user_id)
+    scope = _scope(user_id, key)
+    snapshot_key = SNAPSHOT_KEY % scope
+    drift = 0
+    with _lock:
+        cached = cache_port.get(snapshot_key) if cache_port else None
+        if cached is not None:
+            before = dict((_material_id(m), _record(m)) for m in cached)
+            after = dict((_material_id(m), _record(m)) for m in materials)
+            drift = len([k for k in set(before) | set(after) if before.get(k) != after.get(k)])
+        if cache_port:
+            cache_port.put(snapshot_key, materials, SNAPSHOT_TTL_SECONDS)
+    if cache_port:
+        cache_port.invalidate(SEARCH_KEY % scope)
+    if drift:
+        _LOG.warn("Material catalog of %s had drifted: %s material(s) differed" % (scope, drift))
+        feed.publish(FEED_MODEL, key, reset=True)
+    return {"Materials": len(materials), "Drift": drift, "Checked": cached is not None}
+
+
+def _record(item):
+    record = dict(item) if isinstance(item, dict) else item.to_record()
+    for key in _REFRESH_IGNORED:
+        record.pop(key, None)
+    return record
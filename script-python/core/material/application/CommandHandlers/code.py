@@ -1,43 +1,43 @@
 """Application service layer for handling write operations."""
 
+import json
+
+from adapters.persistence.BulkUploadEngine import code as bulk_upload
 from common.utils.Result import code as ResultModule
+from core.material.application.CatalogProjection import code as catalog
 from core.material.domain.Events import code as events
 
 Result = ResultModule.Result
 
 
-def _invalidate_material_cache(cache_port, user_id):
-    if not cache_port:
-        return
-    try:
-        cache_port.invalidate("materials:%s" % user_id)
-    except Exception:
-        pass
-
-
 def handle_create_material(cmd, repository, cache_port=None, messenger=None):
     result = repository.insert_material(cmd.material, cmd.user_id)
-    _invalidate_material_cache(cache_port, cmd.user_id)
+    material = catalog.written(cmd.material, result)
+    event = events.MaterialCreated(material.material_id.value, material.name, material)
+    catalog.apply(cache_port, cmd.user_id, event, catalog.feed_key(repository, cmd.user_id))
     if messenger:
-        messenger.publish(events.MaterialCreated(cmd.material.material_id.value, cmd.material.name))
-        messenger.info("Material created", material=cmd.material.to_record())
+        messenger.publish(event)
+        messenger.info("Material created", material=material.to_record())
     return Result.Ok(result)
 
 
 def handle_update_material(cmd, repository, cache_port=None, messenger=None):
     result = repository.update_material(cmd.material, cmd.user_id)
-    _invalidate_material_cache(cache_port, cmd.user_id)
+    material = catalog.written(cmd.material, result)
+    event = events.MaterialUpdated(material.material_id.value, material.name, material)
+    catalog.apply(cache_port, cmd.user_id, event, catalog.feed_key(repository, cmd.user_id))
     if messenger:
-        messenger.publish(events.MaterialUpdated(cmd.material.material_id.value, cmd.material.name))
-        messenger.info("Material updated", material=cmd.material.to_record())
+        messenger.publish(event)
+        messenger.info("Material updated", material=material.to_record())
     return Result.Ok(result)
 
 
 def handle_delete_material(cmd, repository, cache_port=None, messenger=None):
     result = repository.delete_material(cmd.material_id, cmd.updated_by, cmd.user_id)
-    _invalidate_material_cache(cache_port, cmd.user_id)
+    event = events.MaterialDeleted(cmd.material_id, cmd.updated_by)
+    catalog.apply(cache_port, cmd.user_id, event, catalog.feed_key(repository, cmd.user_id))
     if messenger:
-        messenger.publish(events.MaterialDeleted(cmd.material_id, cmd.updated_by))
+        messenger.publish(event)
         messenger.info("Material deleted", material_id=cmd.material_id)
     return Result.Ok(result)
 
@@ -75,3 +75,23 @@ def handle_bulk_upload_materials(cmd, repository, messenger=None):
         messenger.publish(events.MaterialsBulkImported(result.get("SuccessCount", 0), result.get("FailureCount", 0)))
         messenger.info("Bulk materials upload executed", summary=result)
     return Result.Ok(result)
+
+
+def handle_bulk_upload_materials_chunked(cmd, repository, cache_port=None, messenger=None):
+    def submit(rows):
+        return repository.bulk_upload_materials(json.dumps(rows), cmd.clock_id, cmd.user_id)
+
+    engine = bulk_upload.BulkUploadEngine("materials:%s" % cmd.user_id, submit, cmd.chunk_size)
+    report = engine.run(cmd.rows, cmd.upload_id)
+    if report["SuccessCount"]:
+        catalog.invalidate(cache_port, cmd.user_id, catalog.feed_key(repository, cmd.user_id))
+        if messenger:
+            messenger.publish(events.MaterialsBulkImported(report["SuccessCount"], report["FailureCount"]))
+    if messenger:
+        messenger.info(
+            "Chunked bulk materials upload executed",
+            upload_id=report["UploadID"],
+            chunks=report["ChunkCount"],
+            failed_chunks=report["FailedChunks"],
+        )
+    return Result.Ok(report)
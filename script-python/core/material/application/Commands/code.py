@@ -49,3 +49,12 @@ class BulkUploadMaterialsCommand(object):
         self.user_id = user_id
         self.json_materials = json_materials
         self.clock_id = clock_id
+
+
+class BulkUploadMaterialsChunkedCommand(object):
+    def __init__(self, user_id, rows, clock_id, upload_id=None, chunk_size=None):
+        self.user_id = user_id
+        self.rows = list(rows or [])
+        self.clock_id = clock_id
+        self.upload_id = upload_id
+        self.chunk_size = chunk_size
@@ -6,6 +6,20 @@ class GetAllMaterialsQuery(object):
         self.user_id = user_id
 
 
+class GetMaterialsByIdQuery(object):
+    def __init__(self, user_id, material_ids):
+        self.user_id = user_id
+        self.material_ids = material_ids
+
+
+class SearchMaterialsQuery(object):
+    def __init__(self, user_id, text, limit=20, filters=None):
+        self.user_id = user_id
+        self.text = text
+        self.limit = limit
+        self.filters = filters or {}
+
+
 class GetMaterialRouteLinksQuery(object):
     def __init__(self, user_id, material_id):
         self.user_id = user_id
@@ -22,6 +36,11 @@ class GetNcmTypesQuery(object):
         self.user_id = user_id
 
 
+class GetBulkLookupsQuery(object):
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+
 class ExportMaterialsQuery(object):
     def __init__(self, user_id):
         self.user_id = user_id
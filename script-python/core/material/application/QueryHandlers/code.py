@@ -1,8 +1,23 @@
 """Application service layer for handling read operations."""
 
+from common.utils.SearchIndex import code as search_index
+from core.material.application.CatalogProjection import code as catalog
+
+MATERIAL_SEARCH_FIELDS = {"Name": 3, "MaterialName": 3, "Description": 2, "MaterialDescription": 1}
+
+MATERIAL_EXPORT_HEADERS = [
+    "SAPMaterialID",
+    "MaterialName",
+    "Description",
+    "IdleCycleTime(min)",
+    "NCMType",
+    "BaseQuantity",
+    "RouteNumber",
+    "Action",
+]
 
 def handle_get_all_materials(query, repository, cache_port=None):
-    cache_key = "materials:%s" % query.user_id
+    cache_key = catalog.SNAPSHOT_KEY % catalog.catalog_scope(repository, query.user_id)
     if cache_port:
         cached = cache_port.get(cache_key)
         if cached is not None:
@@ -10,12 +25,31 @@ def handle_get_all_materials(query, repository, cache_port=None):
     materials = repository.fetch_materials(query.user_id)
     if cache_port:
         try:
-            cache_port.put(cache_key, materials, ttl_seconds=60)
+            cache_port.put(cache_key, materials, ttl_seconds=catalog.SNAPSHOT_TTL_SECONDS)
         except Exception:
             pass
     return materials
 
 
+def handle_get_materials_by_id(query, repository, cache_port=None):
+    """Rows of the given ids from the catalog snapshot, which the write side patches before announcing them."""
+    return catalog.select(handle_get_all_materials(query, repository, cache_port), query.material_ids)
+
+
+def handle_search_materials(query, repository, cache_port=None):
+    cache_key = catalog.SEARCH_KEY % catalog.catalog_scope(repository, query.user_id)
+    index = cache_port.get(cache_key) if cache_port else None
+    if index is None:
+        materials = handle_get_all_materials(query, repository, cache_port)
+        index = search_index.SearchIndex(materials, MATERIAL_SEARCH_FIELDS)
+        if cache_port:
+            try:
+                cache_port.put(cache_key, index, ttl_seconds=catalog.SEARCH_TTL_SECONDS)
+            except Exception:
+                pass
+    return index.search(query.text, query.limit, query.filters)
+
+
 def handle_get_material_route_links(query, repository):
     return repository.fetch_material_route_links(query.material_id, query.user_id)
 
@@ -28,33 +62,46 @@ def handle_get_ncm_types(query, repository):
     return repository.fetch_ncm_types(query.user_id)
 
 
-def handle_export_materials(query, repository, cache_port=None):
-    materials = handle_get_all_materials(query, repository, cache_port)
-    headers = [
-        "SAPMaterialID",
-        "MaterialName",
-        "Description",
-        "IdleCycleTime(min)",
-        "NCMType",
-        "BaseQuantity",
-        "RouteNumber",
-        "Action",
+def handle_get_bulk_lookups(query, repository, cache_port=None):
+    lookups = repository.fetch_bulk_lookups(query.user_id)
+    if cache_port:
+        try:
+            cache_port.put(catalog.SNAPSHOT_KEY % catalog.catalog_scope(repository, query.user_id),
+                           lookups.get("materials"),
+                           ttl_seconds=catalog.SNAPSHOT_TTL_SECONDS)
+        except Exception:
+            pass
+    return lookups
+
+
+def _export_row(item):
+    source = item if isinstance(item, dict) else getattr(item, "to_record", lambda: item)()
+    return [
+        source.get("MaterialName") or source.get("Name"),
+        source.get("MaterialDescription") or source.get("Description"),
+        source.get("MaterialDescription"),
+        source.get("IdealCycleTime"),
+        source.get("NCM"),
+        float(source.get("BaseQuantity") or 0),
+        source.get("DefaultRoute"),
+        "I",
     ]
-    data = []
+
+
+def iter_material_export_rows(materials):
     for item in materials or []:
-        source = item if isinstance(item, dict) else getattr(item, "to_record", lambda: item)()
-        row = [
-            source.get("MaterialName") or source.get("Name"),
-            source.get("MaterialDescription") or source.get("Description"),
-            source.get("MaterialDescription"),
-            source.get("IdealCycleTime"),
-            source.get("NCM"),
-            float(source.get("BaseQuantity") or 0),
-            source.get("DefaultRoute"),
-            "I",
-        ]
-        data.append(row)
-    return {"headers": headers, "data": data}
+        yield _export_row(item)
+
+
+def handle_export_materials(query, repository, cache_port=None):
+    materials = handle_get_all_materials(query, repository, cache_port)
+    return {"headers": list(MATERIAL_EXPORT_HEADERS), "data": list(iter_material_export_rows(materials))}
+
+
+def handle_stream_export_materials(query, repository, cache_port=None):
+    """Export headers plus a generator of rows mapped lazily from the (cached) material list."""
+    materials = handle_get_all_materials(query, repository, cache_port)
+    return {"headers": list(MATERIAL_EXPORT_HEADERS), "rows": iter_material_export_rows(materials)}
 
 
 def handle_filter_bulk_materials(query):
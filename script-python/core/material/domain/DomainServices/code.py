@@ -1,7 +1,16 @@
 """Domain services encapsulating business rules for materials."""
 
+from common.concurrency.Executor import code as Executor
+from common.utils.RuleEngine import code as RuleEngine
+from common.utils.ValidationSession import code as ValidationSession
 from core.material.domain.Entities import code as EntitiesModule
 
+VALIDATION_POOL = "material-validation"
+VALIDATION_POOL_SIZE = 4
+VALIDATION_WORKERS = 4
+VALIDATION_PARTITION_SIZE = 5000
+
+ERROR_STYLE = {"backgroundColor": "#FF474C", "font-weight": "bold", "color": "#FFFFFF"}
 
 class MaterialFactory(object):
     """Factory that safeguards creation of Material aggregates."""
@@ -50,6 +59,28 @@ class MaterialFactory(object):
         )
 
 
+def _sap_material_id(row):
+    return row.get("SAPMaterialID")
+
+
+def _check_existing_material(raw, context):
+    action = context["action"]
+    material_ref = context["material"]
+    if action == "I":
+        if not material_ref:
+            return None
+        if isinstance(material_ref, dict):
+            has_route = bool(material_ref.get("DefaultRoute"))
+        else:
+            has_route = getattr(material_ref, "default_route", None) not in (None, "")
+        if raw.get("RouteNumber") and has_route:
+            return "SAPMaterialID with given Route Already exists"
+        return "SAPMaterialID Already exists"
+    if action in ("U", "D") and not material_ref:
+        return "SAPMaterialID does not exists"
+    return None
+
+
 class BulkMaterialValidationService(object):
     """Executes domain validation rules for bulk material import rows."""
 
@@ -93,84 +124,97 @@ class BulkMaterialValidationService(object):
             if mid:
                 self._materials_in_work_orders.add(str(mid))
 
+        self._validator = self._rules().compile()
+
+    def _rules(self):
+        return RuleEngine.RuleSet([
+            RuleEngine.unique("SAPMaterialID", "Same SAPMaterialID present multiple times"),
+            RuleEngine.rule("existing-material", _check_existing_material),
+            RuleEngine.required("MaterialName", "Please Enter Material Name"),
+            RuleEngine.positive_number("IdealCycleTime", "Idle Cycle Time must be greater than 0"),
+            RuleEngine.required("NCMTypeID", "Please Enter Valid NCM"),
+            RuleEngine.positive_number("BaseQuantity", "BaseQuantity must be greater than 0"),
+            RuleEngine.member_of("RouteNumber", self._routes_lookup, "Please Enter Valid Route Number", optional=True),
+            RuleEngine.action_code(RuleEngine.from_context("action")),
+            RuleEngine.rule("work-orders", self._check_work_orders,
+                            when=RuleEngine.field_in(RuleEngine.from_context("action"), ["D"])),
+        ])
+
+    def _check_work_orders(self, raw, context):
+        material_ref = context["material"]
+        if not material_ref:
+            return None
+        if isinstance(material_ref, dict):
+            material_id = material_ref.get("ID") or material_ref.get("MaterialID")
+        else:
+            material_id = getattr(material_ref.material_id, "value", None)
+        if material_id and str(material_id) in self._materials_in_work_orders:
+            return "WorkOrder exists against material Cannot be Deleted"
+        return None
+
     def validate(self, rows):
-        processed = []
         duplicates = self._detect_duplicates(rows)
+        return self._validate_range(rows, 0, len(rows), duplicates)
+
+    def validate_batched(self, rows, workers=None, partition_size=None):
+        """
+        Validate rows in contiguous partitions on the shared validation pool.
+        Lookup tables are read-only after __init__, so every worker uses them as-is;
+        the duplicate check runs once over all rows before the partitions start and
+        the result keeps input order. Falls back to validate() for small inputs.
+        """
+        workers = workers or VALIDATION_WORKERS
+        partition_size = partition_size or VALIDATION_PARTITION_SIZE
+        total = len(rows)
+        if workers <= 1 or total <= partition_size:
+            return self.validate(rows)
 
-        for raw in rows:
-            bulk_row = EntitiesModule.BulkMaterialRow(raw)
-            if not bulk_row.sap_material_id:
-                continue  # skip empty rows silently
-
-            if bulk_row.sap_material_id in duplicates:
-                bulk_row.add_error("Same SAPMaterialID present multiple times")
-
-            action = bulk_row.action or "I"
-            material_ref = self._materials_by_sap.get(bulk_row.sap_material_id)
-
-            if action == "I":
-                if material_ref:
-                    has_route = False
-                    if isinstance(material_ref, dict):
-                        has_route = bool(material_ref.get("DefaultRoute"))
-                        material_id = material_ref.get("ID")
-                    else:
-                        has_route = getattr(material_ref, "default_route", None) not in (None, "")
-                        material_id = getattr(material_ref.material_id, "value", None)
-                    if bulk_row.route_number and has_route:
-                        bulk_row.add_error("SAPMaterialID with given Route Already exists")
-                    else:
-                        bulk_row.add_error("SAPMaterialID Already exists")
-            elif action in ("U", "D"):
-                if not material_ref:
-                    bulk_row.add_error("SAPMaterialID does not exists")
-
-            if not bulk_row.material_name:
-                bulk_row.add_error("Please Enter Material Name")
-
-            try:
-                if float(bulk_row.ideal_cycle_time) <= 0:
-                    bulk_row.add_error("Idle Cycle Time must be greater than 0")
-            except Exception:
-                bulk_row.add_error("Idle Cycle Time must be greater than 0")
-
-            ncm_type_id = self._ncm_lookup.get(bulk_row.ncm_type)
-            if not ncm_type_id:
-                bulk_row.add_error("Please Enter Valid NCM")
-            raw.update({"NCMTypeID": ncm_type_id})
-
-            base_qty_raw = raw.get("BaseQuantity")
-            try:
-                base_qty = float(str(base_qty_raw).replace(",", ""))
-            except Exception:
-                base_qty = -1
-            if base_qty <= 0:
-                bulk_row.add_error("BaseQuantity must be greater than 0")
-            raw["BaseQuantity"] = base_qty
-
-            if bulk_row.route_number and bulk_row.route_number not in self._routes_lookup:
-                bulk_row.add_error("Please Enter Valid Route Number")
-
-            if action not in ("I", "U", "D"):
-                bulk_row.add_error("Please Enter Valid Action(I/U/D)")
-
-            if action == "D" and material_ref:
-                material_id = None
-                if isinstance(material_ref, dict):
-                    material_id = material_ref.get("ID") or material_ref.get("MaterialID")
-                else:
-                    material_id = getattr(material_ref.material_id, "value", None)
-                if material_id and str(material_id) in self._materials_in_work_orders:
-                    bulk_row.add_error("WorkOrder exists against material Cannot be Deleted")
-
-            if bulk_row.is_valid():
-                raw["Flag"] = 0
-            else:
-                raw["Flag"] = 1
-            raw.update(bulk_row.to_feedback())
-            processed.append(raw)
+        duplicates = self._detect_duplicates(rows)
+        size = max(partition_size, -(-total // workers))
+        pool = Executor.shared(VALIDATION_POOL, VALIDATION_POOL_SIZE)
+        futures = [
+            pool.submit(self._validate_range, rows, start, min(start + size, total), duplicates)
+            for start in range(0, total, size)
+        ]
+        processed = []
+        for future in futures:
+            processed.extend(future.result())
+        return processed
+
+    def session(self):
+        """ValidationSession over these lookups that re-validates only changed rows."""
+        return ValidationSession.ValidationSession(self._session_row, _sap_material_id)
+
+    def _session_row(self, raw, duplicates):
+        return raw if self._validate_row(raw, duplicates) else None
+
+    def _validate_range(self, rows, start, stop, duplicates):
+        processed = []
+        for index in range(start, stop):
+            raw = rows[index]
+            if self._validate_row(raw, duplicates):
+                processed.append(raw)
         return processed
 
+    def _validate_row(self, raw, duplicates):
+        """Validate one row in place; False for rows without SAPMaterialID, which are skipped."""
+        sap_material_id = raw.get("SAPMaterialID")
+        if not sap_material_id:
+            return False
+        context = {
+            "duplicates": duplicates,
+            "action": (raw.get("Action") or "").upper() or "I",
+            "material": self._materials_by_sap.get(sap_material_id),
+        }
+        raw["NCMTypeID"] = self._ncm_lookup.get(raw.get("NCMType"))
+        base_qty = RuleEngine.to_float(str(raw.get("BaseQuantity")).replace(",", ""))
+        raw["BaseQuantity"] = -1 if base_qty is None else base_qty
+
+        errors = self._validator(raw, context)
+        raw["Flag"] = 1 if errors else 0
+        raw["Reasons"] = {"value": ",".join(errors), "style": dict(ERROR_STYLE) if errors else {}}
+        return True
+
     @staticmethod
     def _detect_duplicates(rows):
         seen = set()
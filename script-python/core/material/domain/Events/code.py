@@ -1,15 +1,18 @@
 """Domain events emitted by the Material aggregate."""
 
 class MaterialCreated(object):
-    def __init__(self, material_id, name):
+    # material: the Material as written, for in-process projections (not published)
+    def __init__(self, material_id, name, material=None):
         self.material_id = material_id
         self.name = name
+        self.material = material
 
 
 class MaterialUpdated(object):
-    def __init__(self, material_id, name):
+    def __init__(self, material_id, name, material=None):
         self.material_id = material_id
         self.name = name
+        self.material = material
 
 
 class MaterialDeleted(object):
@@ -5,6 +5,9 @@ def get_cache():
     cache = ignite.get("material")
     return cache if cache else local
 
+def is_local():
+    return get_cache() is local
+
 def get(key):
     return get_cache().get("material", key)
 
@@ -1,17 +1,39 @@
 """Messaging adapter bridging to configured event transport and logging."""
 
-from adapters.messaging import MessageRouter as router
+from adapters.messaging.EventMapping import code as EventMapping
+from adapters.messaging.Outbox import code as outbox
+from adapters.persistence.UnitOfWork import code as UnitOfWork
 from common.logging.LogFactory import code as LogFactory
+from core.material.domain.Events import code as events
 
 _LOG = LogFactory.get_logger("MaterialMessaging")
 
+NOUN = "MaterialDefinition"
+
+EVENTS = EventMapping.Registry()
+EVENTS.register(events.MaterialCreated, NOUN, "SyncAdd", [("MaterialID", "material_id"), ("Name", "name")])
+EVENTS.register(events.MaterialUpdated, NOUN, "SyncChange", [("MaterialID", "material_id"), ("Name", "name")])
+EVENTS.register(events.MaterialDeleted, NOUN, "SyncDelete",
+                [("MaterialID", "material_id"), ("DeletedBy", "deleted_by")])
+EVENTS.register(events.MaterialRoutesLinked, NOUN, "SyncRoutes",
+                [("MaterialID", "material_id"), ("RouteIDs", "route_ids")])
+EVENTS.register(events.MaterialsBulkImported, "MaterialBulkImport", "Process",
+                [("ImportedCount", "imported_count"), ("FailedCount", "failed_count")])
+
 
 class Messenger(object):
-    def publish(self, envelope):
+    # publish() writes to the outbox, so it runs inside the caller's unit of work
+    TRANSACTIONAL = ("publish",)
+
+    def publish(self, event):
+        """Map a domain event (or envelope dict) to its ISA-95 envelope and topic and queue it."""
         try:
-            topic = envelope.get("noun", "event") if isinstance(envelope, dict) else "event"
-            return router.publish(topic, envelope)
+            topic, envelope = EVENTS.map(event)
+            event_type = "%s.%s" % (envelope.get("noun"), envelope.get("verb"))
+            return outbox.append(topic, event_type, envelope)
         except Exception as exc:
+            if UnitOfWork.current() is not None:
+                raise  # the write must not commit without its event
             _LOG.error("Failed to publish material event: %s" % exc)
             return None
 
@@ -2,6 +2,8 @@
 
 import json
 
+from adapters.persistence.PersistenceGateway import code as gateway
+from adapters.persistence.QueryBatch import code as query_batch
 from common.cache.CacheManager import code as cache
 from common.exceptions import RepositoryException as rex
 from common.logging.LogFactory import code as LogFactory
@@ -55,16 +57,27 @@ def _resolve_datasource(user_id):
     return datasource
 
 
+def datasource_for(user_id):
+    """Datasource holding user_id's materials."""
+    return _resolve_datasource(user_id)
+
+
 def _run_query(statement, params, datasource):
     try:
-        from system.db import runPrepQuery
-
-        if datasource:
-            return runPrepQuery(statement, params, datasource)
-        return runPrepQuery(statement, params)
-    except Exception:
+        return gateway.run_query(statement, params, datasource)
+    except gateway.Unavailable:
         # outside Ignition we just simulate empty set
         return []
+    except Exception as ex:
+        if gateway.current_scope() is not None:
+            raise  # let the unit of work roll back
+        if gateway.is_busy(ex):
+            raise  # an empty result would be cached as the catalog
+        return []
+
+
+def _call(procedure, params, datasource):
+    return gateway.call_with(_run_query, procedure, params, datasource)
 
 
 def _dataset_to_dicts(dataset):
@@ -97,12 +110,9 @@ def _first_row(dataset):
     return rows[0] if rows else {}
 
 
-def fetch_materials(user_id):
-    ds = _resolve_datasource(user_id)
-    statement = "EXEC %s" % SP_GET_MATERIALS
-    rows = _dataset_to_dicts(_run_query(statement, [], ds))
+def _to_materials(dataset):
     materials = []
-    for row in rows:
+    for row in _dataset_to_dicts(dataset):
         try:
             materials.append(Material.from_record(row))
         except Exception as exc:
@@ -110,6 +120,37 @@ def fetch_materials(user_id):
     return materials
 
 
+def _to_routes(dataset):
+    return [Route.from_record(row) for row in _dataset_to_dicts(dataset)]
+
+
+def _to_ncm_types(dataset):
+    return [NcmType.from_record(row) for row in _dataset_to_dicts(dataset)]
+
+
+def run_batch(calls, user_id):
+    """Run independent BatchCall objects concurrently; returns {key: result}."""
+    ds = _resolve_datasource(user_id)
+    return query_batch.run(calls, _run_query, ds)
+
+
+def fetch_bulk_lookups(user_id):
+    """Materials, routes and NCM types needed by bulk-import validation in one round trip."""
+    return run_batch(
+        [
+            query_batch.BatchCall("materials", SP_GET_MATERIALS, mapper=_to_materials),
+            query_batch.BatchCall("routes", SP_GET_ROUTES, mapper=_to_routes),
+            query_batch.BatchCall("ncm_types", SP_GET_NCM_TYPES, mapper=_to_ncm_types),
+        ],
+        user_id,
+    )
+
+
+def fetch_materials(user_id):
+    ds = _resolve_datasource(user_id)
+    return _to_materials(_call(SP_GET_MATERIALS, [], ds))
+
+
 def insert_material(material, user_id):
     ds = _resolve_datasource(user_id)
     record = material.to_record()
@@ -132,11 +173,7 @@ def insert_material(material, user_id):
         ("@BaseQuantity", record.get("BaseQuantity")),
         ("@MaterialDescription", record.get("MaterialDescription")),
     ]
-    statement = "EXEC %s %s" % (
-        SP_INSERT_MATERIAL,
-        ", ".join(["%s=?" % name for name, _ in params]),
-    )
-    result = _first_row(_run_query(statement, [value for _, value in params], ds))
+    result = _first_row(_call(SP_INSERT_MATERIAL, params, ds))
     message = result.get("OutputMessage")
     if message and message not in ("[[STPSuccessfullyAdded]]", "[[STPSuccess]]"):
         raise rex.RepositoryException(message)
@@ -166,11 +203,7 @@ def update_material(material, user_id):
         ("@BaseQuantity", record.get("BaseQuantity")),
         ("@MaterialDescription", record.get("MaterialDescription")),
     ]
-    statement = "EXEC %s %s" % (
-        SP_UPDATE_MATERIAL,
-        ", ".join(["%s=?" % name for name, _ in params]),
-    )
-    result = _first_row(_run_query(statement, [value for _, value in params], ds))
+    result = _first_row(_call(SP_UPDATE_MATERIAL, params, ds))
     message = result.get("OutputMessage")
     if message and message not in ("[[STPSuccessfullyUpdated]]", "[[STPSuccess]]"):
         raise rex.RepositoryException(message)
@@ -183,28 +216,19 @@ def delete_material(material_id, updated_by, user_id):
         ("@MaterialID", material_id),
         ("@UpdatedBy", updated_by),
     ]
-    statement = "EXEC %s %s" % (
-        SP_DELETE_MATERIAL,
-        ", ".join(["%s=?" % name for name, _ in params]),
-    )
-    return _first_row(_run_query(statement, [value for _, value in params], ds))
+    return _first_row(_call(SP_DELETE_MATERIAL, params, ds))
 
 
 def fetch_material_route_links(material_id, user_id):
     ds = _resolve_datasource(user_id)
     params = [("@MaterialID", material_id)]
-    statement = "EXEC %s %s" % (
-        SP_GET_ROUTE_LINKS,
-        ", ".join(["%s=?" % name for name, _ in params]),
-    )
-    rows = _dataset_to_dicts(_run_query(statement, [value for _, value in params], ds))
+    rows = _dataset_to_dicts(_call(SP_GET_ROUTE_LINKS, params, ds))
     return [MaterialRouteLink.from_record(row) for row in rows]
 
 
 def fetch_routes(user_id):
     ds = _resolve_datasource(user_id)
-    rows = _dataset_to_dicts(_run_query("EXEC %s" % SP_GET_ROUTES, [], ds))
-    return [Route.from_record(row) for row in rows]
+    return _to_routes(_call(SP_GET_ROUTES, [], ds))
 
 
 def insert_route_link(route_dataset, material_id, user_id):
@@ -213,11 +237,7 @@ def insert_route_link(route_dataset, material_id, user_id):
         ("@RouteData", route_dataset),
         ("@MaterialID", material_id),
     ]
-    statement = "EXEC %s %s" % (
-        SP_INSERT_ROUTE_LINK,
-        ", ".join(["%s=?" % name for name, _ in params]),
-    )
-    return _first_row(_run_query(statement, [value for _, value in params], ds))
+    return _first_row(_call(SP_INSERT_ROUTE_LINK, params, ds))
 
 
 def update_default_route(material_id, route_id, is_secondary, user_id):
@@ -227,11 +247,7 @@ def update_default_route(material_id, route_id, is_secondary, user_id):
         ("@RouteID", route_id),
         ("@IsSecondary", is_secondary),
     ]
-    statement = "EXEC %s %s" % (
-        SP_UPDATE_DEFAULT_ROUTE,
-        ", ".join(["%s=?" % name for name, _ in params]),
-    )
-    return _first_row(_run_query(statement, [value for _, value in params], ds))
+    return _first_row(_call(SP_UPDATE_DEFAULT_ROUTE, params, ds))
 
 
 def delete_route_link(material_id, route_id, user_id):
@@ -240,17 +256,12 @@ def delete_route_link(material_id, route_id, user_id):
         ("@MaterialID", material_id),
         ("@RouteID", route_id),
     ]
-    statement = "EXEC %s %s" % (
-        SP_DELETE_ROUTE_LINK,
-        ", ".join(["%s=?" % name for name, _ in params]),
-    )
-    return _first_row(_run_query(statement, [value for _, value in params], ds))
+    return _first_row(_call(SP_DELETE_ROUTE_LINK, params, ds))
 
 
 def fetch_ncm_types(user_id):
     ds = _resolve_datasource(user_id)
-    rows = _dataset_to_dicts(_run_query("EXEC %s" % SP_GET_NCM_TYPES, [], ds))
-    return [NcmType.from_record(row) for row in rows]
+    return _to_ncm_types(_call(SP_GET_NCM_TYPES, [], ds))
 
 
 def bulk_upload_materials(json_materials, clock_id, user_id):
@@ -259,8 +270,4 @@ def bulk_upload_materials(json_materials, clock_id, user_id):
         ("@JsonMaterialsList", json_materials),
         ("@ClockID", clock_id),
     ]
-    statement = "EXEC %s %s" % (
-        SP_BULK_UPLOAD,
-        ", ".join(["%s=?" % name for name, _ in params]),
-    )
-    return _first_row(_run_query(statement, [value for _, value in params], ds))
+    return _first_row(_call(SP_BULK_UPLOAD, params, ds))
@@ -14,6 +14,9 @@ class MaterialRepositoryPort(object):
     def fetch_ncm_types(self, user_id):
         raise NotImplementedError
 
+    def fetch_bulk_lookups(self, user_id):
+        raise NotImplementedError
+
     def insert_material(self, material, user_id):
         raise NotImplementedError
 
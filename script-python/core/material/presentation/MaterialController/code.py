@@ -1,6 +1,10 @@
 """Material controller exposing application layer to Ignition scripts."""
 
+from adapters.messaging.ChangeFeed import code as feed
+from adapters.persistence.UnitOfWork import code as UnitOfWork
+from common.concurrency.Executor import code as executor
 from common.logging.LogFactory import code as LogFactory
+from core.material.application.CatalogProjection import code as catalog
 from core.material.application.Commands import code as cmds
 from core.material.application.CommandHandlers import code as ch
 from core.material.application.Queries import code as queries
@@ -11,6 +15,13 @@ from core.material.infrastructure.CacheAdapter import code as cache
 from core.material.infrastructure.MessagingAdapter import code as messaging
 
 _LOG = LogFactory.get_logger("MaterialController")
+_QUERY_POOL = "material-queries"
+_QUERY_POOL_SIZE = 8
+
+try:
+    string_types = (basestring,)  # type: ignore[name-defined]
+except Exception:  # pragma: no cover - Python 3 fallback
+    string_types = (str,)
 
 
 class MaterialController(object):
@@ -28,17 +39,49 @@ class MaterialController(object):
             _LOG.error("Failed to get materials: %s" % exc)
             raise
 
+    def get_materials_by_id(self, material_ids):
+        """The given materials from the catalog snapshot, for refetching the ids of a pushed change."""
+        q = queries.GetMaterialsByIdQuery(self.user_id, material_ids)
+        return qh.handle_get_materials_by_id(q, self.repository, self.cache_port)
+
+    def search_materials(self, text, limit=20, filters=None):
+        q = queries.SearchMaterialsQuery(self.user_id, text, limit, filters)
+        return qh.handle_search_materials(q, self.repository, self.cache_port)
+
     def create_material(self, payload):
         command = cmds.CreateMaterialCommand(self.user_id, payload)
-        return ch.handle_create_material(command, self.repository, self.cache_port, self.messenger)
+        with UnitOfWork.UnitOfWork() as uow:
+            return ch.handle_create_material(command, self.repository, uow.cache(self.cache_port),
+                                             uow.events(self.messenger))
 
     def update_material(self, payload):
         command = cmds.UpdateMaterialCommand(self.user_id, payload)
-        return ch.handle_update_material(command, self.repository, self.cache_port, self.messenger)
+        with UnitOfWork.UnitOfWork() as uow:
+            return ch.handle_update_material(command, self.repository, uow.cache(self.cache_port),
+                                             uow.events(self.messenger))
 
     def delete_material(self, material_id, updated_by):
         command = cmds.DeleteMaterialCommand(self.user_id, material_id, updated_by)
-        return ch.handle_delete_material(command, self.repository, self.cache_port, self.messenger)
+        with UnitOfWork.UnitOfWork() as uow:
+            return ch.handle_delete_material(command, self.repository, uow.cache(self.cache_port),
+                                             uow.events(self.messenger))
+
+    def update_material_with_default_route(self, payload, route_id, is_secondary=0):
+        """Update a material and its default route in one transaction with their outbox events."""
+        command = cmds.UpdateMaterialCommand(self.user_id, payload)
+        with UnitOfWork.UnitOfWork() as uow:
+            cache_port = uow.cache(self.cache_port)
+            messenger = uow.events(self.messenger)
+            result = ch.handle_update_material(command, self.repository, cache_port, messenger)
+            route_command = cmds.UpdateDefaultRouteCommand(
+                self.user_id, command.material.material_id.value, route_id, is_secondary
+            )
+            ch.handle_update_default_route(route_command, self.repository, messenger)
+        return result
+
+    def refresh_catalog(self):
+        """Reload the cached catalog and report drift (check_catalog_consistency() runs it on a timer)."""
+        return catalog.refresh(self.repository, self.cache_port, self.user_id)
 
     def get_material_route_links(self, material_id):
         q = queries.GetMaterialRouteLinksQuery(self.user_id, material_id)
@@ -50,7 +93,8 @@ class MaterialController(object):
 
     def insert_material_route_link(self, route_dataset, material_id):
         command = cmds.InsertMaterialRouteLinkCommand(self.user_id, route_dataset, material_id)
-        return ch.handle_insert_route_link(command, self.repository, self.messenger)
+        with UnitOfWork.UnitOfWork() as uow:
+            return ch.handle_insert_route_link(command, self.repository, uow.events(self.messenger))
 
     def update_default_route(self, material_id, route_id, is_secondary=0):
         command = cmds.UpdateDefaultRouteCommand(self.user_id, material_id, route_id, is_secondary)
@@ -64,24 +108,64 @@ class MaterialController(object):
         q = queries.GetNcmTypesQuery(self.user_id)
         return qh.handle_get_ncm_types(q, self.repository)
 
+    def get_bulk_lookups(self):
+        q = queries.GetBulkLookupsQuery(self.user_id)
+        return qh.handle_get_bulk_lookups(q, self.repository, self.cache_port)
+
     def bulk_upload_materials(self, json_materials, clock_id):
         command = cmds.BulkUploadMaterialsCommand(self.user_id, json_materials, clock_id)
-        return ch.handle_bulk_upload_materials(command, self.repository, self.messenger)
+        with UnitOfWork.UnitOfWork() as uow:
+            return ch.handle_bulk_upload_materials(command, self.repository, uow.events(self.messenger))
+
+    def bulk_upload_materials_chunked(self, rows, clock_id, upload_id=None, chunk_size=None):
+        command = cmds.BulkUploadMaterialsChunkedCommand(self.user_id, rows, clock_id, upload_id, chunk_size)
+        return ch.handle_bulk_upload_materials_chunked(command, self.repository, self.cache_port, self.messenger)
+
+    def subscribe_catalog_changes(self, session_id, page_id=None):
+        """Push catalog deltas of this user's datasource to the page; call again before the lease runs out."""
+        return feed.subscribe(session_id, catalog.FEED_MODEL, [catalog.feed_key(self.repository, self.user_id)],
+                              page_id)
 
     def export_materials(self):
         q = queries.ExportMaterialsQuery(self.user_id)
         return qh.handle_export_materials(q, self.repository, self.cache_port)
 
+    def stream_export_materials(self):
+        q = queries.ExportMaterialsQuery(self.user_id)
+        return qh.handle_stream_export_materials(q, self.repository, self.cache_port)
+
     def filter_valid_materials(self, materials_data):
         q = queries.FilterBulkMaterialsQuery(materials_data)
         return qh.handle_filter_bulk_materials(q)
 
-    def validate_bulk_material_rows(self, rows, existing_materials=None, ncm_types=None, routes=None, work_orders=None):
+    def gather(self, calls, timeout=None, timeouts=None):
+        """
+        Run independent queries concurrently and return {name: result}.
+        calls maps a name to a query method name or callable, e.g.
+        {"materials": "get_materials", "routes": "get_routes"}.
+        """
+        resolved = {}
+        for name, call in calls.items():
+            resolved[name] = getattr(self, call) if isinstance(call, string_types) else call
+        pool = executor.shared(_QUERY_POOL, _QUERY_POOL_SIZE)
+        return executor.gather(resolved, timeout=timeout, timeouts=timeouts, pool=pool)
+
+    def validate_bulk_material_rows(self, rows, existing_materials=None, ncm_types=None, routes=None, work_orders=None,
+                                    batched=False, workers=None):
         service = DomainServicesModule.BulkMaterialValidationService(existing_materials, ncm_types, routes, work_orders)
+        if batched:
+            return service.validate_batched(rows, workers=workers)
         return service.validate(rows)
 
+    def create_bulk_validation_session(self, existing_materials=None, ncm_types=None, routes=None, work_orders=None):
+        service = DomainServicesModule.BulkMaterialValidationService(existing_materials, ncm_types, routes, work_orders)
+        return service.session()
+
 
 class _RepositoryAdapter(object):
+    def datasource_for(self, user_id):
+        return repo.datasource_for(user_id)
+
     def fetch_materials(self, user_id):
         return repo.fetch_materials(user_id)
 
@@ -94,6 +178,9 @@ class _RepositoryAdapter(object):
     def fetch_ncm_types(self, user_id):
         return repo.fetch_ncm_types(user_id)
 
+    def fetch_bulk_lookups(self, user_id):
+        return repo.fetch_bulk_lookups(user_id)
+
     def insert_material(self, material, user_id):
         return repo.insert_material(material, user_id)
 
@@ -125,3 +212,17 @@ class _CachePort(object):
 
     def invalidate(self, key=None):
         return cache.invalidate(key)
+
+    def is_local(self):
+        return cache.is_local()
+
+
+def check_catalog_consistency():
+    """Gateway timer script: reload the catalogs patched since the last run; returns {user id: drift report}."""
+    reports = {}
+    for user_id in catalog.take_patched_users():
+        try:
+            reports[user_id] = MaterialController(user_id).refresh_catalog()
+        except Exception as exc:
+            _LOG.error("Catalog consistency check failed for %s: %s" % (user_id, exc))
+    return reports
@@ -3,6 +3,9 @@
 import csv
 import io
 
+from common.cache.CacheManager import code as local_cache
+from common.concurrency.Executor import code as executor
+from common.utils.StreamingExport import code as streaming_export
 from core.material.presentation.MaterialController import code as MaterialControllerModule
 
 try:
@@ -47,6 +50,16 @@ DEFAULT_ROUTE_COLUMNS = [
     "value",
 ]
 
+# Imports above this many rows are validated in partitions on the worker pool.
+BATCHED_VALIDATION_THRESHOLD = 5000
+
+# Longest a bulk validation waits for the work order lookup before failing.
+LOOKUP_TIMEOUT_SECONDS = 30
+
+# Validation sessions hold live lookup tables, so they stay in the local cache.
+VALIDATION_SESSION_CACHE = "bulk-validation"
+VALIDATION_SESSION_TTL_SECONDS = 30 * 60
+
 
 def _object_to_dict(obj):
     if hasattr(obj, "to_record"):
@@ -107,6 +120,26 @@ def get_materialData(user_id):
     return _to_dataset(records, DEFAULT_MATERIAL_COLUMNS)
 
 
+def subscribe_materialData(user_id, session_id, page_id=None):
+    """Have the "mes-change" message handler of the screen refetch rows instead of polling get_materialData."""
+    controller = MaterialControllerModule.MaterialController(user_id)
+    return controller.subscribe_catalog_changes(session_id, page_id)
+
+
+def get_materialData_rows(user_id, material_ids):
+    """Rows of the given materials only, for the added/changed ids of a pushed change."""
+    controller = MaterialControllerModule.MaterialController(user_id)
+    records = [_object_to_dict(m) for m in controller.get_materials_by_id(material_ids) or []]
+    return _to_dataset(records, DEFAULT_MATERIAL_COLUMNS)
+
+
+def search_materialData(user_id, query, limit=20):
+    controller = MaterialControllerModule.MaterialController(user_id)
+    materials = controller.search_materials(query, limit) or []
+    records = [_object_to_dict(m) for m in materials]
+    return _to_dataset(records, DEFAULT_MATERIAL_COLUMNS)
+
+
 def get_MaterialRouteLink(user_id, material_id):
     controller = MaterialControllerModule.MaterialController(user_id)
     route_links = controller.get_material_route_links(material_id) or []
@@ -160,8 +193,8 @@ def insert_material(user_id, sap_materialid, material_name, material_desc, idle_
     return controller.create_material(payload)
 
 
-def update_material(user_id, material_id, sap_materialid, material_name, material_desc, idle_cycle_time, updated_by, ncm_type_id, base_quant):
-    payload = {
+def _update_material_payload(material_id, sap_materialid, material_name, material_desc, idle_cycle_time, updated_by, ncm_type_id, base_quant):
+    return {
         "ID": material_id,
         "Name": sap_materialid,
         "MaterialName": sap_materialid,
@@ -179,10 +212,24 @@ def update_material(user_id, material_id, sap_materialid, material_name, materia
         "UnitofMeasure1ID": 1,
         "IsDeleted": 0,
     }
+
+
+def update_material(user_id, material_id, sap_materialid, material_name, material_desc, idle_cycle_time, updated_by, ncm_type_id, base_quant):
+    payload = _update_material_payload(
+        material_id, sap_materialid, material_name, material_desc, idle_cycle_time, updated_by, ncm_type_id, base_quant
+    )
     controller = MaterialControllerModule.MaterialController(user_id)
     return controller.update_material(payload)
 
 
+def update_material_with_default_route(user_id, material_id, sap_materialid, material_name, material_desc, idle_cycle_time, updated_by, ncm_type_id, base_quant, route_id, is_secondary=0):
+    payload = _update_material_payload(
+        material_id, sap_materialid, material_name, material_desc, idle_cycle_time, updated_by, ncm_type_id, base_quant
+    )
+    controller = MaterialControllerModule.MaterialController(user_id)
+    return controller.update_material_with_default_route(payload, route_id, is_secondary)
+
+
 def delete_material(user_id, material_id, updated_by):
     controller = MaterialControllerModule.MaterialController(user_id)
     return controller.delete_material(material_id, updated_by)
@@ -199,6 +246,13 @@ def bulk_upload_materials(user_id, json_materials, clock_id):
     return controller.bulk_upload_materials(json_materials, clock_id)
 
 
+def bulk_upload_materials_chunked(user_id, materials_data, clock_id, upload_id=None, chunk_size=None):
+    """Resuming after editing rows needs upload_id from the failed run; the default id hashes the rows."""
+    controller = MaterialControllerModule.MaterialController(user_id)
+    result = controller.bulk_upload_materials_chunked(_dataset_to_dicts(materials_data), clock_id, upload_id, chunk_size)
+    return getattr(result, "value", result)
+
+
 def export_materials(user_id):
     controller = MaterialControllerModule.MaterialController(user_id)
     export_payload = controller.export_materials()
@@ -212,7 +266,32 @@ def export_materials(user_id):
         return {"headers": headers, "rows": data}
 
 
-def read_and_process_materials_csv(user_id, filedata):
+def write_materials_export(user_id, stream, export_format=streaming_export.CSV, compress=False):
+    """Stream the material export into a binary file-like object."""
+    controller = MaterialControllerModule.MaterialController(user_id)
+    export = controller.stream_export_materials()
+    return streaming_export.write(stream, export["headers"], export["rows"], export_format, compress)
+
+
+def export_materials_file(user_id, export_format=streaming_export.CSV, compress=False, path=None):
+    """Stream the material export to a file (temp file by default) and return its summary."""
+    controller = MaterialControllerModule.MaterialController(user_id)
+    export = controller.stream_export_materials()
+    return streaming_export.export_file(
+        export["headers"], export["rows"], export_format, compress, path, base_name="materials"
+    )
+
+
+def _fetch_work_orders(user_id):
+    try:
+        from View.FMV import WorkOrderView
+
+        return WorkOrderView.get_sap_order_ids(user_id)
+    except Exception:
+        return []
+
+
+def _parse_materials_csv(filedata):
     if isinstance(filedata, bytes):
         filedata = filedata.decode("utf-8")
     reader = csv.DictReader(io.StringIO(filedata))
@@ -225,28 +304,60 @@ def read_and_process_materials_csv(user_id, filedata):
         row.setdefault("IdealCycleTime", row.get("IdleCycleTime(min)", "0"))
         row.setdefault("BaseQuantity", row.get("BaseQuantity", "0"))
         rows.append(row)
+    return rows
 
-    controller = MaterialControllerModule.MaterialController(user_id)
-    materials = controller.get_materials() or []
-    routes = controller.get_routes() or []
-    ncm_types = controller.get_ncm_types() or []
 
-    try:
-        from View.FMV import WorkOrderView
+def _bulk_validation_lookups(user_id, controller):
+    workorders_future = executor.shared("material-view").submit_in_context(_fetch_work_orders, user_id)
+    lookups = controller.get_bulk_lookups() or {}
+    materials = lookups.get("materials") or []
+    routes = lookups.get("routes") or []
+    ncm_types = lookups.get("ncm_types") or []
+    workorders = workorders_future.result(LOOKUP_TIMEOUT_SECONDS)
+    return {
+        "existing_materials": [_object_to_dict(m) for m in materials],
+        "ncm_types": [getattr(n, "to_choice", lambda: _object_to_dict(n))() for n in ncm_types],
+        "routes": [_object_to_dict(r) for r in routes],
+        "work_orders": _dataset_to_dicts(workorders),
+    }
 
-        workorders = WorkOrderView.get_sap_order_ids(user_id)
-    except Exception:
-        workorders = []
+
+def _validation_session_key(user_id, session_id):
+    return "materials:%s:%s" % (user_id, session_id)
+
+
+def _validation_session(user_id, controller, session_id):
+    key = _validation_session_key(user_id, session_id)
+    session = local_cache.get(VALIDATION_SESSION_CACHE, key)
+    if session is None:
+        session = controller.create_bulk_validation_session(**_bulk_validation_lookups(user_id, controller))
+    local_cache.put(VALIDATION_SESSION_CACHE, key, session, VALIDATION_SESSION_TTL_SECONDS)
+    return session
+
+
+def read_and_process_materials_csv(user_id, filedata, session_id=None):
+    """
+    Validate an uploaded material CSV. With a session_id the lookups and row
+    results are kept between calls, so re-sending the file after a fix only
+    re-validates the rows that changed.
+    """
+    rows = _parse_materials_csv(filedata)
+    controller = MaterialControllerModule.MaterialController(user_id)
+    if session_id:
+        return _validation_session(user_id, controller, session_id).validate(rows)
 
     processed = controller.validate_bulk_material_rows(
         rows,
-        existing_materials=[_object_to_dict(m) for m in materials],
-        ncm_types=[getattr(n, "to_choice", lambda: _object_to_dict(n))() for n in ncm_types],
-        routes=[_object_to_dict(r) for r in routes],
-        work_orders=_dataset_to_dicts(workorders),
+        batched=len(rows) > BATCHED_VALIDATION_THRESHOLD,
+        **_bulk_validation_lookups(user_id, controller)
     )
     return processed
 
 
+def close_materials_validation_session(user_id, session_id):
+    local_cache.invalidate(VALIDATION_SESSION_CACHE, _validation_session_key(user_id, session_id))
+    return True
+
+
 def filter_materials(materials_data):
     return [row for row in materials_data if row.get("Flag") == 0]
@@ -1,6 +1,88 @@
-# In Ignition, map this to a message handler or MQTT/Kafka consumer.
+# In Ignition, map this to a message handler or MQTT/Kafka consumer:
+#     MessageHandler.handle(payload, topic)
+# Envelopes are applied on the InboundDispatcher workers of "material-inbound",
+# in order per MaterialID; see MessagingConfig.inbound_options().
+import threading
+
+from adapters.messaging.InboundDispatcher import code as inbound
+from common.exceptions import MessagingException as mex
 from core.material.infrastructure import MessagingAdapter as msg
+from core.material.presentation.MaterialController import code as MaterialControllerModule
+from infrastructure import MessagingConfig as cfg
+
+DISPATCHER_NAME = "material-inbound"
+
+_dispatcher = None
+_lock = threading.Lock()
+
+
+def _applied(result):
+    if result is not None and getattr(result, "ok", True) is False:
+        raise mex.MessagingException("Inbound change rejected: %s" % result.error, code="INBOUND_REJECTED")
+    return result
+
+
+def _routes(controller, user_id):
+    def sync_add(envelope):
+        return _applied(controller.create_material(envelope.get("data") or {}))
+
+    def sync_change(envelope):
+        return _applied(controller.update_material(envelope.get("data") or {}))
+
+    def sync_delete(envelope):
+        data = envelope.get("data") or {}
+        return _applied(controller.delete_material(data.get("MaterialID"), data.get("DeletedBy") or user_id))
+
+    def sync_routes(envelope):
+        data = envelope.get("data") or {}
+        material_id = data.get("MaterialID")
+        route_data = data.get("RouteData", data.get("RouteIDs"))
+        if route_data:
+            _applied(controller.insert_material_route_link(route_data, material_id))
+        if data.get("DefaultRouteID") is not None:
+            _applied(controller.update_default_route(material_id, data["DefaultRouteID"],
+                                                     data.get("IsSecondary", 0)))
+
+    return (
+        ("SyncAdd", sync_add),
+        ("SyncChange", sync_change),
+        ("SyncDelete", sync_delete),
+        ("SyncRoutes", sync_routes),
+    )
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _lock:
+            if _dispatcher is None:
+                options = dict(cfg.inbound_options())
+                user_id = options.pop("user_id", None) or "ERP"
+                dispatcher = inbound.shared(DISPATCHER_NAME, **options)
+                controller = MaterialControllerModule.MaterialController(user_id)
+                for verb, handler in _routes(controller, user_id):
+                    dispatcher.route(handler, noun=msg.NOUN, verb=verb)
+                _dispatcher = dispatcher
+    return _dispatcher
+
+
+def handle(envelope, topic=None):
+    """Queue an inbound envelope (dict, JSON text or encoded bytes); True when it was accepted."""
+    return get_dispatcher().submit(envelope, topic)
+
+
+def handle_batch(data, topic=None):
+    """Queue every envelope of an EnvelopeCodec batch frame; returns how many were accepted."""
+    return get_dispatcher().submit_batch(data, topic)
+
+
+def stats():
+    return get_dispatcher().stats()
+
+
+def dead_letters(clear=False):
+    return get_dispatcher().dead_letters(clear)
+
 
-def handle(envelope):
-    # Here you can route inbound events to commands/queries as needed.
-    return True
+def replay_dead_letters():
+    return get_dispatcher().replay_dead_letters()
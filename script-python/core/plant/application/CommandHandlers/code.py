@@ -2,64 +2,211 @@
 
 import json
 
+from adapters.messaging.ChangeFeed import code as feed
+from adapters.persistence.BulkUploadEngine import code as bulk_upload
 from common.decorators.ExceptionHandlerDecorator import code as exception_decorator
 from common.decorators.TraceDecorator import code as trace_decorator
 from common.utils.Result import code as result_module
 
 Result = result_module.Result
 
+# Read-model keys cached per user by the plant query side.
+PLANT_CACHE_KEYS = ("equipment:%s", "equipment-search:%s")
+EQUIPMENT_CLASS_CACHE_KEYS = ("equipment-classes-search:%s",)
+MACHINE_INDEX_CACHE_KEY = "machines:%s"
+
+# ChangeFeed model for plant screens, keyed by DepartmentID. Equipment changes
+# carry row ids; structural changes (departments, batches, uploads) are resets
+# for every department. An update that moves equipment to another department
+# is a removal there and an addition here, or a reset for every department
+# when the previous department is not in the cached hierarchy.
+PLANT_FEED_MODEL = "plant-department"
+_UNKNOWN = object()
+
+
+def _invalidate(cache_port, user_id, keys):
+    if not cache_port:
+        return
+    for key in keys:
+        try:
+            cache_port.invalidate(key % user_id)
+        except Exception:
+            pass
+
+
+def _invalidate_plant_cache(cache_port, user_id):
+    # The machine index is dropped too; patching the cached copy is lost on
+    # caches that return copies and races with readers.
+    _invalidate(cache_port, user_id, PLANT_CACHE_KEYS + (MACHINE_INDEX_CACHE_KEY,))
+
+
+def _invalidate_after_batch(cache_port, user_id, outcome, deleted_ids=None):
+    # One invalidation per batch, and only if at least one row was written.
+    if not outcome or not outcome.get("SuccessCount"):
+        return
+    if deleted_ids is not None:
+        deleted_ids = [deleted_ids[row["Index"]] for row in outcome.get("Rows") or [] if row.get("Status") == "OK"]
+    _invalidate_plant_cache(cache_port, user_id)
+    if deleted_ids is not None:
+        feed.publish(PLANT_FEED_MODEL, removed=deleted_ids)
+    else:
+        feed.publish(PLANT_FEED_MODEL, reset=True)
+
+
+def _cached_department(cache_port, user_id, equipment_id):
+    # DepartmentID of the equipment in the cached hierarchy, read before the
+    # write invalidates it.
+    if not cache_port or equipment_id is None:
+        return _UNKNOWN
+    try:
+        index = cache_port.get(PLANT_CACHE_KEYS[0] % user_id)
+        node = index.node(equipment_id) if index is not None else None
+    except Exception:
+        return _UNKNOWN
+    if node is None:
+        return _UNKNOWN
+    if isinstance(node, dict):
+        return node.get("DepartmentID")
+    return getattr(node, "department_id", None)
+
+
+def _announce_equipment(record, result, state, previous_department=None):
+    equipment_id = record.get("ID")
+    if equipment_id is None and isinstance(result, dict):
+        equipment_id = result.get("ID") or result.get("EquipmentID")
+    department_id = record.get("DepartmentID")
+    if equipment_id is None:
+        feed.publish(PLANT_FEED_MODEL, department_id, reset=True)
+    elif state != feed.CHANGED or previous_department == department_id:
+        feed.publish(PLANT_FEED_MODEL, department_id, **{state: [equipment_id]})
+    elif previous_department is _UNKNOWN:
+        feed.publish(PLANT_FEED_MODEL, reset=True)
+    else:
+        feed.publish(PLANT_FEED_MODEL, previous_department, removed=[equipment_id])
+        feed.publish(PLANT_FEED_MODEL, department_id, added=[equipment_id])
+
 
 @exception_decorator.guarded
 @trace_decorator.traced
-def handle_create_equipment(command, repository):
+def handle_create_equipment(command, repository, cache_port=None):
     record = command.equipment.to_record()
     result = repository.insert_equipment(record, command.user_id)
+    _invalidate_plant_cache(cache_port, command.user_id)
+    _announce_equipment(record, result, feed.ADDED)
     return Result.Ok(result)
 
 
 @exception_decorator.guarded
 @trace_decorator.traced
-def handle_update_equipment(command, repository):
+def handle_update_equipment(command, repository, cache_port=None):
     record = command.equipment.to_record()
+    previous_department = _cached_department(cache_port, command.user_id, record.get("ID"))
     result = repository.update_equipment(record, command.user_id)
+    _invalidate_plant_cache(cache_port, command.user_id)
+    _announce_equipment(record, result, feed.CHANGED, previous_department)
     return Result.Ok(result)
 
 
 @exception_decorator.guarded
 @trace_decorator.traced
-def handle_delete_equipment(command, repository):
+def handle_delete_equipment(command, repository, cache_port=None):
     result = repository.delete_equipment(command.equipment_id, command.user_id)
+    _invalidate_plant_cache(cache_port, command.user_id)
+    feed.publish(PLANT_FEED_MODEL, removed=[command.equipment_id])
     return Result.Ok(result)
 
 
 @exception_decorator.guarded
 @trace_decorator.traced
-def handle_create_department(command, repository):
+def handle_create_department(command, repository, cache_port=None):
     record = command.department.to_record()
     result = repository.insert_department(record, command.user_id)
+    _invalidate_plant_cache(cache_port, command.user_id)
+    feed.publish(PLANT_FEED_MODEL, reset=True)
     return Result.Ok(result)
 
 
 @exception_decorator.guarded
 @trace_decorator.traced
-def handle_update_department(command, repository):
+def handle_update_department(command, repository, cache_port=None):
     record = command.department.to_record()
     result = repository.update_department(record, command.user_id)
+    _invalidate_plant_cache(cache_port, command.user_id)
+    feed.publish(PLANT_FEED_MODEL, reset=True)
     return Result.Ok(result)
 
 
 @exception_decorator.guarded
 @trace_decorator.traced
-def handle_delete_department(command, repository):
+def handle_delete_department(command, repository, cache_port=None):
     result = repository.delete_department(command.department_id, command.updated_by, command.user_id)
+    _invalidate_plant_cache(cache_port, command.user_id)
+    feed.publish(PLANT_FEED_MODEL, reset=True)
+    return Result.Ok(result)
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_create_equipment_batch(command, repository, cache_port=None):
+    records = [item.to_record() for item in command.equipment]
+    result = repository.insert_equipment_batch(records, command.user_id, command.chunk_size, command.atomic)
+    _invalidate_after_batch(cache_port, command.user_id, result)
+    return Result.Ok(result)
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_update_equipment_batch(command, repository, cache_port=None):
+    records = [item.to_record() for item in command.equipment]
+    result = repository.update_equipment_batch(records, command.user_id, command.chunk_size, command.atomic)
+    _invalidate_after_batch(cache_port, command.user_id, result)
     return Result.Ok(result)
 
 
 @exception_decorator.guarded
 @trace_decorator.traced
-def handle_insert_equipment_class(command, repository):
+def handle_delete_equipment_batch(command, repository, cache_port=None):
+    result = repository.delete_equipment_batch(
+        command.equipment_ids, command.user_id, command.chunk_size, command.atomic
+    )
+    _invalidate_after_batch(cache_port, command.user_id, result, command.equipment_ids)
+    return Result.Ok(result)
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_create_department_batch(command, repository, cache_port=None):
+    records = [item.to_record() for item in command.departments]
+    result = repository.insert_department_batch(records, command.user_id, command.chunk_size, command.atomic)
+    _invalidate_after_batch(cache_port, command.user_id, result)
+    return Result.Ok(result)
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_update_department_batch(command, repository, cache_port=None):
+    records = [item.to_record() for item in command.departments]
+    result = repository.update_department_batch(records, command.user_id, command.chunk_size, command.atomic)
+    _invalidate_after_batch(cache_port, command.user_id, result)
+    return Result.Ok(result)
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_delete_department_batch(command, repository, cache_port=None):
+    result = repository.delete_department_batch(
+        command.department_ids, command.updated_by, command.user_id, command.chunk_size, command.atomic
+    )
+    _invalidate_after_batch(cache_port, command.user_id, result)
+    return Result.Ok(result)
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_insert_equipment_class(command, repository, cache_port=None):
     record = command.equipment_class.to_record()
     result = repository.insert_equipment_class(record, command.user_id)
+    _invalidate(cache_port, command.user_id, EQUIPMENT_CLASS_CACHE_KEYS)
     return Result.Ok(result)
 
 
@@ -68,11 +215,28 @@ def handle_insert_equipment_class(command, repository):
 def handle_update_workstation_sort_order(command, repository):
     payload = [item.to_record() for item in command.sort_orders]
     result = repository.update_workstation_sort_order(json.dumps(payload), command.user_id)
+    feed.publish(PLANT_FEED_MODEL, reset=True)
     return Result.Ok(result)
 
 
 @exception_decorator.guarded
 @trace_decorator.traced
-def handle_bulk_upload_machines(command, repository):
+def handle_bulk_upload_machines(command, repository, cache_port=None):
     result = repository.bulk_upload_machines(command.json_payload, command.clock_id, command.user_id)
+    _invalidate_plant_cache(cache_port, command.user_id)
+    feed.publish(PLANT_FEED_MODEL, reset=True)
     return Result.Ok(result)
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_bulk_upload_machines_chunked(command, repository, cache_port=None):
+    def submit(rows):
+        return repository.bulk_upload_machines(json.dumps(rows), command.clock_id, command.user_id)
+
+    engine = bulk_upload.BulkUploadEngine("machines:%s" % command.user_id, submit, command.chunk_size)
+    report = engine.run(command.rows, command.upload_id)
+    if report["SuccessCount"]:
+        _invalidate_plant_cache(cache_port, command.user_id)
+        feed.publish(PLANT_FEED_MODEL, reset=True)
+    return Result.Ok(report)
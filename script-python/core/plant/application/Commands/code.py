@@ -45,6 +45,55 @@ class DeleteDepartmentCommand(object):
         self.updated_by = updated_by
 
 
+class CreateEquipmentBatchCommand(object):
+    def __init__(self, user_id, payloads, chunk_size=None, atomic=True):
+        self.user_id = user_id
+        self.equipment = [EquipmentUpsert.from_dict(payload) for payload in payloads or []]
+        self.chunk_size = chunk_size
+        self.atomic = atomic
+
+
+class UpdateEquipmentBatchCommand(object):
+    def __init__(self, user_id, payloads, chunk_size=None, atomic=True):
+        self.user_id = user_id
+        self.equipment = [EquipmentUpsert.from_dict(payload) for payload in payloads or []]
+        self.chunk_size = chunk_size
+        self.atomic = atomic
+
+
+class DeleteEquipmentBatchCommand(object):
+    def __init__(self, user_id, equipment_ids, chunk_size=None, atomic=True):
+        self.user_id = user_id
+        self.equipment_ids = list(equipment_ids or [])
+        self.chunk_size = chunk_size
+        self.atomic = atomic
+
+
+class CreateDepartmentBatchCommand(object):
+    def __init__(self, user_id, payloads, chunk_size=None, atomic=True):
+        self.user_id = user_id
+        self.departments = [DepartmentUpsert.from_dict(payload) for payload in payloads or []]
+        self.chunk_size = chunk_size
+        self.atomic = atomic
+
+
+class UpdateDepartmentBatchCommand(object):
+    def __init__(self, user_id, payloads, chunk_size=None, atomic=True):
+        self.user_id = user_id
+        self.departments = [DepartmentUpsert.from_dict(payload) for payload in payloads or []]
+        self.chunk_size = chunk_size
+        self.atomic = atomic
+
+
+class DeleteDepartmentBatchCommand(object):
+    def __init__(self, user_id, department_ids, updated_by, chunk_size=None, atomic=True):
+        self.user_id = user_id
+        self.department_ids = list(department_ids or [])
+        self.updated_by = updated_by
+        self.chunk_size = chunk_size
+        self.atomic = atomic
+
+
 class InsertEquipmentClassCommand(object):
     def __init__(self, user_id, payload):
         self.user_id = user_id
@@ -62,3 +111,12 @@ class BulkUploadMachinesCommand(object):
         self.user_id = user_id
         self.json_payload = json_payload
         self.clock_id = clock_id
+
+
+class BulkUploadMachinesChunkedCommand(object):
+    def __init__(self, user_id, rows, clock_id, upload_id=None, chunk_size=None):
+        self.user_id = user_id
+        self.rows = list(rows or [])
+        self.clock_id = clock_id
+        self.upload_id = upload_id
+        self.chunk_size = chunk_size
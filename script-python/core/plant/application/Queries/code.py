@@ -6,6 +6,42 @@ class GetEquipmentTreeQuery(object):
         self.user_id = user_id
 
 
+class GetPlantHierarchyQuery(object):
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+
+class GetEquipmentChildrenQuery(object):
+    def __init__(self, user_id, parent_ids=None, cursor=None, page_size=None):
+        self.user_id = user_id
+        if parent_ids is None:
+            parent_ids = [None]
+        elif not isinstance(parent_ids, (list, tuple)):
+            parent_ids = [parent_ids]
+        self.parent_ids = list(parent_ids)
+        self.cursor = cursor
+        self.page_size = page_size
+
+
+class SearchEquipmentQuery(object):
+    def __init__(self, user_id, text, limit=20, equipment_type=None, department_id=None, parent_id=None):
+        self.user_id = user_id
+        self.text = text
+        self.limit = limit
+        self.filters = {
+            "EquipmentType": equipment_type,
+            "DepartmentID": department_id,
+            "ParentID": parent_id,
+        }
+
+
+class SearchEquipmentClassesQuery(object):
+    def __init__(self, user_id, text, limit=20):
+        self.user_id = user_id
+        self.text = text
+        self.limit = limit
+
+
 class GetEquipmentDropdownQuery(object):
     def __init__(self, user_id):
         self.user_id = user_id
@@ -48,6 +84,11 @@ class GetEquipmentDetailsQuery(object):
         }
 
 
+class GetMachineIndexQuery(object):
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+
 class GetEquipmentClassDropdownQuery(object):
     def __init__(self, user_id):
         self.user_id = user_id
@@ -65,6 +106,12 @@ class GetWorkstationFromMachineQuery(object):
         self.equipment_id = equipment_id
 
 
+class GetPlantScreenQuery(object):
+    def __init__(self, user_id, department_id=None):
+        self.user_id = user_id
+        self.department_id = department_id
+
+
 class ExportMachinesQuery(object):
     def __init__(self, user_id, equipment_id=None, workstation_id=None, workcenter_id=None):
         self.user_id = user_id
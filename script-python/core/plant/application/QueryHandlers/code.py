@@ -2,16 +2,139 @@
 
 from common.decorators.ExceptionHandlerDecorator import code as exception_decorator
 from common.decorators.TraceDecorator import code as trace_decorator
+from common.utils.MultiIndex import code as multi_index
+from common.utils.SearchIndex import code as search_index
+from core.plant.domain.DomainServices import code as domain_services
+from core.plant.domain.Entities import code as entities
+
+EQUIPMENT_CACHE_KEY = "equipment:%s"
+EQUIPMENT_SEARCH_CACHE_KEY = "equipment-search:%s"
+EQUIPMENT_CLASS_SEARCH_CACHE_KEY = "equipment-classes-search:%s"
+MACHINE_INDEX_CACHE_KEY = "machines:%s"
+
+MACHINE_EXPORT_HEADERS = [
+    "MachineName",
+    "MachineDescription",
+    "AssetNumber",
+    "EquipmentNumber",
+    "FunctionalLocation",
+    "MachineClass",
+    "WorkCenter",
+    "WorkStation",
+    "Action",
+]
+
+MACHINE_INDEX_FIELDS = ["EquipmentNumber", "FunctionalLocation", "Code", "WorkCenterID"]
+
+EQUIPMENT_SEARCH_FIELDS = {"Name": 3, "Code": 2, "EquipmentNumber": 2, "FunctionalLocation": 1, "AlternateName": 1}
+EQUIPMENT_CLASS_SEARCH_FIELDS = {"Name": 3, "Code": 2, "EquipmentClassNumber": 2, "AlternateName": 1}
 
 
 def _normalize_filters(filters):
     return {k: v for k, v in (filters or {}).items() if v not in (None, "", [])}
 
 
+def _cache_hierarchy(cache_port, user_id, equipment):
+    index = domain_services.PlantHierarchyIndex(equipment)
+    if cache_port:
+        try:
+            cache_port.put(EQUIPMENT_CACHE_KEY % user_id, index, ttl_seconds=60)
+        except Exception:
+            pass
+    return index
+
+
+def _cached(cache_port, key, build):
+    if cache_port:
+        cached = cache_port.get(key)
+        if cached is not None:
+            return cached
+    value = build()
+    if cache_port:
+        try:
+            cache_port.put(key, value, ttl_seconds=60)
+        except Exception:
+            pass
+    return value
+
+
+def _load_hierarchy(query, repository, cache_port):
+    # The tree and its index are cached together, so the index is built once per snapshot.
+    if cache_port:
+        cached = cache_port.get(EQUIPMENT_CACHE_KEY % query.user_id)
+        if cached is not None:
+            return cached
+    return _cache_hierarchy(cache_port, query.user_id, repository.fetch_equipment_tree(query.user_id))
+
+
+def _equipment_filters(filters, hierarchy):
+    filters = dict(filters)
+    equipment_type = filters.pop("EquipmentType", None)
+    if equipment_type:
+        wanted = equipment_type.strip().lower()
+        filters["EquipmentType"] = lambda item: (item.equipment_type or "").strip().lower() == wanted
+    parent_id = filters.pop("ParentID", None)
+    if parent_id is not None:
+        filters["ParentID"] = lambda item: hierarchy.is_under(item.equipment_id, parent_id)
+    return filters
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_get_equipment_tree(query, repository, cache_port=None):
+    return _load_hierarchy(query, repository, cache_port).items()
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_get_plant_hierarchy(query, repository, cache_port=None):
+    return _load_hierarchy(query, repository, cache_port)
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_get_equipment_children(query, repository, cache_port=None):
+    index = _load_hierarchy(query, repository, cache_port)
+    parent_ids = query.parent_ids
+    if query.cursor:
+        parent_ids = [index.cursor_parent(query.cursor)]
+    items = []
+    next_cursors = {}
+    for parent_id in parent_ids:
+        children, next_cursor = index.children_page(parent_id, query.cursor, query.page_size)
+        for child in children:
+            rec = child.to_record() if hasattr(child, "to_record") else dict(child)
+            rec["HasChildren"] = 1 if index.has_children(rec.get("ID")) else 0
+            items.append(rec)
+        next_cursors[domain_services.page_key(parent_id)] = next_cursor
+    return {"items": items, "next_cursors": next_cursors}
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_search_equipment(query, repository, cache_port=None):
+    hierarchy = _load_hierarchy(query, repository, cache_port)
+    index = _cached(
+        cache_port,
+        EQUIPMENT_SEARCH_CACHE_KEY % query.user_id,
+        lambda: search_index.SearchIndex(hierarchy.items(), EQUIPMENT_SEARCH_FIELDS),
+    )
+    filters = _equipment_filters(_normalize_filters(query.filters), hierarchy)
+    matches = index.search(query.text, query.limit, filters)
+    return [entities.EquipmentDropdown.from_equipment(item) for item in matches]
+
+
 @exception_decorator.guarded
 @trace_decorator.traced
-def handle_get_equipment_tree(query, repository):
-    return repository.fetch_equipment_tree(query.user_id)
+def handle_search_equipment_classes(query, repository, cache_port=None):
+    index = _cached(
+        cache_port,
+        EQUIPMENT_CLASS_SEARCH_CACHE_KEY % query.user_id,
+        lambda: search_index.SearchIndex(
+            repository.fetch_equipment_class_dropdown(query.user_id), EQUIPMENT_CLASS_SEARCH_FIELDS
+        ),
+    )
+    return index.search(query.text, query.limit)
 
 
 @exception_decorator.guarded
@@ -50,6 +173,18 @@ def handle_get_equipment_details(query, repository):
     return repository.fetch_equipment_details(_normalize_filters(query.filters), query.user_id)
 
 
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_get_machine_index(query, repository, cache_port=None):
+    return _cached(
+        cache_port,
+        MACHINE_INDEX_CACHE_KEY % query.user_id,
+        lambda: multi_index.MultiIndex(
+            repository.fetch_equipment_details({}, query.user_id), key="EquipmentID", indexes=MACHINE_INDEX_FIELDS
+        ),
+    )
+
+
 @exception_decorator.guarded
 @trace_decorator.traced
 def handle_get_equipment_class_dropdown(query, repository):
@@ -70,37 +205,46 @@ def handle_get_workstation_from_machine(query, repository):
 
 @exception_decorator.guarded
 @trace_decorator.traced
-def handle_export_machines(query, repository):
-    records = repository.fetch_equipment_details(_normalize_filters(query.filters), query.user_id)
-    headers = [
-        "MachineName",
-        "MachineDescription",
-        "AssetNumber",
-        "EquipmentNumber",
-        "FunctionalLocation",
-        "MachineClass",
-        "WorkCenter",
-        "WorkStation",
-        "Action",
+def handle_get_plant_screen(query, repository, cache_port=None):
+    screen = repository.fetch_plant_screen(query.department_id, query.user_id)
+    _cache_hierarchy(cache_port, query.user_id, screen.get("equipment_tree"))
+    return screen
+
+
+def _machine_export_row(rec):
+    if hasattr(rec, "to_record"):
+        rec = rec.to_record()
+    return [
+        rec.get("Machine") or rec.get("Equipment") or rec.get("Name"),
+        rec.get("Description"),
+        rec.get("Code"),
+        rec.get("EquipmentNumber"),
+        rec.get("FunctionalLocation"),
+        rec.get("MachineClass"),
+        rec.get("WorkCenter"),
+        rec.get("WorkStation"),
+        "I",
     ]
-    rows = []
+
+
+def iter_machine_export_rows(records):
     for rec in records or []:
-        if hasattr(rec, "to_record"):
-            rec = rec.to_record()
-        rows.append(
-            [
-                rec.get("Machine") or rec.get("Equipment") or rec.get("Name"),
-                rec.get("Description"),
-                rec.get("Code"),
-                rec.get("EquipmentNumber"),
-                rec.get("FunctionalLocation"),
-                rec.get("MachineClass"),
-                rec.get("WorkCenter"),
-                rec.get("WorkStation"),
-                "I",
-            ]
-        )
-    return {"headers": headers, "rows": rows}
+        yield _machine_export_row(rec)
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_export_machines(query, repository):
+    records = repository.fetch_equipment_details(_normalize_filters(query.filters), query.user_id)
+    return {"headers": list(MACHINE_EXPORT_HEADERS), "rows": list(iter_machine_export_rows(records))}
+
+
+@exception_decorator.guarded
+@trace_decorator.traced
+def handle_stream_export_machines(query, repository):
+    """Export headers plus a generator of rows mapped from the dataset as it is consumed."""
+    records = repository.iter_equipment_details(_normalize_filters(query.filters), query.user_id)
+    return {"headers": list(MACHINE_EXPORT_HEADERS), "rows": iter_machine_export_rows(records)}
 
 
 @exception_decorator.guarded
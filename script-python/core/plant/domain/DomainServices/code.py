@@ -0,0 +1,327 @@
+"""Domain services encapsulating business rules for the plant bounded context."""
+
+import re
+
+from common.utils.MultiIndex import code as multi_index
+from common.utils.RuleEngine import code as rule_engine
+from common.utils.ValidationSession import code as validation_session
+
+SPECIAL_CHARACTERS = "}~!@#$%^&*(`)+={[]|\\:;<,>.?/\"'"
+_SPECIAL_CHARACTER_PATTERN = re.compile("[%s]" % re.escape(SPECIAL_CHARACTERS))
+
+ERROR_STYLE = {
+    "backgroundColor": "#FF474C",
+    "font-weight": "bold",
+    "color": "#FFFFFF",
+}
+
+
+def has_special_characters(value):
+    if value is None:
+        return False
+    return _SPECIAL_CHARACTER_PATTERN.search(str(value)) is not None
+
+
+def _node_ids(item):
+    if isinstance(item, dict):
+        node_id = item.get("ID")
+        return node_id if node_id is not None else item.get("EquipmentID"), item.get("EquipmentParentID")
+    return getattr(item, "equipment_id", None), getattr(item, "equipment_parent_id", None)
+
+
+def _equipment_type(item):
+    if isinstance(item, dict):
+        return item.get("EquipmentType")
+    return getattr(item, "equipment_type", None)
+
+
+# next_cursors key of the root level; other levels use the parent id as text.
+ROOT_PAGE_KEY = "root"
+
+
+def page_key(node_id):
+    return ROOT_PAGE_KEY if node_id is None else str(node_id)
+
+
+def _cursor_parent_key(node_id):
+    return "" if node_id is None else str(node_id)
+
+
+def _split_cursor(cursor):
+    parts = str(cursor).split("|")
+    if len(parts) != 3:
+        raise ValueError("Malformed children cursor: %s" % cursor)
+    try:
+        offset = max(0, int(parts[2]))
+    except ValueError:
+        raise ValueError("Malformed children cursor: %s" % cursor)
+    return parts[0], parts[1], offset
+
+
+class PlantHierarchyIndex(object):
+    """
+    Read-only index over one equipment tree snapshot.
+
+    Built once from the flat list returned by fetch_equipment_tree. Every node
+    gets an Euler-tour interval [enter, exit) over the pre-order sequence, so
+    subtree membership is an interval check and a subtree is a contiguous slice.
+    Nodes whose parent is missing from the snapshot are treated as roots.
+    """
+
+    def __init__(self, equipment):
+        self._items = list(equipment or [])
+        self._nodes = {}
+        self._parent = {}
+        self._children = {}
+        for item in self._items:
+            node_id, parent_id = _node_ids(item)
+            if node_id is None or node_id in self._nodes:
+                continue
+            self._nodes[node_id] = item
+            self._parent[node_id] = parent_id
+        self._roots = []
+        for node_id in self._nodes:
+            parent_id = self._parent[node_id]
+            if parent_id is None or parent_id == node_id or parent_id not in self._nodes:
+                self._parent[node_id] = None
+                self._roots.append(node_id)
+            else:
+                self._children.setdefault(parent_id, []).append(node_id)
+        self._order = []
+        self._enter = {}
+        self._exit = {}
+        self._depth = {}
+        for root in self._roots:
+            self._tour(root)
+        # Parent links that form a cycle are never reached from a root; cut
+        # them at an arbitrary member so every node is still indexed.
+        for node_id in self._nodes:
+            if node_id not in self._enter:
+                self._detach(node_id)
+                self._roots.append(node_id)
+                self._tour(node_id)
+        self._keys = dict((str(node_id), node_id) for node_id in self._nodes)
+        self._position = {}
+        for siblings in [self._roots] + list(self._children.values()):
+            for position, node_id in enumerate(siblings):
+                self._position[node_id] = position
+
+    def _tour(self, root):
+        # Iterative pre-order walk; plant trees can be deeper than Jython's recursion limit.
+        self._depth[root] = 0
+        stack = [(root, False)]
+        while stack:
+            node_id, leaving = stack.pop()
+            if leaving:
+                self._exit[node_id] = len(self._order)
+                continue
+            self._enter[node_id] = len(self._order)
+            self._order.append(node_id)
+            stack.append((node_id, True))
+            for child_id in reversed(self._children.get(node_id, [])):
+                if child_id not in self._enter:
+                    self._depth[child_id] = self._depth[node_id] + 1
+                    stack.append((child_id, False))
+
+    def _detach(self, node_id):
+        parent_id = self._parent.get(node_id)
+        if parent_id is not None:
+            self._children[parent_id].remove(node_id)
+            self._parent[node_id] = None
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, node_id):
+        return node_id in self._nodes
+
+    def items(self):
+        """The snapshot in its original order."""
+        return list(self._items)
+
+    def node(self, node_id):
+        return self._nodes.get(node_id)
+
+    def roots(self):
+        return [self._nodes[i] for i in self._roots]
+
+    def parent(self, node_id):
+        parent_id = self._parent.get(node_id)
+        return self._nodes.get(parent_id) if parent_id is not None else None
+
+    def children(self, node_id):
+        return [self._nodes[i] for i in self._children.get(node_id, [])]
+
+    def has_children(self, node_id):
+        return bool(self._children.get(node_id))
+
+    def depth(self, node_id):
+        return self._depth.get(node_id)
+
+    def subtree_size(self, node_id):
+        if node_id not in self._enter:
+            return 0
+        return self._exit[node_id] - self._enter[node_id]
+
+    def descendants(self, node_id):
+        """All nodes below node_id in pre-order, excluding node_id itself."""
+        if node_id not in self._enter:
+            return []
+        ids = self._order[self._enter[node_id] + 1:self._exit[node_id]]
+        return [self._nodes[i] for i in ids]
+
+    def ancestors(self, node_id):
+        """Parent first, root last."""
+        result = []
+        parent_id = self._parent.get(node_id)
+        while parent_id is not None:
+            result.append(self._nodes[parent_id])
+            parent_id = self._parent.get(parent_id)
+        return result
+
+    def path_to_root(self, node_id):
+        if node_id not in self._nodes:
+            return []
+        return [self._nodes[node_id]] + self.ancestors(node_id)
+
+    def is_under(self, node_id, ancestor_id, inclusive=False):
+        """True when node_id lies in the subtree of ancestor_id."""
+        if node_id not in self._enter or ancestor_id not in self._enter:
+            return False
+        if node_id == ancestor_id:
+            return inclusive
+        return self._enter[ancestor_id] < self._enter[node_id] < self._exit[ancestor_id]
+
+    def ancestor_of_type(self, node_id, equipment_type):
+        """Nearest ancestor of the given EquipmentType (case-insensitive), e.g. a machine's WorkCenter."""
+        wanted = (equipment_type or "").strip().lower()
+        for item in self.ancestors(node_id):
+            if (_equipment_type(item) or "").strip().lower() == wanted:
+                return item
+        return None
+
+    # ------------------------------------------------------------------
+    # Paging
+    # ------------------------------------------------------------------
+    def children_page(self, node_id=None, cursor=None, limit=None):
+        """
+        One page of node_id's children (roots when node_id is None).
+
+        Returns (items, next_cursor); next_cursor is None on the last page.
+        The cursor names the last child returned, so paging resumes after it
+        even if siblings were added in a newer snapshot; if that child is gone
+        the recorded offset is used instead. A cursor of another parent, e.g.
+        one missing from a newer snapshot, gives an empty last page.
+        """
+        siblings = self._roots if node_id is None else self._children.get(node_id, [])
+        start = 0
+        if cursor:
+            parent_key, after_key, offset = _split_cursor(cursor)
+            if parent_key != _cursor_parent_key(node_id):
+                return [], None
+            after = self._keys.get(after_key)
+            if after is not None and self._parent.get(after) == node_id:
+                start = self._position[after] + 1
+            else:
+                start = min(offset, len(siblings))
+        end = len(siblings) if not limit else min(len(siblings), start + int(limit))
+        items = [self._nodes[i] for i in siblings[start:end]]
+        next_cursor = None
+        if end < len(siblings):
+            next_cursor = "%s|%s|%s" % (_cursor_parent_key(node_id), siblings[end - 1], end)
+        return items, next_cursor
+
+    def cursor_parent(self, cursor):
+        """Parent id a cursor returned by children_page belongs to; its key when it left the snapshot."""
+        parent_key = _split_cursor(cursor)[0]
+        return self._keys.get(parent_key, parent_key) if parent_key else None
+
+
+def _machine_name(row):
+    return (row.get("MachineName") or "").strip()
+
+
+class MachineCsvValidationService(object):
+    """
+    Validation rules for machine bulk-upload rows, applied one row at a time.
+
+    Callers make two linear passes over the rows: count_names() first (duplicate
+    MachineNames and the row total), then iter_validated() to stream results.
+    existing_machines may be a MultiIndex with an EquipmentNumber index or any
+    iterable of machine records, which is indexed once here.
+    """
+
+    def __init__(self, existing_machines=None):
+        if existing_machines is not None and hasattr(existing_machines, "find"):
+            self._machines = existing_machines
+        else:
+            self._machines = multi_index.MultiIndex(
+                existing_machines, key="EquipmentID", indexes=["EquipmentNumber"]
+            )
+        self._validator = rule_engine.RuleSet([
+            rule_engine.required("MachineName", "Please Enter Machine Name!!"),
+            rule_engine.required("MachineDescription", "Please Enter Machine Description!!"),
+            rule_engine.required("MachineClass", "Please Enter Machine Class!!"),
+            rule_engine.required("WorkCenter", "Please Enter Work Center!!"),
+            rule_engine.required("WorkStation", "Please Enter Work Station!!"),
+            rule_engine.max_length("MachineName", 100, "Machine Name cannot exceed 100 character length !!"),
+            rule_engine.max_length("MachineDescription", 200, "Machine description cannot exceed 200 character length !!"),
+            rule_engine.max_length("AssetNumber", 100, "Asset Number cannot exceed 100 character length !!"),
+            rule_engine.max_length("EquipmentNumber", 50, "Equipment Number cannot exceed 50 character length !!"),
+            rule_engine.allowed_characters(
+                ["MachineName", "FunctionalLocation"],
+                _SPECIAL_CHARACTER_PATTERN,
+                "Machine Name and Functional Location are allowed to have only these special characters Hypen (-), Space ( ), Underscore ( _ )",
+            ),
+            rule_engine.unique("MachineName", "Same Machine Name present multiple times"),
+            rule_engine.action_code(rule_engine.from_context("action")),
+            rule_engine.rule(
+                "equipment-number-work-center",
+                self._check_equipment_number,
+                when=rule_engine.field_in(rule_engine.from_context("action"), ["I"]),
+            ),
+        ]).compile()
+
+    def _check_equipment_number(self, row, context):
+        for machine in self._machines.find("EquipmentNumber", row.get("EquipmentNumber")):
+            record = machine.to_record() if hasattr(machine, "to_record") else machine
+            if record.get("WorkCenter") != row.get("WorkCenter"):
+                return "Equipment Number already assigned to different Work Center"
+        return None
+
+    @staticmethod
+    def clean(row):
+        return dict((k, v.strip() if isinstance(v, str) else v) for k, v in row.items())
+
+    @staticmethod
+    def count_names(rows):
+        """One pass: ({MachineName: occurrences}, total rows)."""
+        counts = {}
+        total = 0
+        for row in rows:
+            total += 1
+            name = (row.get("MachineName") or "").strip()
+            if name:
+                counts[name] = counts.get(name, 0) + 1
+        return counts, total
+
+    def session(self):
+        """ValidationSession over existing_machines that re-validates only changed rows."""
+        return validation_session.ValidationSession(self.validate_row, _machine_name)
+
+    def iter_validated(self, rows, name_counts):
+        for row in rows:
+            yield self.validate_row(row, name_counts)
+
+    def validate_row(self, row, name_counts):
+        row = self.clean(row)
+        row.setdefault("Flag", 0)
+        row.setdefault("Reasons", {"value": "", "style": {}})
+        errors = self._validator(row, {"duplicates": name_counts, "action": row.get("Action", "I")})
+        if errors:
+            row["Flag"] = 1
+            row["Reasons"] = {"value": ",".join(errors), "style": dict(ERROR_STYLE)}
+        return row
@@ -0,0 +1,15 @@
+from adapters.cache.IgniteAdapter import code as ignite
+from common.cache.CacheManager import code as local
+
+def get_cache():
+    cache = ignite.get("plant")
+    return cache if cache else local
+
+def get(key):
+    return get_cache().get("plant", key)
+
+def put(key, value, ttl_seconds=600):
+    return get_cache().put("plant", key, value, ttl_seconds)
+
+def invalidate(key=None):
+    return get_cache().invalidate("plant", key)
@@ -1,6 +1,9 @@
 """Repository adapter bridging plant aggregate operations with stored procedures."""
 
+from adapters.persistence.PersistenceGateway import code as gateway
+from adapters.persistence.QueryBatch import code as query_batch
 from common.cache.CacheManager import code as cache
+from common.exceptions import RepositoryException as rex
 from common.logging.LogFactory import code as LogFactory
 from core.plant.domain.Entities import code as entities
 from core.plant.ports.RepositoryPort import code as port
@@ -35,6 +38,12 @@ SP_GET_WORKSTATION_FROM_MACHINE = "usp_S_GetWorkstationFromMachine"
 SP_UPDATE_WORKSTATION_SORT_ORDER = "usp_U_UpdateWorkstationSortOrder"
 SP_BULK_UPLOAD_MACHINES = "usp_C_BulkUploadMaterials"
 
+BATCH_CHUNK_SIZE = 200
+
+# OutputMessage values the write procedures return when the row was written.
+SUCCESS_MESSAGES = ("[[STPSuccess]]", "[[STPSuccessfullyAdded]]", "[[STPSuccessfullyUpdated]]",
+                    "[[STPSuccessfullyDeleted]]")
+
 
 class PlantRepositoryAdapter(port.PlantRepositoryPort):
     def __init__(self):
@@ -74,14 +83,20 @@ class PlantRepositoryAdapter(port.PlantRepositoryPort):
     @staticmethod
     def _run_query(statement, params, datasource):
         try:
-            from system.db import runPrepQuery
-
-            if datasource:
-                return runPrepQuery(statement, params, datasource)
-            return runPrepQuery(statement, params)
-        except Exception:
+            return gateway.run_query(statement, params, datasource)
+        except gateway.Unavailable:
+            return []
+        except Exception as ex:
+            if gateway.current_scope() is not None:
+                raise  # let the unit of work roll back
+            if gateway.is_busy(ex):
+                raise  # an empty result would be cached as the read model
             return []
 
+    @classmethod
+    def _call(cls, procedure, params, datasource):
+        return gateway.call_with(cls._run_query, procedure, params, datasource)
+
     @staticmethod
     def _dataset_to_dicts(dataset):
         if dataset is None:
@@ -117,37 +132,43 @@ class PlantRepositoryAdapter(port.PlantRepositoryPort):
     # ------------------------------------------------------------------
     def fetch_equipment_tree(self, user_id):
         ds = self._resolve_datasource(user_id)
-        statement = "EXEC %s" % SP_GET_EQUIPMENT_TREE
-        rows = self._dataset_to_dicts(self._run_query(statement, [], ds))
+        rows = self._dataset_to_dicts(self._call(SP_GET_EQUIPMENT_TREE, [], ds))
         return [Equipment.from_record(row) for row in rows]
 
     def fetch_equipment_dropdown(self, user_id):
         ds = self._resolve_datasource(user_id)
-        statement = "EXEC %s" % SP_GET_EQUIPMENT_DROPDOWN
-        rows = self._dataset_to_dicts(self._run_query(statement, [], ds))
+        rows = self._dataset_to_dicts(self._call(SP_GET_EQUIPMENT_DROPDOWN, [], ds))
         return [EquipmentDropdown.from_record(row) for row in rows]
 
     def fetch_workcenter_dropdown(self, user_id):
         ds = self._resolve_datasource(user_id)
-        statement = "EXEC %s" % SP_GET_WORKCENTER_DROPDOWN
-        rows = self._dataset_to_dicts(self._run_query(statement, [], ds))
+        rows = self._dataset_to_dicts(self._call(SP_GET_WORKCENTER_DROPDOWN, [], ds))
         return [EquipmentDropdown.from_record(row) for row in rows]
 
     def fetch_machine_dropdown(self, filters, user_id):
         ds = self._resolve_datasource(user_id)
         params = [
-            filters.get("EquipmentID"),
-            filters.get("WorkStationID"),
-            filters.get("WorkCenterID"),
+            ("@EquipmentID", filters.get("EquipmentID")),
+            ("@WorkStationID", filters.get("WorkStationID")),
+            ("@WorkCenterID", filters.get("WorkCenterID")),
         ]
-        statement = "EXEC %s @EquipmentID=?, @WorkStationID=?, @WorkCenterID=?" % SP_GET_EQUIPMENT
-        rows = self._dataset_to_dicts(self._run_query(statement, params, ds))
+        rows = self._dataset_to_dicts(self._call(SP_GET_EQUIPMENT, params, ds))
         return [MachineDropdown.from_record(row) for row in rows]
 
+    def iter_equipment_details(self, filters, user_id):
+        """Like fetch_equipment_details, but builds the entities lazily as the caller iterates."""
+        ds = self._resolve_datasource(user_id)
+        params = [
+            ("@EquipmentID", filters.get("EquipmentID")),
+            ("@WorkStationID", filters.get("WorkStationID")),
+            ("@WorkCenterID", filters.get("WorkCenterID")),
+        ]
+        dataset = self._call(SP_GET_EQUIPMENT, params, ds)
+        return (MachineDropdown.from_record(row) for row in self._dataset_to_dicts(dataset))
+
     def fetch_departments(self, department_id, user_id):
         ds = self._resolve_datasource(user_id)
-        statement = "EXEC %s @DepartmentID=?" % SP_GET_DEPARTMENTS
-        rows = self._dataset_to_dicts(self._run_query(statement, [department_id], ds))
+        rows = self._dataset_to_dicts(self._call(SP_GET_DEPARTMENTS, [("@DepartmentID", department_id)], ds))
         return [Department.from_record(row) for row in rows]
 
     def fetch_department_dropdown(self, department_id, user_id):
@@ -157,24 +178,21 @@ class PlantRepositoryAdapter(port.PlantRepositoryPort):
     def fetch_equipment_details(self, filters, user_id):
         ds = self._resolve_datasource(user_id)
         params = [
-            filters.get("EquipmentID"),
-            filters.get("WorkStationID"),
-            filters.get("WorkCenterID"),
+            ("@EquipmentID", filters.get("EquipmentID")),
+            ("@WorkStationID", filters.get("WorkStationID")),
+            ("@WorkCenterID", filters.get("WorkCenterID")),
         ]
-        statement = "EXEC %s @EquipmentID=?, @WorkStationID=?, @WorkCenterID=?" % SP_GET_EQUIPMENT
-        rows = self._dataset_to_dicts(self._run_query(statement, params, ds))
+        rows = self._dataset_to_dicts(self._call(SP_GET_EQUIPMENT, params, ds))
         return [MachineDropdown.from_record(row) for row in rows]
 
     def fetch_equipment_class_dropdown(self, user_id):
         ds = self._resolve_datasource(user_id)
-        statement = "EXEC %s" % SP_GET_EQUIPMENT_CLASS
-        rows = self._dataset_to_dicts(self._run_query(statement, [], ds))
+        rows = self._dataset_to_dicts(self._call(SP_GET_EQUIPMENT_CLASS, [], ds))
         return [EquipmentClass.from_record(row) for row in rows]
 
     def fetch_equipment_name(self, plant_model_type, user_id):
         ds = self._resolve_datasource(user_id)
-        statement = "EXEC %s @PlantModelType=?" % SP_GET_EQUIPMENT_NAME
-        result = self._run_query(statement, [plant_model_type], ds)
+        result = self._call(SP_GET_EQUIPMENT_NAME, [("@PlantModelType", plant_model_type)], ds)
         first = self._first_row(result)
         if isinstance(first, dict):
             return list(first.values())[0] if first else None
@@ -188,263 +206,330 @@ class PlantRepositoryAdapter(port.PlantRepositoryPort):
 
     def fetch_workstation_from_machine(self, equipment_id, user_id):
         ds = self._resolve_datasource(user_id)
-        statement = "EXEC %s @EquipmentID=?" % SP_GET_WORKSTATION_FROM_MACHINE
-        return self._dataset_to_dicts(self._run_query(statement, [equipment_id], ds))
+        return self._dataset_to_dicts(
+            self._call(SP_GET_WORKSTATION_FROM_MACHINE, [("@EquipmentID", equipment_id)], ds)
+        )
+
+    # ------------------------------------------------------------------
+    # Batched reads
+    # ------------------------------------------------------------------
+    def run_batch(self, calls, user_id):
+        """Run independent BatchCall objects concurrently; returns {key: result}."""
+        ds = self._resolve_datasource(user_id)
+        return query_batch.run(calls, self._run_query, ds)
+
+    def fetch_plant_screen(self, department_id, user_id):
+        """Equipment tree, department dropdown and equipment classes in one round trip."""
+        to_dicts = self._dataset_to_dicts
+        return self.run_batch(
+            [
+                query_batch.BatchCall(
+                    "equipment_tree",
+                    SP_GET_EQUIPMENT_TREE,
+                    mapper=lambda dataset: [Equipment.from_record(row) for row in to_dicts(dataset)],
+                ),
+                query_batch.BatchCall(
+                    "department_dropdown",
+                    SP_GET_DEPARTMENTS,
+                    [("@DepartmentID", department_id)],
+                    mapper=lambda dataset: [
+                        DepartmentDropdown.from_department(Department.from_record(row))
+                        for row in to_dicts(dataset)
+                    ],
+                ),
+                query_batch.BatchCall(
+                    "equipment_classes",
+                    SP_GET_EQUIPMENT_CLASS,
+                    mapper=lambda dataset: [EquipmentClass.from_record(row) for row in to_dicts(dataset)],
+                ),
+            ],
+            user_id,
+        )
+
+    # ------------------------------------------------------------------
+    # Stored procedure parameter builders
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _insert_equipment_params(record):
+        return [
+            ("@Name", record.get("Name")),
+            ("@Description", record.get("Description")),
+            ("@AlternateName", record.get("AlternateName")),
+            ("@Code", record.get("Code")),
+            ("@EquipmentTypeID", record.get("EquipmentTypeID")),
+            ("@EquipmentParentID", record.get("EquipmentParentID")),
+            ("@IsConsumptionPoint", record.get("IsConsumptionPoint")),
+            ("@IsProductionPoint", record.get("IsProductionPoint")),
+            ("@ConsumptionCycle", record.get("ConsumptionCycle")),
+            ("@ProductionCycle", record.get("ProductionCycle")),
+            ("@LocationID", record.get("LocationID")),
+            ("@ShiftScheduleID", record.get("ShiftScheduleID")),
+            ("@QueqeTime", record.get("QueqeTime")),
+            ("@WaitTime", record.get("WaitTime")),
+            ("@WorkCenterID", record.get("WorkCenterID")),
+            ("@TemplateID", record.get("TemplateID")),
+            ("@DepartmentID", record.get("DepartmentID")),
+            ("@SortOrder", record.get("SortOrder")),
+            ("@InsertedBy", record.get("InsertedBy")),
+            ("@UpdatedBy", record.get("UpdatedBy")),
+            ("@IsDeleted", record.get("IsDeleted")),
+            ("@EquipmentClassID", record.get("EquipmentClassID")),
+            ("@WorkUnitThingName", record.get("WorkUnitThingName")),
+            ("@ProductionCountMultiplier", record.get("ProductionCountMultiplier")),
+            ("@IsFirstUnit", record.get("IsFirstUnit")),
+            ("@IsLastUnit", record.get("IsLastUnit")),
+            ("@EquipmentNumber", record.get("EquipmentNumber")),
+            ("@FunctionalLocation", record.get("FunctionalLocation")),
+        ]
+
+    @staticmethod
+    def _update_equipment_params(record):
+        return [
+            ("@ID", record.get("ID")),
+            ("@Name", record.get("Name")),
+            ("@Description", record.get("Description")),
+            ("@AlternateName", record.get("AlternateName")),
+            ("@Code", record.get("Code")),
+            ("@EquipmentTypeID", record.get("EquipmentTypeID")),
+            ("@EquipmentParentID", record.get("EquipmentParentID")),
+            ("@IsConsumptionPoint", record.get("IsConsumptionPoint")),
+            ("@IsProductionPoint", record.get("IsProductionPoint")),
+            ("@ConsumptionCycle", record.get("ConsumptionCycle")),
+            ("@ProductionCycle", record.get("ProductionCycle")),
+            ("@LocationID", record.get("LocationID")),
+            ("@ShiftScheduleID", record.get("ShiftScheduleID")),
+            ("@QueqeTime", record.get("QueqeTime")),
+            ("@WaitTime", record.get("WaitTime")),
+            ("@WorkCenterID", record.get("WorkCenterID")),
+            ("@TemplateID", record.get("TemplateID")),
+            ("@DepartmentID", record.get("DepartmentID")),
+            ("@SortOrder", record.get("SortOrder")),
+            ("@UpdatedBy", record.get("UpdatedBy")),
+            ("@IsDeleted", record.get("IsDeleted")),
+            ("@EquipmentClassID", record.get("EquipmentClassID")),
+            ("@WorkUnitThingName", record.get("WorkUnitThingName")),
+            ("@ProductionCountMultiplier", record.get("ProductionCountMultiplier")),
+            ("@IsFirstUnit", record.get("IsFirstUnit")),
+            ("@IsLastUnit", record.get("IsLastUnit")),
+            ("@FunctionalLocation", record.get("FunctionalLocation")),
+        ]
+
+    @staticmethod
+    def _insert_department_params(record):
+        return [
+            ("@Name", record.get("Name")),
+            ("@Description", record.get("Description")),
+            ("@Category", record.get("Category")),
+            ("@SortOrder", record.get("SortOrder")),
+            ("@IsDeleted", record.get("IsDeleted")),
+            ("@DepartmentTypeID", record.get("DepartmentTypeID")),
+            ("@DepartmentParentID", record.get("DepartmentParentID")),
+            ("@IsOrderLinkingSupported", record.get("IsOrderLinkingSupported")),
+            ("@EquipmentID", record.get("EquipmentID")),
+            ("@InsertedBy", record.get("InsertedBy")),
+            ("@JobOrderCompletionThreshold", record.get("JobOrderCompletionThreshold")),
+            ("@AlternateName", record.get("AlternateName")),
+            ("@DepartmentNumber", record.get("DepartmentNumber")),
+            ("@FunctionalLocation", record.get("FunctionalLocation")),
+            ("@WorkstationOptimization", record.get("WorkstationOptimization")),
+        ]
+
+    @staticmethod
+    def _update_department_params(record):
+        return [
+            ("@DepartmentID", record.get("DepartmentID")),
+            ("@Name", record.get("Name")),
+            ("@Description", record.get("Description")),
+            ("@Category", record.get("Category")),
+            ("@SortOrder", record.get("SortOrder")),
+            ("@IsDeleted", record.get("IsDeleted")),
+            ("@DepartmentTypeID", record.get("DepartmentTypeID")),
+            ("@DepartmentParentID", record.get("DepartmentParentID")),
+            ("@IsOrderLinkingSupported", record.get("IsOrderLinkingSupported")),
+            ("@EquipmentID", record.get("EquipmentID")),
+            ("@UpdatedBy", record.get("UpdatedBy")),
+            ("@JobOrderCompletionThreshold", record.get("JobOrderCompletionThreshold")),
+            ("@AlternateName", record.get("AlternateName")),
+            ("@FunctionalLocation", record.get("FunctionalLocation")),
+            ("@WorkstationOptimization", record.get("WorkstationOptimization")),
+        ]
 
     # ------------------------------------------------------------------
     # Command implementations
     # ------------------------------------------------------------------
     def insert_equipment(self, record, user_id):
         ds = self._resolve_datasource(user_id)
-        params = [
-            record.get("Name"),
-            record.get("Description"),
-            record.get("AlternateName"),
-            record.get("Code"),
-            record.get("EquipmentTypeID"),
-            record.get("EquipmentParentID"),
-            record.get("IsConsumptionPoint"),
-            record.get("IsProductionPoint"),
-            record.get("ConsumptionCycle"),
-            record.get("ProductionCycle"),
-            record.get("LocationID"),
-            record.get("ShiftScheduleID"),
-            record.get("QueqeTime"),
-            record.get("WaitTime"),
-            record.get("WorkCenterID"),
-            record.get("TemplateID"),
-            record.get("DepartmentID"),
-            record.get("SortOrder"),
-            record.get("InsertedBy"),
-            record.get("UpdatedBy"),
-            record.get("IsDeleted"),
-            record.get("EquipmentClassID"),
-            record.get("WorkUnitThingName"),
-            record.get("ProductionCountMultiplier"),
-            record.get("IsFirstUnit"),
-            record.get("IsLastUnit"),
-            record.get("EquipmentNumber"),
-            record.get("FunctionalLocation"),
-        ]
-        statement = "EXEC %s " % SP_INSERT_EQUIPMENT + ", ".join([
-            "@Name=?",
-            "@Description=?",
-            "@AlternateName=?",
-            "@Code=?",
-            "@EquipmentTypeID=?",
-            "@EquipmentParentID=?",
-            "@IsConsumptionPoint=?",
-            "@IsProductionPoint=?",
-            "@ConsumptionCycle=?",
-            "@ProductionCycle=?",
-            "@LocationID=?",
-            "@ShiftScheduleID=?",
-            "@QueqeTime=?",
-            "@WaitTime=?",
-            "@WorkCenterID=?",
-            "@TemplateID=?",
-            "@DepartmentID=?",
-            "@SortOrder=?",
-            "@InsertedBy=?",
-            "@UpdatedBy=?",
-            "@IsDeleted=?",
-            "@EquipmentClassID=?",
-            "@WorkUnitThingName=?",
-            "@ProductionCountMultiplier=?",
-            "@IsFirstUnit=?",
-            "@IsLastUnit=?",
-            "@EquipmentNumber=?",
-            "@FunctionalLocation=?",
-        ])
-        result = self._run_query(statement, params, ds)
+        result = self._call(SP_INSERT_EQUIPMENT, self._insert_equipment_params(record), ds)
         return self._first_row(result)
 
     def update_equipment(self, record, user_id):
         ds = self._resolve_datasource(user_id)
-        params = [
-            record.get("ID"),
-            record.get("Name"),
-            record.get("Description"),
-            record.get("AlternateName"),
-            record.get("Code"),
-            record.get("EquipmentTypeID"),
-            record.get("EquipmentParentID"),
-            record.get("IsConsumptionPoint"),
-            record.get("IsProductionPoint"),
-            record.get("ConsumptionCycle"),
-            record.get("ProductionCycle"),
-            record.get("LocationID"),
-            record.get("ShiftScheduleID"),
-            record.get("QueqeTime"),
-            record.get("WaitTime"),
-            record.get("WorkCenterID"),
-            record.get("TemplateID"),
-            record.get("DepartmentID"),
-            record.get("SortOrder"),
-            record.get("UpdatedBy"),
-            record.get("IsDeleted"),
-            record.get("EquipmentClassID"),
-            record.get("WorkUnitThingName"),
-            record.get("ProductionCountMultiplier"),
-            record.get("IsFirstUnit"),
-            record.get("IsLastUnit"),
-            record.get("FunctionalLocation"),
-        ]
-        statement = "EXEC %s " % SP_UPDATE_EQUIPMENT + ", ".join([
-            "@ID=?",
-            "@Name=?",
-            "@Description=?",
-            "@AlternateName=?",
-            "@Code=?",
-            "@EquipmentTypeID=?",
-            "@EquipmentParentID=?",
-            "@IsConsumptionPoint=?",
-            "@IsProductionPoint=?",
-            "@ConsumptionCycle=?",
-            "@ProductionCycle=?",
-            "@LocationID=?",
-            "@ShiftScheduleID=?",
-            "@QueqeTime=?",
-            "@WaitTime=?",
-            "@WorkCenterID=?",
-            "@TemplateID=?",
-            "@DepartmentID=?",
-            "@SortOrder=?",
-            "@UpdatedBy=?",
-            "@IsDeleted=?",
-            "@EquipmentClassID=?",
-            "@WorkUnitThingName=?",
-            "@ProductionCountMultiplier=?",
-            "@IsFirstUnit=?",
-            "@IsLastUnit=?",
-            "@FunctionalLocation=?",
-        ])
-        result = self._run_query(statement, params, ds)
+        result = self._call(SP_UPDATE_EQUIPMENT, self._update_equipment_params(record), ds)
         return self._first_row(result)
 
     def delete_equipment(self, equipment_id, user_id):
         ds = self._resolve_datasource(user_id)
-        statement = "EXEC %s @EquipmentID=?" % SP_DELETE_EQUIPMENT
-        result = self._run_query(statement, [equipment_id], ds)
+        result = self._call(SP_DELETE_EQUIPMENT, [("@EquipmentID", equipment_id)], ds)
         return self._first_row(result)
 
     def insert_department(self, record, user_id):
         ds = self._resolve_datasource(user_id)
-        params = [
-            record.get("Name"),
-            record.get("Description"),
-            record.get("Category"),
-            record.get("SortOrder"),
-            record.get("IsDeleted"),
-            record.get("DepartmentTypeID"),
-            record.get("DepartmentParentID"),
-            record.get("IsOrderLinkingSupported"),
-            record.get("EquipmentID"),
-            record.get("InsertedBy"),
-            record.get("JobOrderCompletionThreshold"),
-            record.get("AlternateName"),
-            record.get("DepartmentNumber"),
-            record.get("FunctionalLocation"),
-            record.get("WorkstationOptimization"),
-        ]
-        statement = "EXEC %s " % SP_INSERT_DEPARTMENT + ", ".join([
-            "@Name=?",
-            "@Description=?",
-            "@Category=?",
-            "@SortOrder=?",
-            "@IsDeleted=?",
-            "@DepartmentTypeID=?",
-            "@DepartmentParentID=?",
-            "@IsOrderLinkingSupported=?",
-            "@EquipmentID=?",
-            "@InsertedBy=?",
-            "@JobOrderCompletionThreshold=?",
-            "@AlternateName=?",
-            "@DepartmentNumber=?",
-            "@FunctionalLocation=?",
-            "@WorkstationOptimization=?",
-        ])
-        result = self._run_query(statement, params, ds)
+        result = self._call(SP_INSERT_DEPARTMENT, self._insert_department_params(record), ds)
         return self._first_row(result)
 
     def update_department(self, record, user_id):
         ds = self._resolve_datasource(user_id)
-        params = [
-            record.get("DepartmentID"),
-            record.get("Name"),
-            record.get("Description"),
-            record.get("Category"),
-            record.get("SortOrder"),
-            record.get("IsDeleted"),
-            record.get("DepartmentTypeID"),
-            record.get("DepartmentParentID"),
-            record.get("IsOrderLinkingSupported"),
-            record.get("EquipmentID"),
-            record.get("UpdatedBy"),
-            record.get("JobOrderCompletionThreshold"),
-            record.get("AlternateName"),
-            record.get("FunctionalLocation"),
-            record.get("WorkstationOptimization"),
-        ]
-        statement = "EXEC %s " % SP_UPDATE_DEPARTMENT + ", ".join([
-            "@DepartmentID=?",
-            "@Name=?",
-            "@Description=?",
-            "@Category=?",
-            "@SortOrder=?",
-            "@IsDeleted=?",
-            "@DepartmentTypeID=?",
-            "@DepartmentParentID=?",
-            "@IsOrderLinkingSupported=?",
-            "@EquipmentID=?",
-            "@UpdatedBy=?",
-            "@JobOrderCompletionThreshold=?",
-            "@AlternateName=?",
-            "@FunctionalLocation=?",
-            "@WorkstationOptimization=?",
-        ])
-        result = self._run_query(statement, params, ds)
+        result = self._call(SP_UPDATE_DEPARTMENT, self._update_department_params(record), ds)
         return self._first_row(result)
 
     def delete_department(self, department_id, updated_by, user_id):
         ds = self._resolve_datasource(user_id)
-        params = [department_id, updated_by]
-        statement = "EXEC %s @DepartmentID=?, @UpdatedBy=?" % SP_DELETE_DEPARTMENT
-        result = self._run_query(statement, params, ds)
+        params = [("@DepartmentID", department_id), ("@UpdatedBy", updated_by)]
+        result = self._call(SP_DELETE_DEPARTMENT, params, ds)
         return self._first_row(result)
 
     def insert_equipment_class(self, record, user_id):
         ds = self._resolve_datasource(user_id)
         params = [
-            record.get("Name"),
-            record.get("Description"),
-            record.get("AlternateName"),
-            record.get("Code"),
-            record.get("InsertedBy"),
-            record.get("IsDeleted"),
-            record.get("TrainingSetpointDuration"),
-            record.get("EquipmentClassNumber"),
+            ("@Name", record.get("Name")),
+            ("@Description", record.get("Description")),
+            ("@AlternateName", record.get("AlternateName")),
+            ("@Code", record.get("Code")),
+            ("@InsertedBy", record.get("InsertedBy")),
+            ("@IsDeleted", record.get("IsDeleted")),
+            ("@TrainingSetpointDuration", record.get("TrainingSetpointDuration")),
+            ("@EquipmentClassNumber", record.get("EquipmentClassNumber")),
         ]
-        statement = "EXEC %s " % SP_INSERT_EQUIPMENT_CLASS + ", ".join([
-            "@Name=?",
-            "@Description=?",
-            "@AlternateName=?",
-            "@Code=?",
-            "@InsertedBy=?",
-            "@IsDeleted=?",
-            "@TrainingSetpointDuration=?",
-            "@EquipmentClassNumber=?",
-        ])
-        result = self._run_query(statement, params, ds)
+        result = self._call(SP_INSERT_EQUIPMENT_CLASS, params, ds)
         return self._first_row(result)
 
     def update_workstation_sort_order(self, json_payload, user_id):
         ds = self._resolve_datasource(user_id)
-        statement = "EXEC %s @JsonDept=?" % SP_UPDATE_WORKSTATION_SORT_ORDER
-        return self._run_query(statement, [json_payload], ds)
+        return self._call(SP_UPDATE_WORKSTATION_SORT_ORDER, [("@JsonDept", json_payload)], ds)
 
     def bulk_upload_machines(self, json_payload, clock_id, user_id):
         ds = self._resolve_datasource(user_id)
-        statement = "EXEC %s @JSONMaterialsList=?, @ClockID=?" % SP_BULK_UPLOAD_MACHINES
-        result = self._run_query(statement, [json_payload, clock_id], ds)
+        params = [("@JSONMaterialsList", json_payload), ("@ClockID", clock_id)]
+        result = self._call(SP_BULK_UPLOAD_MACHINES, params, ds)
         return self._first_row(result)
+
+    # ------------------------------------------------------------------
+    # Batch command implementations
+    # ------------------------------------------------------------------
+    def insert_equipment_batch(self, records, user_id, chunk_size=None, atomic=True):
+        rows = [self._insert_equipment_params(record) for record in records]
+        return self._write_batch(SP_INSERT_EQUIPMENT, rows, user_id, chunk_size, atomic)
+
+    def update_equipment_batch(self, records, user_id, chunk_size=None, atomic=True):
+        rows = [self._update_equipment_params(record) for record in records]
+        return self._write_batch(SP_UPDATE_EQUIPMENT, rows, user_id, chunk_size, atomic)
+
+    def delete_equipment_batch(self, equipment_ids, user_id, chunk_size=None, atomic=True):
+        rows = [[("@EquipmentID", equipment_id)] for equipment_id in equipment_ids]
+        return self._write_batch(SP_DELETE_EQUIPMENT, rows, user_id, chunk_size, atomic)
+
+    def insert_department_batch(self, records, user_id, chunk_size=None, atomic=True):
+        rows = [self._insert_department_params(record) for record in records]
+        return self._write_batch(SP_INSERT_DEPARTMENT, rows, user_id, chunk_size, atomic)
+
+    def update_department_batch(self, records, user_id, chunk_size=None, atomic=True):
+        rows = [self._update_department_params(record) for record in records]
+        return self._write_batch(SP_UPDATE_DEPARTMENT, rows, user_id, chunk_size, atomic)
+
+    def delete_department_batch(self, department_ids, updated_by, user_id, chunk_size=None, atomic=True):
+        rows = [[("@DepartmentID", department_id), ("@UpdatedBy", updated_by)] for department_id in department_ids]
+        return self._write_batch(SP_DELETE_DEPARTMENT, rows, user_id, chunk_size, atomic)
+
+    def _write_batch(self, procedure, param_rows, user_id, chunk_size=None, atomic=True):
+        """
+        Execute procedure once per row and return per-row outcomes.
+
+        atomic=True runs every row in one transaction, so the whole batch costs a
+        single commit and the first failure rolls everything back. atomic=False
+        commits each chunk of chunk_size rows on its own; a failed chunk is rolled
+        back without stopping the chunks after it.
+        """
+        ds = self._resolve_datasource(user_id)
+        size = max(1, int(chunk_size or BATCH_CHUNK_SIZE))
+        indexes = list(range(len(param_rows)))
+        if atomic or gateway.current_scope() is not None:
+            groups = [indexes]
+        else:
+            groups = [indexes[i:i + size] for i in range(0, len(indexes), size)]
+
+        outcomes = [None] * len(param_rows)
+        for group in groups:
+            if group:
+                self._write_group(procedure, param_rows, group, ds, outcomes)
+        self._log.debug("Batch %s: %s rows in %s transaction(s)" % (procedure, len(indexes), len(groups)))
+
+        succeeded = len([o for o in outcomes if o["Status"] == "OK"])
+        return {
+            "SuccessCount": succeeded,
+            "FailureCount": len(outcomes) - succeeded,
+            "Rows": outcomes,
+        }
+
+    def _write_group(self, procedure, param_rows, indexes, datasource, outcomes):
+        scope = gateway.current_scope()
+        if scope is not None:
+            # The enclosing unit of work owns the transaction; a failure marks it
+            # rollback-only so rows already written are undone with it.
+            error = self._write_rows(procedure, param_rows, indexes, datasource, scope.transaction(datasource), outcomes)
+            if error is not None:
+                scope.set_rollback_only()
+                self._mark_rolled_back(indexes, outcomes, error)
+            return
+
+        try:
+            tx = gateway.begin(datasource)
+        except gateway.Unavailable:
+            tx = None  # outside Ignition rows are simulated without a transaction
+
+        error = None
+        try:
+            error = self._write_rows(procedure, param_rows, indexes, datasource, tx, outcomes)
+            if tx is not None and error is None:
+                try:
+                    gateway.commit(tx)
+                except Exception as exc:
+                    error = exc
+            if tx is not None and error is not None:
+                try:
+                    gateway.rollback(tx)
+                except Exception:
+                    pass
+                self._mark_rolled_back(indexes, outcomes, error)
+        finally:
+            if tx is not None:
+                try:
+                    gateway.close(tx)
+                except Exception:
+                    pass
+
+    def _write_rows(self, procedure, param_rows, indexes, datasource, tx, outcomes):
+        """Run rows in order until one fails; returns that error (rows after it are skipped)."""
+        error = None
+        for index in indexes:
+            if error is not None:
+                outcomes[index] = {"Index": index, "Status": "Skipped", "Error": str(error)}
+                continue
+            try:
+                result = self._first_row(gateway.call(procedure, param_rows[index], datasource, tx))
+                message = result.get("OutputMessage")
+                if message and message not in SUCCESS_MESSAGES:
+                    raise rex.RepositoryException(message)
+            except gateway.Unavailable:
+                result = {}
+            except Exception as exc:
+                error = exc
+                outcomes[index] = {"Index": index, "Status": "Failed", "Error": str(exc)}
+                continue
+            outcomes[index] = {"Index": index, "Status": "OK", "Result": result}
+        return error
+
+    @staticmethod
+    def _mark_rolled_back(indexes, outcomes, error):
+        for index in indexes:
+            if outcomes[index]["Status"] == "OK":
+                outcomes[index] = {"Index": index, "Status": "RolledBack", "Error": str(error)}
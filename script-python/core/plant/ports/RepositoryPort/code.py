@@ -23,6 +23,9 @@ class PlantRepositoryPort(object):
     def fetch_equipment_details(self, filters, user_id):
         raise NotImplementedError
 
+    def iter_equipment_details(self, filters, user_id):
+        raise NotImplementedError
+
     def fetch_equipment_class_dropdown(self, user_id):
         raise NotImplementedError
 
@@ -32,6 +35,9 @@ class PlantRepositoryPort(object):
     def fetch_workstation_from_machine(self, equipment_id, user_id):
         raise NotImplementedError
 
+    def fetch_plant_screen(self, department_id, user_id):
+        raise NotImplementedError
+
     def insert_equipment(self, equipment, user_id):
         raise NotImplementedError
 
@@ -50,6 +56,24 @@ class PlantRepositoryPort(object):
     def delete_department(self, department_id, updated_by, user_id):
         raise NotImplementedError
 
+    def insert_equipment_batch(self, records, user_id, chunk_size=None, atomic=True):
+        raise NotImplementedError
+
+    def update_equipment_batch(self, records, user_id, chunk_size=None, atomic=True):
+        raise NotImplementedError
+
+    def delete_equipment_batch(self, equipment_ids, user_id, chunk_size=None, atomic=True):
+        raise NotImplementedError
+
+    def insert_department_batch(self, records, user_id, chunk_size=None, atomic=True):
+        raise NotImplementedError
+
+    def update_department_batch(self, records, user_id, chunk_size=None, atomic=True):
+        raise NotImplementedError
+
+    def delete_department_batch(self, department_ids, updated_by, user_id, chunk_size=None, atomic=True):
+        raise NotImplementedError
+
     def insert_equipment_class(self, equipment_class, user_id):
         raise NotImplementedError
 
@@ -1,24 +1,55 @@
 """Application façade for plant bounded context interactions."""
 
+from adapters.messaging.ChangeFeed import code as feed
+from common.concurrency.Executor import code as executor
 from common.logging.LogFactory import code as LogFactory
 from core.plant.application.Commands import code as cmds
 from core.plant.application.CommandHandlers import code as ch
 from core.plant.application.Queries import code as queries
 from core.plant.application.QueryHandlers import code as qh
+from core.plant.infrastructure.CacheAdapter import code as cache
 from core.plant.infrastructure.RepositoryAdapter import code as repo
 
 _LOG = LogFactory.get_logger("PlantController")
+_QUERY_POOL = "plant-queries"
+_QUERY_POOL_SIZE = 8
+
+try:
+    string_types = (basestring,)  # type: ignore[name-defined]
+except Exception:  # pragma: no cover - Python 3 fallback
+    string_types = (str,)
 
 
 class PlantController(object):
-    def __init__(self, user_id, repository=None):
+    def __init__(self, user_id, repository=None, cache_port=None):
         self.user_id = user_id
         self.repository = repository or repo.PlantRepositoryAdapter()
+        self.cache_port = cache_port or _CachePort()
 
     # ----------------------------- Queries ---------------------------------
     def get_equipment_tree(self):
         q = queries.GetEquipmentTreeQuery(self.user_id)
-        return qh.handle_get_equipment_tree(q, self.repository)
+        return qh.handle_get_equipment_tree(q, self.repository, self.cache_port)
+
+    def get_plant_hierarchy(self):
+        q = queries.GetPlantHierarchyQuery(self.user_id)
+        return qh.handle_get_plant_hierarchy(q, self.repository, self.cache_port)
+
+    def get_equipment_children(self, parent_ids=None, cursor=None, page_size=None):
+        q = queries.GetEquipmentChildrenQuery(self.user_id, parent_ids, cursor, page_size)
+        return qh.handle_get_equipment_children(q, self.repository, self.cache_port)
+
+    def search_equipment(self, text, limit=20, equipment_type=None, department_id=None, parent_id=None):
+        q = queries.SearchEquipmentQuery(self.user_id, text, limit, equipment_type, department_id, parent_id)
+        return qh.handle_search_equipment(q, self.repository, self.cache_port)
+
+    def search_equipment_classes(self, text, limit=20):
+        q = queries.SearchEquipmentClassesQuery(self.user_id, text, limit)
+        return qh.handle_search_equipment_classes(q, self.repository, self.cache_port)
+
+    def subscribe_plant_changes(self, session_id, department_ids=None, page_id=None):
+        """Push equipment deltas of department_ids (None: every department) to the session."""
+        return feed.subscribe(session_id, ch.PLANT_FEED_MODEL, department_ids, page_id)
 
     def get_equipment_dropdown(self):
         q = queries.GetEquipmentDropdownQuery(self.user_id)
@@ -44,6 +75,10 @@ class PlantController(object):
         q = queries.GetEquipmentDetailsQuery(self.user_id, equipment_id, workstation_id, workcenter_id)
         return qh.handle_get_equipment_details(q, self.repository)
 
+    def get_machine_index(self):
+        q = queries.GetMachineIndexQuery(self.user_id)
+        return qh.handle_get_machine_index(q, self.repository, self.cache_port)
+
     def get_equipment_class_dropdown(self):
         q = queries.GetEquipmentClassDropdownQuery(self.user_id)
         return qh.handle_get_equipment_class_dropdown(q, self.repository)
@@ -56,42 +91,88 @@ class PlantController(object):
         q = queries.GetWorkstationFromMachineQuery(self.user_id, equipment_id)
         return qh.handle_get_workstation_from_machine(q, self.repository)
 
+    def get_plant_screen(self, department_id=None):
+        q = queries.GetPlantScreenQuery(self.user_id, department_id)
+        return qh.handle_get_plant_screen(q, self.repository, self.cache_port)
+
     def export_machines(self, equipment_id=None, workstation_id=None, workcenter_id=None):
         q = queries.ExportMachinesQuery(self.user_id, equipment_id, workstation_id, workcenter_id)
         return qh.handle_export_machines(q, self.repository)
 
+    def stream_export_machines(self, equipment_id=None, workstation_id=None, workcenter_id=None):
+        q = queries.ExportMachinesQuery(self.user_id, equipment_id, workstation_id, workcenter_id)
+        return qh.handle_stream_export_machines(q, self.repository)
+
     def filter_valid_machines(self, machines_data):
         q = queries.FilterValidMachinesQuery(machines_data)
         return qh.handle_filter_valid_machines(q)
 
+    # ----------------------------- Fan-out ---------------------------------
+    def gather(self, calls, timeout=None, timeouts=None):
+        """
+        Run independent queries concurrently and return {name: result}.
+        calls maps a name to a query method name or callable, e.g.
+        {"tree": "get_equipment_tree", "classes": "get_equipment_class_dropdown"}.
+        """
+        resolved = {}
+        for name, call in calls.items():
+            resolved[name] = getattr(self, call) if isinstance(call, string_types) else call
+        pool = executor.shared(_QUERY_POOL, _QUERY_POOL_SIZE)
+        return executor.gather(resolved, timeout=timeout, timeouts=timeouts, pool=pool)
+
     # ----------------------------- Commands --------------------------------
     def create_equipment(self, payload):
         command = cmds.CreateEquipmentCommand(self.user_id, payload)
-        return ch.handle_create_equipment(command, self.repository)
+        return ch.handle_create_equipment(command, self.repository, self.cache_port)
 
     def update_equipment(self, payload):
         command = cmds.UpdateEquipmentCommand(self.user_id, payload)
-        return ch.handle_update_equipment(command, self.repository)
+        return ch.handle_update_equipment(command, self.repository, self.cache_port)
 
     def delete_equipment(self, equipment_id):
         command = cmds.DeleteEquipmentCommand(self.user_id, equipment_id)
-        return ch.handle_delete_equipment(command, self.repository)
+        return ch.handle_delete_equipment(command, self.repository, self.cache_port)
 
     def create_department(self, payload):
         command = cmds.CreateDepartmentCommand(self.user_id, payload)
-        return ch.handle_create_department(command, self.repository)
+        return ch.handle_create_department(command, self.repository, self.cache_port)
 
     def update_department(self, payload):
         command = cmds.UpdateDepartmentCommand(self.user_id, payload)
-        return ch.handle_update_department(command, self.repository)
+        return ch.handle_update_department(command, self.repository, self.cache_port)
 
     def delete_department(self, department_id, updated_by):
         command = cmds.DeleteDepartmentCommand(self.user_id, department_id, updated_by)
-        return ch.handle_delete_department(command, self.repository)
+        return ch.handle_delete_department(command, self.repository, self.cache_port)
+
+    # --------------------------- Batch commands ----------------------------
+    def create_equipment_batch(self, payloads, chunk_size=None, atomic=True):
+        command = cmds.CreateEquipmentBatchCommand(self.user_id, payloads, chunk_size, atomic)
+        return ch.handle_create_equipment_batch(command, self.repository, self.cache_port)
+
+    def update_equipment_batch(self, payloads, chunk_size=None, atomic=True):
+        command = cmds.UpdateEquipmentBatchCommand(self.user_id, payloads, chunk_size, atomic)
+        return ch.handle_update_equipment_batch(command, self.repository, self.cache_port)
+
+    def delete_equipment_batch(self, equipment_ids, chunk_size=None, atomic=True):
+        command = cmds.DeleteEquipmentBatchCommand(self.user_id, equipment_ids, chunk_size, atomic)
+        return ch.handle_delete_equipment_batch(command, self.repository, self.cache_port)
+
+    def create_department_batch(self, payloads, chunk_size=None, atomic=True):
+        command = cmds.CreateDepartmentBatchCommand(self.user_id, payloads, chunk_size, atomic)
+        return ch.handle_create_department_batch(command, self.repository, self.cache_port)
+
+    def update_department_batch(self, payloads, chunk_size=None, atomic=True):
+        command = cmds.UpdateDepartmentBatchCommand(self.user_id, payloads, chunk_size, atomic)
+        return ch.handle_update_department_batch(command, self.repository, self.cache_port)
+
+    def delete_department_batch(self, department_ids, updated_by, chunk_size=None, atomic=True):
+        command = cmds.DeleteDepartmentBatchCommand(self.user_id, department_ids, updated_by, chunk_size, atomic)
+        return ch.handle_delete_department_batch(command, self.repository, self.cache_port)
 
     def insert_equipment_class(self, payload):
         command = cmds.InsertEquipmentClassCommand(self.user_id, payload)
-        return ch.handle_insert_equipment_class(command, self.repository)
+        return ch.handle_insert_equipment_class(command, self.repository, self.cache_port)
 
     def update_workstation_sort_order(self, sequence):
         command = cmds.UpdateWorkstationSortOrderCommand(self.user_id, sequence)
@@ -99,4 +180,19 @@ class PlantController(object):
 
     def bulk_upload_machines(self, json_payload, clock_id):
         command = cmds.BulkUploadMachinesCommand(self.user_id, json_payload, clock_id)
-        return ch.handle_bulk_upload_machines(command, self.repository)
+        return ch.handle_bulk_upload_machines(command, self.repository, self.cache_port)
+
+    def bulk_upload_machines_chunked(self, rows, clock_id, upload_id=None, chunk_size=None):
+        command = cmds.BulkUploadMachinesChunkedCommand(self.user_id, rows, clock_id, upload_id, chunk_size)
+        return ch.handle_bulk_upload_machines_chunked(command, self.repository, self.cache_port)
+
+
+class _CachePort(object):
+    def get(self, key):
+        return cache.get(key)
+
+    def put(self, key, value, ttl_seconds=60):
+        return cache.put(key, value, ttl_seconds)
+
+    def invalidate(self, key=None):
+        return cache.invalidate(key)
@@ -4,7 +4,10 @@ import csv
 import json
 from io import StringIO
 
+from common.cache.CacheManager import code as local_cache
 from common.logging.LogFactory import code as LogFactory
+from common.utils.StreamingExport import code as streaming_export
+from core.plant.domain.DomainServices import code as domain_services
 from core.plant.presentation.PlantController import code as controller_module
 
 _LOG = LogFactory.get_logger("PlantView")
@@ -56,8 +59,35 @@ DEPARTMENT_COLUMNS = [
     "WorkstationOptimization",
 ]
 
+DEPARTMENT_DROPDOWN_COLUMNS = [
+    "DepartmentID",
+    "DepartmentName",
+    "DepartmentParentID",
+    "DepartmentTypeID",
+    "DepartmentNumber",
+    "label",
+    "value",
+]
+
+EQUIPMENT_CLASS_COLUMNS = [
+    "ID",
+    "Name",
+    "Description",
+    "AlternateName",
+    "Code",
+    "label",
+    "value",
+]
+
 DROPDOWN_COLUMNS = ["label", "value"]
 
+PLANT_MODEL_PAGE_SIZE = 200
+SEARCH_LIMIT = 20
+MACHINE_CSV_CHUNK_SIZE = 500
+# Validation sessions hold the live machine index, so they stay in the local cache.
+VALIDATION_SESSION_CACHE = "bulk-validation"
+VALIDATION_SESSION_TTL_SECONDS = 30 * 60
+
 
 def _object_to_dict(obj):
     if hasattr(obj, "to_record"):
@@ -120,6 +150,47 @@ def get_plant_model(user_id):
     return _to_dataset(records, EQUIPMENT_COLUMNS)
 
 
+def subscribe_plant_model(user_id, SessionID, DepartmentIDs=None, PageID=None):
+    """Have the "mes-change" message handler of the screen refetch rows instead of polling get_plant_model."""
+    controller = controller_module.PlantController(user_id)
+    return controller.subscribe_plant_changes(SessionID, DepartmentIDs, PageID)
+
+
+def get_plant_model_rows(user_id, EquipmentIDs):
+    """Rows of the given equipment only, for the added/changed ids of a pushed change."""
+    wanted = set(str(equipment_id) for equipment_id in EquipmentIDs or [])
+    controller = controller_module.PlantController(user_id)
+    records = [_object_to_dict(item) for item in controller.get_equipment_tree() or []]
+    return _to_dataset([r for r in records if str(r.get("ID")) in wanted], EQUIPMENT_COLUMNS)
+
+
+def get_plant_model_children(user_id, ParentIDs=None, Cursor=None, PageSize=PLANT_MODEL_PAGE_SIZE):
+    controller = controller_module.PlantController(user_id)
+    page = controller.get_equipment_children(ParentIDs, Cursor, PageSize) or {}
+    if not isinstance(page, dict):
+        return page
+    return {
+        "children": _to_dataset(page.get("items") or [], EQUIPMENT_COLUMNS),
+        "nextCursors": page.get("next_cursors") or {},
+    }
+
+
+def get_plant_screen_data(user_id, DepartmentID=None):
+    controller = controller_module.PlantController(user_id)
+    screen = controller.get_plant_screen(DepartmentID) or {}
+    if not isinstance(screen, dict):
+        return screen
+
+    def records(key):
+        return [_object_to_dict(item) for item in screen.get(key) or []]
+
+    return {
+        "plantModel": _to_dataset(records("equipment_tree"), EQUIPMENT_COLUMNS),
+        "departments": _to_dataset(records("department_dropdown"), DEPARTMENT_DROPDOWN_COLUMNS),
+        "equipmentClasses": _to_dataset(records("equipment_classes"), EQUIPMENT_CLASS_COLUMNS),
+    }
+
+
 def get_plant_model_dropdown(user_id):
     controller = controller_module.PlantController(user_id)
     equipment = controller.get_equipment_dropdown() or []
@@ -127,6 +198,21 @@ def get_plant_model_dropdown(user_id):
     return _to_dataset(records, EQUIPMENT_DROPDOWN_COLUMNS)
 
 
+def search_plant_model_dropdown(user_id, Query, Limit=SEARCH_LIMIT, EquipmentType=None, DepartmentID=None, ParentID=None):
+    controller = controller_module.PlantController(user_id)
+    equipment = controller.search_equipment(Query, Limit, EquipmentType, DepartmentID, ParentID) or []
+    records = [_object_to_dict(item) for item in equipment]
+    return _to_dataset(records, EQUIPMENT_DROPDOWN_COLUMNS)
+
+
+def search_equipment_dropdown(user_id, Query, Limit=SEARCH_LIMIT, WorkStationID=None, WorkCenterID=None):
+    controller = controller_module.PlantController(user_id)
+    parent_id = WorkStationID if WorkStationID is not None else WorkCenterID
+    machines = controller.search_equipment(Query, Limit, "WorkUnit", None, parent_id) or []
+    records = [_object_to_dict(item) for item in machines]
+    return _to_dataset(records, DROPDOWN_COLUMNS)
+
+
 def insert_equipment(user_id, **kwargs):
     username = _resolve_username(user_id)
     payload = dict(kwargs)
@@ -185,6 +271,61 @@ def insert_department(user_id, **kwargs):
     return getattr(result, "value", result)
 
 
+def _batch_payloads(rows, username, *defaults):
+    payloads = []
+    for row in rows or []:
+        payload = _object_to_dict(row)
+        for field in defaults:
+            payload.setdefault(field, username)
+        payloads.append(payload)
+    return payloads
+
+
+def insert_equipment_batch(user_id, rows, atomic=True):
+    username = _resolve_username(user_id)
+    payloads = _batch_payloads(_dataset_to_dicts(rows), username, "InsertedBy", "UpdatedBy")
+    controller = controller_module.PlantController(user_id)
+    result = controller.create_equipment_batch(payloads, atomic=atomic)
+    return getattr(result, "value", result)
+
+
+def update_equipment_batch(user_id, rows, atomic=True):
+    username = _resolve_username(user_id)
+    payloads = _batch_payloads(_dataset_to_dicts(rows), username, "UpdatedBy")
+    controller = controller_module.PlantController(user_id)
+    result = controller.update_equipment_batch(payloads, atomic=atomic)
+    return getattr(result, "value", result)
+
+
+def delete_equipment_batch(user_id, IDs, atomic=True):
+    controller = controller_module.PlantController(user_id)
+    result = controller.delete_equipment_batch(list(IDs or []), atomic=atomic)
+    return getattr(result, "value", result)
+
+
+def insert_department_batch(user_id, rows, atomic=True):
+    username = _resolve_username(user_id)
+    payloads = _batch_payloads(_dataset_to_dicts(rows), username, "InsertedBy")
+    controller = controller_module.PlantController(user_id)
+    result = controller.create_department_batch(payloads, atomic=atomic)
+    return getattr(result, "value", result)
+
+
+def update_department_batch(user_id, rows, atomic=True):
+    username = _resolve_username(user_id)
+    payloads = _batch_payloads(_dataset_to_dicts(rows), username, "UpdatedBy")
+    controller = controller_module.PlantController(user_id)
+    result = controller.update_department_batch(payloads, atomic=atomic)
+    return getattr(result, "value", result)
+
+
+def delete_department_batch(user_id, DepartmentIDs, atomic=True):
+    username = _resolve_username(user_id)
+    controller = controller_module.PlantController(user_id)
+    result = controller.delete_department_batch(list(DepartmentIDs or []), username, atomic=atomic)
+    return getattr(result, "value", result)
+
+
 def get_department(user_id, department_id=None):
     controller = controller_module.PlantController(user_id)
     departments = controller.get_departments(department_id) or []
@@ -227,15 +368,7 @@ def get_line_workstation_dropdown(user_id, DepartmentID=None):
     controller = controller_module.PlantController(user_id)
     departments = controller.get_department_dropdown(DepartmentID) or []
     records = [_object_to_dict(item) for item in departments]
-    return _to_dataset(records, [
-        "DepartmentID",
-        "DepartmentName",
-        "DepartmentParentID",
-        "DepartmentTypeID",
-        "DepartmentNumber",
-        "label",
-        "value",
-    ])
+    return _to_dataset(records, DEPARTMENT_DROPDOWN_COLUMNS)
 
 
 def get_workcenter_dropdown(user_id):
@@ -261,15 +394,14 @@ def get_equipment_class_dropdown(user_id):
     controller = controller_module.PlantController(user_id)
     classes = controller.get_equipment_class_dropdown() or []
     records = [_object_to_dict(item) for item in classes]
-    return _to_dataset(records, [
-        "ID",
-        "Name",
-        "Description",
-        "AlternateName",
-        "Code",
-        "label",
-        "value",
-    ])
+    return _to_dataset(records, EQUIPMENT_CLASS_COLUMNS)
+
+
+def search_equipment_class_dropdown(user_id, Query, Limit=SEARCH_LIMIT):
+    controller = controller_module.PlantController(user_id)
+    classes = controller.search_equipment_classes(Query, Limit) or []
+    records = [_object_to_dict(item) for item in classes]
+    return _to_dataset(records, EQUIPMENT_CLASS_COLUMNS)
 
 
 def insert_equipment_class(user_id, **kwargs):
@@ -282,10 +414,7 @@ def insert_equipment_class(user_id, **kwargs):
 
 
 def check_special_char(input_string):
-    special_characters = "}~!@#$%^&*(`)+={[]|\\:;<,>.?/\"'"
-    if input_string is None:
-        return False
-    return any(c in special_characters for c in str(input_string))
+    return domain_services.has_special_characters(input_string)
 
 
 def get_plant_model_equipment_name(user_id, PlantModelType):
@@ -353,84 +482,93 @@ def export_machines(user_id, EquipmentID=None, WorkStationID=None, WorkCenterID=
         return export_data
 
 
-def read_and_process_machines_csv(user_id, filedata):
-    reader = list(csv.DictReader(StringIO(filedata)))
-    duplicate_machines = set()
-    for i in range(len(reader) - 1):
-        left_name = (reader[i].get("MachineName") or "").strip()
-        if not left_name:
-            continue
-        for j in range(i + 1, len(reader)):
-            right_name = (reader[j].get("MachineName") or "").strip()
-            if left_name and left_name == right_name:
-                duplicate_machines.add(left_name)
+def write_machines_export(user_id, stream, EquipmentID=None, WorkStationID=None, WorkCenterID=None,
+                          export_format=streaming_export.CSV, compress=False):
+    """Stream the machine export into a binary file-like object."""
+    controller = controller_module.PlantController(user_id)
+    export = controller.stream_export_machines(EquipmentID, WorkStationID, WorkCenterID)
+    if not isinstance(export, dict):
+        return export
+    return streaming_export.write(stream, export["headers"], export["rows"], export_format, compress)
+
+
+def export_machines_file(user_id, EquipmentID=None, WorkStationID=None, WorkCenterID=None,
+                         export_format=streaming_export.CSV, compress=False, path=None):
+    """Stream the machine export to a file (temp file by default) and return its summary."""
+    controller = controller_module.PlantController(user_id)
+    export = controller.stream_export_machines(EquipmentID, WorkStationID, WorkCenterID)
+    if not isinstance(export, dict):
+        return export
+    return streaming_export.export_file(
+        export["headers"], export["rows"], export_format, compress, path, base_name="machines"
+    )
+
+
+def _iter_csv_rows(filedata):
+    return csv.DictReader(StringIO(filedata))
+
 
+def iter_machines_csv_chunks(user_id, filedata, chunk_size=MACHINE_CSV_CHUNK_SIZE):
+    if isinstance(filedata, bytes):
+        filedata = filedata.decode("utf-8")
     controller = controller_module.PlantController(user_id)
-    existing = controller.get_equipment_details(None, None, None) or []
+    service = domain_services.MachineCsvValidationService(controller.get_machine_index())
+    name_counts, total = service.count_names(_iter_csv_rows(filedata))
+
+    chunk = []
+    processed = 0
+    for row in service.iter_validated(_iter_csv_rows(filedata), name_counts):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            processed += len(chunk)
+            yield {"rows": chunk, "processed": processed, "total": total}
+            chunk = []
+    if chunk or not processed:
+        processed += len(chunk)
+        yield {"rows": chunk, "processed": processed, "total": total}
+
+
+def _machine_validation_session_key(user_id, session_id):
+    return "machines:%s:%s" % (user_id, session_id)
+
+
+def _machine_validation_session(user_id, session_id):
+    key = _machine_validation_session_key(user_id, session_id)
+    session = local_cache.get(VALIDATION_SESSION_CACHE, key)
+    if session is None:
+        controller = controller_module.PlantController(user_id)
+        session = domain_services.MachineCsvValidationService(controller.get_machine_index()).session()
+    local_cache.put(VALIDATION_SESSION_CACHE, key, session, VALIDATION_SESSION_TTL_SECONDS)
+    return session
+
+
+def read_and_process_machines_csv(user_id, filedata, progress=None, chunk_size=MACHINE_CSV_CHUNK_SIZE, session_id=None):
+    """
+    Validate an uploaded machine CSV. With a session_id the machine index and
+    row results are kept between calls, so re-sending the file after a fix only
+    re-validates the rows that changed.
+    """
+    if session_id:
+        if isinstance(filedata, bytes):
+            filedata = filedata.decode("utf-8")
+        processed = _machine_validation_session(user_id, session_id).validate(_iter_csv_rows(filedata))
+        if progress:
+            progress(len(processed), len(processed))
+        return processed
 
     processed = []
-    for row in reader:
-        row = {k: (v.strip() if isinstance(v, str) else v) for k, v in row.items()}
-        row.setdefault("Flag", 0)
-        row.setdefault("Reasons", {"value": "", "style": {}})
-        errors = []
-
-        if not row.get("MachineName"):
-            errors.append("Please Enter Machine Name!!")
-        if not row.get("MachineDescription"):
-            errors.append("Please Enter Machine Description!!")
-        if not row.get("MachineClass"):
-            errors.append("Please Enter Machine Class!!")
-        if not row.get("WorkCenter"):
-            errors.append("Please Enter Work Center!!")
-        if not row.get("WorkStation"):
-            errors.append("Please Enter Work Station!!")
-
-        if len(row.get("MachineName", "")) > 100:
-            errors.append("Machine Name cannot exceed 100 character length !!")
-        if len(row.get("MachineDescription", "")) > 200:
-            errors.append("Machine description cannot exceed 200 character length !!")
-        if row.get("AssetNumber") and len(row.get("AssetNumber")) > 100:
-            errors.append("Asset Number cannot exceed 100 character length !!")
-        if row.get("EquipmentNumber") and len(row.get("EquipmentNumber")) > 50:
-            errors.append("Equipment Number cannot exceed 50 character length !!")
-
-        if check_special_char(row.get("MachineName")) or check_special_char(row.get("FunctionalLocation")):
-            errors.append(
-                "Machine Name and Functional Location are allowed to have only these special characters Hypen (-), Space ( ), Underscore ( _ )"
-            )
-
-        if row.get("MachineName") in duplicate_machines:
-            errors.append("Same Machine Name present multiple times")
-
-        action = row.get("Action", "I")
-        if action not in ("I", "U", "D"):
-            errors.append("Please Enter Valid Action(I/U/D)")
-
-        if action == "I":
-            for machine in existing:
-                rec = _object_to_dict(machine)
-                if rec.get("EquipmentNumber") == row.get("EquipmentNumber") and (
-                    rec.get("WorkCenter") != row.get("WorkCenter")
-                ):
-                    errors.append("Equipment Number already assigned to different Work Center")
-                    break
-
-        row_errors = ",".join(errors)
-        if errors:
-            row["Flag"] = 1
-            row["Reasons"] = {
-                "value": row_errors,
-                "style": {
-                    "backgroundColor": "#FF474C",
-                    "font-weight": "bold",
-                    "color": "#FFFFFF",
-                },
-            }
-        processed.append(row)
+    for chunk in iter_machines_csv_chunks(user_id, filedata, chunk_size):
+        processed.extend(chunk["rows"])
+        if progress:
+            progress(chunk["processed"], chunk["total"])
     return processed
 
 
+def close_machines_validation_session(user_id, session_id):
+    local_cache.invalidate(VALIDATION_SESSION_CACHE, _machine_validation_session_key(user_id, session_id))
+    return True
+
+
 def filter_machines(machines_data):
     machines_data = machines_data or []
     return [row for row in machines_data if row.get("Flag") == 0]
@@ -440,3 +578,10 @@ def bulk_upload_machines(user_id, json_machines, clock_id):
     controller = controller_module.PlantController(user_id)
     result = controller.bulk_upload_machines(json_machines, clock_id)
     return getattr(result, "value", result)
+
+
+def bulk_upload_machines_chunked(user_id, machines_data, clock_id, UploadID=None, ChunkSize=None):
+    """Resuming after editing rows needs UploadID from the failed run; the default id hashes the rows."""
+    controller = controller_module.PlantController(user_id)
+    result = controller.bulk_upload_machines_chunked(_dataset_to_dicts(machines_data), clock_id, UploadID, ChunkSize)
+    return getattr(result, "value", result)
@@ -0,0 +1,170 @@
+"""
+ConfigService
+-------------
+In-memory view of the infrastructure settings, so hot paths never read a
+tag or a config file to make a decision.
+
+    backend = ConfigService.get("messaging.backend")
+
+- A setting is loaded from its *Config function on first use and then served
+  from memory; get() is a dict lookup and a clock check.
+- Settings backed by a tag are hot-reloaded from the gateway Tag Change event
+  script on that tag:
+      ConfigService.on_tag_change(str(event.tagPath), newValue.value)
+  Call reload() from the project update script when the *Config modules change.
+- max_age is the safety net for gateways without that script: a get() past
+  max_age still returns the cached value and reloads it on a background thread.
+- A loader that fails keeps the last good value (the default before the first
+  successful load) and logs a warning.
+"""
+
+import threading
+import time
+
+from common.concurrency.Executor import code as Executor
+from common.logging.LogFactory import code as LogFactory
+from infrastructure.CacheConfig import code as cache_cfg
+from infrastructure.DatabaseConfig import code as db_cfg
+from infrastructure.MessagingConfig import code as messaging_cfg
+from infrastructure.SecurityConfig import code as security_cfg
+
+log = LogFactory.get_logger("ConfigService")
+
+RELOAD_POOL = "config-reload"
+RETRY_SECONDS = 5  # after a failed load of a setting with max_age
+
+_UNLOADED = object()
+
+
+class Setting(object):
+    __slots__ = ("name", "loader", "tag", "max_age", "default", "normalize", "value", "expires", "refreshing")
+
+    def __init__(self, name, loader, tag=None, max_age=None, default=None, normalize=None):
+        self.name = name
+        self.loader = loader
+        self.tag = tag
+        self.max_age = max_age  # seconds, or a callable returning them
+        self.default = default
+        self.normalize = normalize
+        self.value = _UNLOADED
+        self.expires = None
+        self.refreshing = False
+
+
+_settings = {}
+_by_tag = {}
+_lock = threading.RLock()
+
+
+def _tag_key(path):
+    """Tag path without its [provider] prefix, case-insensitive."""
+    path = str(path or "").strip()
+    if path.startswith("["):
+        path = path[path.find("]") + 1:]
+    return path.lower()
+
+
+def register(name, loader, tag=None, max_age=None, default=None, normalize=None):
+    setting = Setting(name, loader, tag, max_age, default, normalize)
+    with _lock:
+        previous = _settings.get(name)
+        if previous is not None and previous.tag:
+            _by_tag.pop(_tag_key(previous.tag), None)
+        _settings[name] = setting
+        if tag:
+            _by_tag[_tag_key(tag)] = setting
+    return setting
+
+
+def _store(setting, value):
+    if setting.normalize is not None and value is not None:
+        value = setting.normalize(value)
+    max_age = setting.max_age() if callable(setting.max_age) else setting.max_age
+    with _lock:
+        previous, setting.value = setting.value, value
+        setting.expires = time.time() + max_age if max_age else None
+    if previous is not _UNLOADED and previous != value:
+        log.info("Setting %s changed from %s to %s" % (setting.name, previous, value))
+    return value
+
+
+def _load(setting):
+    try:
+        return _store(setting, setting.loader())
+    except Exception as ex:
+        log.warn("Could not load setting %s: %s" % (setting.name, ex))
+        with _lock:
+            if setting.value is _UNLOADED:
+                setting.value = setting.default
+            setting.expires = time.time() + RETRY_SECONDS if setting.max_age else None
+            return setting.value
+
+
+def _refresh(setting):
+    try:
+        _load(setting)
+    finally:
+        setting.refreshing = False
+
+
+def _refresh_in_background(setting):
+    with _lock:
+        if setting.refreshing:
+            return
+        setting.refreshing = True
+    try:
+        Executor.shared(RELOAD_POOL, 1).submit(_refresh, setting)
+    except RuntimeError:
+        setting.refreshing = False  # pool shut down with the gateway
+
+
+def get(name):
+    setting = _settings[name]
+    value = setting.value
+    if value is _UNLOADED:
+        with _lock:
+            if setting.value is _UNLOADED:
+                return _load(setting)
+            return setting.value
+    if setting.expires is not None and time.time() >= setting.expires:
+        _refresh_in_background(setting)
+    return value
+
+
+def on_tag_change(tag_path, value=None):
+    """Tag change event for a setting's tag; value None reloads it through its loader."""
+    setting = _by_tag.get(_tag_key(tag_path))
+    if setting is None:
+        return False
+    if value is None:
+        _load(setting)
+    else:
+        _store(setting, value)
+    return True
+
+
+def reload(name=None):
+    """Reload one setting, or all of them, synchronously; returns {name: value}."""
+    with _lock:
+        settings = [_settings[name]] if name is not None else list(_settings.values())
+    return dict((setting.name, _load(setting)) for setting in settings)
+
+
+def snapshot():
+    with _lock:
+        return dict((name, s.value) for name, s in _settings.items() if s.value is not _UNLOADED)
+
+
+def tags():
+    """Tag paths to add to the Tag Change event script."""
+    with _lock:
+        return sorted(s.tag for s in _settings.values() if s.tag)
+
+
+register("messaging.backend", messaging_cfg.backend, tag=messaging_cfg.BACKEND_TAG,
+         max_age=lambda: messaging_cfg.backend_refresh_seconds(), default="INTERNAL",
+         normalize=lambda value: str(value).upper())
+register("database.datasource", db_cfg.datasource_name)
+register("database.concurrency_wait_seconds", db_cfg.concurrency_wait_seconds, default=30)
+register("cache.default_ttl_seconds", cache_cfg.default_ttl_seconds, default=600)
+register("security.required_roles_for_write", security_cfg.required_roles_for_write, default=["MES-Author"])
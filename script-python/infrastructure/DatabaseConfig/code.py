@@ -1,3 +1,15 @@
 def datasource_name():
     # Set your Ignition DB connection name here
     return "MySQL_DB"
+
+# Per-datasource cap on concurrent queries issued from this gateway.
+# Keep below the connection pool size so a burst of screen loads queues here
+# instead of exhausting Ignition's pool. Datasources not listed are unbounded.
+MAX_CONCURRENT_QUERIES = {}
+
+def max_concurrent_queries(datasource):
+    return MAX_CONCURRENT_QUERIES.get(datasource)
+
+def concurrency_wait_seconds():
+    # How long a query waits for a free slot before failing
+    return 30
@@ -1,10 +1,31 @@
 # ISA-95 envelope helpers
-import datetime, uuid
+import threading, time, uuid
+
+# Correlation ids are "<noun>-<process id>-<sequence>": unique across gateways
+# without a uuid4 per event. The timestamp string is rebuilt once per second.
+_PROCESS_ID = uuid.uuid4().hex[:12]
+_sequence = [0]
+_lock = threading.Lock()
+_stamp = (None, None)
+
+def _next_sequence():
+    with _lock:
+        _sequence[0] += 1
+        return _sequence[0]
+
+def _timestamp():
+    global _stamp
+    second = int(time.time())
+    cached_second, text = _stamp
+    if cached_second != second:
+        text = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(second))
+        _stamp = (second, text)
+    return text
 
 def new_envelope(verb, noun, data, source="MES_Project", target="External", version="1.0"):
     return {
-        "correlationId": "%s-%s" % (noun, str(uuid.uuid4())),
-        "timestamp": datetime.datetime.utcnow().replace(microsecond=0).isoformat()+"Z",
+        "correlationId": "%s-%s-%d" % (noun, _PROCESS_ID, _next_sequence()),
+        "timestamp": _timestamp(),
         "verb": verb,
         "noun": noun,
         "data": data,
@@ -1,9 +1,117 @@
-# Runtime selection of messaging backend: 'INTERNAL', 'MQTT', 'KAFKA'
+# Runtime selection of messaging backend: 'INTERNAL', 'MQTT', 'KAFKA'.
+# Read through ConfigService, which caches it; add BACKEND_TAG to the gateway
+# Tag Change event script (ConfigService.on_tag_change) to switch at once.
+BACKEND_TAG = "[default]MES/Config/Messaging/Backend"
+
 def backend():
     try:
         from system.tag import readBlocking
-        # read a project tag e.g., [System]Messaging/Backend
-        pass
+        qualified = readBlocking([BACKEND_TAG])[0]
+        if qualified.quality.isGood() and qualified.value:
+            return str(qualified.value).upper()
     except Exception:
         return "INTERNAL"
     return "INTERNAL"
+
+# Seconds ConfigService serves the cached backend before re-reading the tag in
+# the background (safety net when the tag change script is not set up)
+def backend_refresh_seconds():
+    return 30
+
+# Transactional outbox for domain events. store 'LOG' appends them to log_path
+# (temp dir by default). 'DATABASE' keeps events in the outbox table next to
+# the business data (falls back to 'LOG' when no database is reachable); switch
+# only after Outbox.install_schema() has created the table and procedures.
+# Schedule Outbox.run_relay_once() in a gateway timer script as a safety net.
+def outbox_options():
+    return {
+        "store": "LOG",
+        "datasource": None,  # None: the datasource the unit of work writes to
+        "log_path": None,
+        "batch_size": 200,
+        "relay_on_commit": True,
+    }
+
+# Kafka producer (backend 'KAFKA'). bootstrap_servers "fake://<name>" uses the
+# in-process FakeKafkaBroker for offline tests. key_fields are tried in order on
+# each payload (then on its "data") for the partition key.
+def kafka_options():
+    return {
+        "bootstrap_servers": "localhost:9092",
+        "client_id": "ignition-mes",
+        "acks": "all",
+        "linger_ms": 20,
+        "batch_size": 65536,  # bytes per partition batch (Java client)
+        "batch_records": 500,  # records per partition batch (in-process producer)
+        "compression": "lz4",  # in-process producer: anything but 'none' is gzip
+        "key_fields": ("tenant", "tenant_id", "TenantID", "equipment_id", "EquipmentID",
+                       "machine_id", "MachineID", "material_id", "MaterialID"),
+        "delivery_timeout_seconds": 30,
+        "max_queue": 100000,
+    }
+
+# MQTT publisher (backend 'MQTT'). url: "engine://<server>" publishes through the
+# Cirrus Link MQTT Engine, "tcp://host:port" connects with paho-mqtt (MQTT v5),
+# "loopback://<name>" uses the in-process MQTTLoopback broker for tests.
+# Topics starting with one of binary_topic_prefixes get the compact
+# MetricPayload encoding instead of JSON; metric_aliases maps metric names to
+# the integer aliases agreed with subscribers.
+def mqtt_options():
+    return {
+        "url": "engine://myEngine",
+        "client_id": "ignition-mes",
+        "qos": 1,
+        "window": 32,  # QoS 1 messages awaiting PUBACK
+        "ack_timeout_seconds": 10,
+        "keepalive_seconds": 30,
+        "connect_timeout_seconds": 10,
+        "reconnect_attempts": 5,
+        "reconnect_backoff_seconds": 0.5,
+        "session_expiry_seconds": 3600,  # broker keeps the session this long after a drop
+        "block_timeout": 5.0,
+        "binary_topic_prefixes": ("plant/",),
+        "metric_aliases": {},
+    }
+
+# Wire encoding of envelopes sent through Kafka and MQTT (EnvelopeCodec):
+# 'JSON', 'PACK' (MessagePack) or 'SCHEMA' (field order per noun, no names).
+def envelope_codec():
+    return "JSON"
+
+# Topic of each domain event (EventMapping); {noun} and {verb} are available.
+# One topic per noun keeps an entity's Add/Change/Delete in order (one Kafka
+# partition per key, one relay stream); the verb travels in the envelope.
+# Kafka topic names cannot contain '/', so KafkaAdapter sends them with '.'.
+def event_topic_template():
+    return "mes/{noun}"
+
+# Inbound envelopes (MessageHandler / InboundDispatcher). Messages with the same
+# key_fields value are applied in order on one of the workers; correlationIds
+# of the last dedupe_window messages are remembered to skip redeliveries.
+# Envelopes from ignore_sources are our own events echoed by the broker.
+# user_id is the user inbound changes are written as.
+def inbound_options():
+    return {
+        "workers": 4,
+        "max_queue": 10000,
+        "block_timeout": 0.5,
+        "max_attempts": 3,
+        "retry_backoff_seconds": 0.2,
+        "dedupe_window": 50000,
+        "dead_letter_size": 1000,
+        "key_fields": ("MaterialID", "ID", "material_id"),
+        "ignore_sources": ("MES_Project",),
+        "user_id": "ERP",
+    }
+
+# Change notifications pushed to Perspective sessions (ChangeFeed). A session
+# gets at most one push per max_rate_ms; changes in between are merged.
+# Subscriptions expire after lease_seconds unless the view renews them; a
+# delta touching more than max_ids rows is sent as a reset instead.
+def change_feed_options():
+    return {
+        "max_rate_ms": 1000,
+        "lease_seconds": 300,
+        "max_ids": 500,
+        "message_type": "mes-change",
+    }
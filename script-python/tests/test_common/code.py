@@ -1,5 +1,8 @@
 import os
 import sys
+import tempfile
+import threading
+import time
 import unittest
 from types import ModuleType
 
@@ -104,6 +107,7 @@ _install_system_modules()
 # Imports of project modules under test.
 # ---------------------------------------------------------------------------
 from common.cache import CacheManager as CacheManager
+from common.concurrency import Executor as executor_module
 from common.decorators import CacheDecorator as cache_decorator_module
 from common.decorators import ExceptionHandlerDecorator as exception_decorator_module
 from common.decorators import TraceDecorator as trace_decorator_module
@@ -114,7 +118,36 @@ from common.logging import LogFactory as log_factory_module
 from common.logging import LogFormatter as log_formatter_module
 from common.context import SessionContext as session_context_module
 from common.exceptions import MESException as mes_exception_module
+from common.exceptions import MessagingException as messaging_exception_module
 from common.exceptions import SecurityException as security_exception_module
+from common.utils import MultiIndex as multi_index_module
+from common.utils import RuleEngine as rule_engine_module
+from common.utils import StreamingExport as streaming_export_module
+from common.utils import ValidationSession as validation_session_module
+from core.material.application.CatalogProjection import code as catalog_projection
+from core.material.application.Queries import code as material_queries
+from core.material.application.QueryHandlers import code as material_query_handlers
+from core.material.domain.Entities import code as material_entities
+from core.material.domain.Events import code as material_events
+from core.material.infrastructure.RepositoryAdapter import code as material_repository_module
+from core.plant.application.CommandHandlers import code as plant_command_handlers
+from core.plant.application.Commands import code as plant_commands
+from core.plant.domain.DomainServices import code as plant_domain_services
+from core.plant.domain.Entities import code as plant_entities
+from infrastructure.ConfigService import code as config_service_module
+from adapters.messaging.AsyncPublisher import code as async_publisher_module
+from adapters.messaging.ChangeFeed import code as change_feed_module
+from adapters.messaging import EnvelopeCodec as envelope_codec_module
+from adapters.messaging import EventMapping as event_mapping_module
+from adapters.messaging import FakeKafkaBroker as fake_kafka_broker_module
+from adapters.messaging import InboundDispatcher as inbound_dispatcher_module
+from adapters.messaging import KafkaAdapter as kafka_adapter_module
+from adapters.messaging import MQTTAdapter as mqtt_adapter_module
+from adapters.messaging import MQTTLoopback as mqtt_loopback_module
+from adapters.messaging.Outbox import code as outbox_module
+from adapters.persistence.PersistenceGateway import code as persistence_gateway_module
+from adapters.persistence.QueryBatch import code as query_batch_module
+from adapters.persistence.UnitOfWork import code as unit_of_work_module
 
 
 class _TestLogger(object):
@@ -309,6 +342,160 @@ class TransactionDecoratorTests(unittest.TestCase):
         self.assertEqual(operation(_tx="existing-tx"), "ok")
         self.assertEqual(_DB_CALLS, [])
 
+    def test_nested_transaction_joins_outer(self):
+        @transaction_decorator_module.transactional("MES_DB")
+        def inner(_tx=None):
+            return _tx
+
+        @transaction_decorator_module.transactional("MES_DB")
+        def outer(_tx=None):
+            return inner()
+
+        self.assertEqual(outer(), "tx-MES_DB")
+        self.assertEqual(
+            _DB_CALLS,
+            [("begin", "MES_DB"), ("commit", "tx-MES_DB"), ("close", "tx-MES_DB")]
+        )
+
+
+class MultiIndexTests(unittest.TestCase):
+    def test_secondary_indexes_follow_upserts_and_removals(self):
+        index = multi_index_module.MultiIndex(
+            [{"ID": 1, "Code": "A"}, {"ID": 2, "Code": "A"}], key="ID", indexes=["Code"]
+        )
+        index.add({"ID": 2, "Code": "B"})
+        self.assertEqual([item["ID"] for item in index.find("Code", "A")], [1])
+        self.assertEqual([item["ID"] for item in index.find("Code", "B")], [2])
+        index.remove(1)
+        self.assertEqual(index.find("Code", "A"), [])
+        self.assertEqual(len(index), 1)
+
+
+class PlantHierarchyIndexTests(unittest.TestCase):
+    def _index(self, rows):
+        return plant_domain_services.PlantHierarchyIndex(
+            [{"ID": node_id, "EquipmentParentID": parent_id, "EquipmentType": kind} for node_id, parent_id, kind in rows]
+        )
+
+    def setUp(self):
+        self.index = self._index([
+            (1, None, "Site"),
+            (2, 1, "WorkCenter"),
+            (3, 2, "WorkStation"),
+            (4, 3, "Machine"),
+            (5, 1, "WorkCenter"),
+            (6, 99, "Machine"),  # parent missing from the snapshot
+        ])
+
+    def _ids(self, items):
+        return [item["ID"] for item in items]
+
+    def test_descendants_are_the_pre_order_subtree(self):
+        self.assertEqual(self._ids(self.index.descendants(1)), [2, 3, 4, 5])
+        self.assertEqual(self._ids(self.index.descendants(2)), [3, 4])
+        self.assertEqual(self.index.descendants(4), [])
+        self.assertEqual(self.index.descendants(42), [])
+
+    def test_is_under_inclusive_and_exclusive(self):
+        self.assertTrue(self.index.is_under(4, 2))
+        self.assertFalse(self.index.is_under(5, 2))
+        self.assertFalse(self.index.is_under(2, 2))
+        self.assertTrue(self.index.is_under(2, 2, inclusive=True))
+        self.assertFalse(self.index.is_under(2, 4))
+
+    def test_orphan_is_promoted_to_root(self):
+        self.assertEqual(self._ids(self.index.roots()), [1, 6])
+        self.assertIsNone(self.index.parent(6))
+        self.assertEqual(self.index.depth(6), 0)
+
+    def test_ancestor_of_type(self):
+        self.assertEqual(self.index.ancestor_of_type(4, "workcenter")["ID"], 2)
+        self.assertEqual(self.index.ancestor_of_type(4, "Site")["ID"], 1)
+        self.assertIsNone(self.index.ancestor_of_type(4, "Machine"))
+        self.assertIsNone(self.index.ancestor_of_type(1, "Site"))
+
+    def test_parent_cycle_is_cut_and_every_node_indexed(self):
+        index = self._index([(1, 3, None), (2, 1, None), (3, 2, None), (4, None, None)])
+        self.assertEqual(len(index.roots()), 2)
+        cut = index.roots()[1]["ID"]
+        self.assertEqual(len(index.descendants(cut)), 2)
+        self.assertEqual(sorted(self._ids(index.path_to_root(cut) + index.descendants(cut))), [1, 2, 3])
+
+    def test_cursor_of_a_vanished_parent_gives_an_empty_page(self):
+        items, cursor = self.index.children_page(1, limit=1)
+        self.assertEqual((self._ids(items), cursor), ([2], "1|2|1"))
+        newer = self._index([(5, None, "WorkCenter")])
+        parent_id = newer.cursor_parent(cursor)
+        self.assertEqual(plant_domain_services.page_key(parent_id), "1")
+        self.assertEqual(newer.children_page(parent_id, cursor, 1), ([], None))
+        self.assertEqual(plant_domain_services.page_key(None), "root")
+
+    def test_deep_chain_beyond_the_recursion_limit(self):
+        depth = sys.getrecursionlimit() + 500
+        index = self._index([(i, i - 1 if i else None, None) for i in range(depth)])
+        self.assertEqual(index.depth(depth - 1), depth - 1)
+        self.assertEqual(len(index.descendants(0)), depth - 1)
+        self.assertTrue(index.is_under(depth - 1, 0))
+        self.assertEqual(len(index.ancestors(depth - 1)), depth - 1)
+
+
+class ValidationSessionTests(unittest.TestCase):
+    def test_only_changed_rows_and_their_duplicates_are_revalidated(self):
+        def validate_row(row, duplicates):
+            return {"Name": row["Name"], "Flag": 1 if row["Name"] in duplicates else 0}
+
+        session = validation_session_module.ValidationSession(validate_row, lambda row: row.get("Name"))
+        rows = [{"Name": "a", "Qty": "1"}, {"Name": "b", "Qty": "1"}, {"Name": "c", "Qty": "2"}]
+        session.validate(rows)
+        self.assertEqual(session.revalidated, 3)
+
+        edited = [dict(row) for row in rows]
+        edited[2]["Name"] = "b"
+        result = session.validate(edited)
+        self.assertEqual([row["Flag"] for row in result], [0, 1, 1])
+        self.assertEqual(session.revalidated, 2)
+
+
+class RuleEngineTests(unittest.TestCase):
+    def test_compiled_rules_report_in_declaration_order(self):
+        import re
+
+        rules = rule_engine_module
+        validate = rules.RuleSet([
+            rules.allowed_characters(["Name"], re.compile("[@#]"), "bad characters"),
+            rules.required("Name", "name required"),
+            rules.positive_number("Qty", "qty must be positive"),
+            rules.member_of("Route", set(["R1"]), "unknown route", optional=True),
+            rules.unique("Name", "duplicate name"),
+            rules.action_code(when=rules.field_in("Kind", ["upload"])),
+        ]).compile()
+
+        self.assertEqual(validate({"Name": "a", "Qty": "2", "Action": "X"}), [])
+        self.assertEqual(
+            validate({"Name": "a@", "Qty": "0", "Route": "R9", "Kind": "upload"}, {"duplicates": {"a@": 2}}),
+            ["bad characters", "qty must be positive", "unknown route", "duplicate name",
+             rules.INVALID_ACTION_MESSAGE],
+        )
+        self.assertEqual(validate({"Qty": 1.5, "Route": ""}), ["name required"])
+
+
+class StreamingExportTests(unittest.TestCase):
+    def test_write_streams_csv_and_ndjson_from_a_generator(self):
+        import gzip
+        import io
+        import json
+
+        rows = (["m%d" % i, i] for i in range(5))
+        stream = io.BytesIO()
+        summary = streaming_export_module.write(stream, ["Name", "Qty"], rows, compress=True, flush_rows=2)
+        text = gzip.GzipFile(fileobj=io.BytesIO(stream.getvalue())).read().decode("utf-8")
+        self.assertEqual(summary["Rows"], 5)
+        self.assertEqual(text.splitlines()[:2], ["Name,Qty", "m0,0"])
+
+        stream = io.BytesIO()
+        streaming_export_module.write(stream, ["Name", "Qty"], [["a", 1]], fmt=streaming_export_module.NDJSON)
+        self.assertEqual(json.loads(stream.getvalue().decode("utf-8")), {"Name": "a", "Qty": 1})
+
 
 class AccessControlTests(unittest.TestCase):
     def setUp(self):
@@ -349,6 +536,636 @@ class LogFormatterTests(unittest.TestCase):
         self.assertEqual(formatted, "MSG | a=1 | b=2")
 
 
+class ExecutorTests(unittest.TestCase):
+    def setUp(self):
+        self.pool = executor_module.BoundedExecutor(max_workers=2, name="test-pool")
+
+    def tearDown(self):
+        self.pool.shutdown(wait=True)
+        session_context_module.unbind()
+
+    def test_gather_propagates_bound_context(self):
+        session_context_module.bind({"correlationId": "CID-GATHER"})
+        results = executor_module.gather(
+            {
+                "a": lambda: session_context_module.current()["correlationId"],
+                "b": lambda: session_context_module.current()["correlationId"],
+            },
+            timeout=5,
+            pool=self.pool,
+        )
+        self.assertEqual(results, {"a": "CID-GATHER", "b": "CID-GATHER"})
+
+    def test_cancel_only_affects_pending_tasks(self):
+        import threading
+
+        release = threading.Event()
+        started = []
+
+        def block():
+            started.append(1)
+            return release.wait(5)
+
+        blockers = [self.pool.submit(block) for _ in range(2)]
+        while len(started) < 2:
+            release.wait(0.01)
+        pending = self.pool.submit(lambda: "never")
+        self.assertTrue(pending.cancel())
+        self.assertFalse(blockers[0].cancel())
+        release.set()
+        with self.assertRaises(executor_module.ExecutorCancelled):
+            pending.result(1)
+        self.assertTrue(blockers[0].result(1))
+
+
+class _ShortWait(object):
+    @staticmethod
+    def get(name):
+        return 0.05
+
+
+class PersistenceGatewayTests(unittest.TestCase):
+    def setUp(self):
+        self._config = persistence_gateway_module.config
+        persistence_gateway_module.config = _ShortWait
+        persistence_gateway_module.set_limit("test-busy", 1)
+        persistence_gateway_module._functions["runPrepQuery"] = lambda *args: []
+
+    def tearDown(self):
+        persistence_gateway_module.config = self._config
+        persistence_gateway_module.set_limit("test-busy", None)
+        persistence_gateway_module._functions.pop("runPrepQuery", None)
+
+    def test_busy_datasource_is_raised_instead_of_read_as_empty(self):
+        limiter = persistence_gateway_module._limiter("test-busy")
+        self.assertTrue(limiter.acquire(0))
+        try:
+            with self.assertRaises(mes_exception_module.MESException) as raised:
+                material_repository_module._run_query("EXEC usp_S_GetMaterial", [], "test-busy")
+        finally:
+            limiter.release()
+        self.assertTrue(persistence_gateway_module.is_busy(raised.exception))
+        self.assertEqual(material_repository_module._run_query("EXEC usp_S_GetMaterial", [], "test-busy"), [])
+
+
+class QueryBatchTests(unittest.TestCase):
+    def setUp(self):
+        self.threads = {}
+        self.calls = [query_batch_module.BatchCall("fast", "usp_S_Fast"),
+                      query_batch_module.BatchCall("slow", "usp_S_Slow", [("ID", 1)])]
+
+    def _runner(self, statement, values, datasource):
+        key = "slow" if "Slow" in statement else "fast"
+        self.threads[key] = threading.current_thread()
+        time.sleep(0.5 if key == "slow" else 0.2)
+        return key
+
+    def test_calls_inside_a_unit_of_work_use_the_caller_thread(self):
+        with unit_of_work_module.UnitOfWork():
+            result = query_batch_module.run(self.calls, self._runner, "ds")
+        self.assertEqual(result, {"fast": "fast", "slow": "slow"})
+        self.assertEqual(set(self.threads.values()), set([threading.current_thread()]))
+
+    def test_timeout_is_one_deadline_for_the_batch(self):
+        started = time.time()
+        with self.assertRaises(executor_module.ExecutorTimeout):
+            query_batch_module.run(self.calls, self._runner, "ds", timeout=0.35)
+        self.assertLess(time.time() - started, 0.45)
+
+
+class AsyncPublisherTests(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.sent = []
+
+    def _send(self, topic, payloads):
+        self.release.wait(5)
+        self.sent.extend((topic, payload) for payload in payloads)
+        return True
+
+    def _wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_flush_sends_every_accepted_message_in_topic_order(self):
+        self.release.set()
+        publisher = async_publisher_module.AsyncPublisher(
+            self._send, name="test-flush", batch_size=3, linger_ms=1000, senders=2
+        )
+        for i in range(7):
+            publisher.publish("a", i)
+            publisher.publish("b", i)
+        self.assertTrue(publisher.flush(5))
+        self.assertEqual([p for t, p in self.sent if t == "a"], list(range(7)))
+        self.assertEqual([p for t, p in self.sent if t == "b"], list(range(7)))
+        self.assertTrue(publisher.shutdown(5))
+        self.assertTrue(publisher.publish("a", "late"))
+        self.assertEqual(self.sent[-1], ("a", "late"))
+
+    def test_drop_oldest_never_evicts_a_pending_flush(self):
+        publisher = async_publisher_module.AsyncPublisher(
+            self._send, name="test-drop-oldest", max_queue=2, batch_size=1, linger_ms=0, senders=1,
+            policy=async_publisher_module.DROP_OLDEST,
+        )
+        for i in range(3):  # one sending, one waiting in the sender pool, one held by the dispatcher
+            publisher.publish("t", i)
+            self._wait_for(lambda: publisher.stats()["queued"] == 0)
+        flushed = []
+        flusher = threading.Thread(target=lambda: flushed.append(publisher.flush(5)))
+        flusher.start()
+        self._wait_for(lambda: publisher.stats()["queued"] == 1)
+        for i in range(3, 7):
+            self.assertTrue(publisher.publish("t", i))
+        self.release.set()
+        flusher.join(5)
+        self.assertEqual(flushed, [True])
+        self.assertEqual([p for _, p in self.sent], [0, 1, 2, 5, 6])
+        self.assertEqual(publisher.stats()["dropped"], 2)
+        self.assertTrue(publisher.shutdown(5))
+
+
+def _envelope(noun, **data):
+    return {"correlationId": "CID-1", "timestamp": 1700000000.5, "verb": "SyncChange", "noun": noun,
+            "source": "MES", "target": None, "version": 1, "data": data}
+
+
+class EnvelopeCodecTests(unittest.TestCase):
+    def setUp(self):
+        self.envelopes = [
+            _envelope("Equipment", EquipmentID=7, Name=u"Pr\u00e9ss", Active=True, Rate=-1.25, Tags=["a", "b"]),
+            _envelope("Equipment", EquipmentID=2 ** 40, Name="Lathe", Active=False, Rate=0.0, Tags=[]),
+            _envelope("MaterialDefinition", MaterialID=-3, Note=None),
+        ]
+
+    def test_every_codec_round_trips_single_messages_and_batches(self):
+        for name in (envelope_codec_module.JSON, envelope_codec_module.PACK, envelope_codec_module.SCHEMA):
+            codec = envelope_codec_module.get(name)
+            for envelope in self.envelopes:
+                self.assertEqual(envelope_codec_module.decode(codec.encode(envelope)), envelope)
+            self.assertEqual(envelope_codec_module.decode_batch(codec.encode_batch(self.envelopes)), self.envelopes)
+
+    def test_schema_batches_decode_without_prior_registration(self):
+        frame = envelope_codec_module.SchemaCodec().encode_batch(self.envelopes)
+        self.assertEqual(envelope_codec_module.SchemaCodec().decode_batch(frame), self.envelopes)
+
+    def test_schema_id_collision_gets_the_next_free_id(self):
+        envelope = self.envelopes[2]
+        crc_id = envelope_codec_module.Schema("MaterialDefinition", tuple(envelope), ("MaterialID", "Note")).id
+        producer = envelope_codec_module.SchemaCodec()
+        producer.load_schemas([[crc_id, "Other", ["noun", "data"], None]])
+
+        self.assertEqual(producer.schema_for(envelope).id, (crc_id + 1) & 0xffffffff)
+        self.assertEqual(producer.decode(producer.encode(envelope)), envelope)
+        consumer = envelope_codec_module.SchemaCodec()
+        consumer.load_schemas(producer.schemas())
+        self.assertEqual(consumer.decode(producer.encode(envelope)), envelope)
+        with self.assertRaises(ValueError):
+            consumer.load_schemas([[crc_id, "Another", ["noun"], None]])
+
+    def test_schema_registry_is_capped(self):
+        codec = envelope_codec_module.SchemaCodec(max_schemas=2)
+        for envelope in self.envelopes:
+            codec.encode(envelope)
+        self.assertEqual(len(codec.schemas()), 2)
+        self.assertEqual(codec.decode(codec.encode(self.envelopes[0])), self.envelopes[0])
+        self.assertEqual(len(codec.schemas()), 2)
+
+
+class _MaterialCreated(object):
+    def __init__(self, material_id, name):
+        self.material_id = material_id
+        self.name = name
+
+
+class _MaterialDeleted(object):
+    def __init__(self, material_id):
+        self.material_id = material_id
+
+
+class EventMappingTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = event_mapping_module.Registry()
+        self.registry.register(_MaterialCreated, "MaterialDefinition", "SyncAdd",
+                               [("MaterialID", "material_id"), ("Name", "name")])
+        self.registry.register(_MaterialDeleted, "MaterialDefinition", "SyncDelete", [("MaterialID", "material_id")])
+
+    def test_all_verbs_of_a_noun_share_one_topic(self):
+        created_topic, created = self.registry.map(_MaterialCreated(7, "Bolt"))
+        deleted_topic, deleted = self.registry.map(_MaterialDeleted(7))
+        self.assertEqual(created_topic, "mes/MaterialDefinition")
+        self.assertEqual(deleted_topic, created_topic)
+        self.assertEqual((created["verb"], created["data"]), ("SyncAdd", {"MaterialID": 7, "Name": "Bolt"}))
+        self.assertEqual((deleted["verb"], deleted["data"]), ("SyncDelete", {"MaterialID": 7}))
+
+    def test_unmapped_event_is_sent_with_its_attributes(self):
+        registry = event_mapping_module.Registry(topic_template="mes/{noun}/{verb}")
+        topic, envelope = registry.map(_MaterialDeleted(3))
+        self.assertEqual(topic, "mes/_MaterialDeleted/Notify")
+        self.assertEqual(envelope["data"], {"material_id": 3})
+
+
+class InboundDispatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.applied = []
+        self.lock = threading.Lock()
+        self.dispatcher = inbound_dispatcher_module.Dispatcher(
+            "test-inbound", workers=4, retry_backoff_seconds=0, key_fields=("EquipmentID",)
+        )
+
+    def tearDown(self):
+        self.dispatcher.shutdown(5)
+
+    def _apply(self, envelope):
+        if envelope["data"]["n"] % 7 == 0:
+            time.sleep(0.002)  # a slow message must not let later ones of its key overtake it
+        with self.lock:
+            self.applied.append((envelope["data"]["EquipmentID"], envelope["data"]["n"]))
+
+    def test_messages_of_one_key_are_applied_in_arrival_order(self):
+        self.dispatcher.route(self._apply, noun="Equipment")
+        for n in range(200):
+            envelope = _envelope("Equipment", EquipmentID="EQ-%d" % (n % 6), n=n)
+            envelope["correlationId"] = "CID-%d" % n
+            self.assertTrue(self.dispatcher.submit(envelope, "mes/Equipment"))
+        self.assertTrue(self.dispatcher.drain(5))
+        self.assertEqual(len(self.applied), 200)
+        for key in set(key for key, _ in self.applied):
+            numbers = [n for k, n in self.applied if k == key]
+            self.assertEqual(numbers, sorted(numbers))
+
+    def test_duplicates_are_skipped_and_failures_dead_lettered_then_replayed(self):
+        failures = [3]
+
+        def flaky(envelope):
+            if failures[0]:
+                failures[0] -= 1
+                raise ValueError("not yet")
+            self._apply(envelope)
+
+        self.dispatcher.route(flaky, noun="Equipment", verb="SyncChange")
+        envelope = _envelope("Equipment", EquipmentID="EQ-1", n=1)
+        self.assertTrue(self.dispatcher.submit(envelope))
+        self.assertFalse(self.dispatcher.submit(dict(envelope)))
+        self.assertTrue(self.dispatcher.drain(5))
+        letters = self.dispatcher.dead_letters()
+        self.assertEqual([(l["reason"], l["attempts"]) for l in letters], [("HANDLER_ERROR", 3)])
+
+        self.assertEqual(self.dispatcher.replay_dead_letters(), 1)
+        self.assertTrue(self.dispatcher.drain(5))
+        self.assertEqual(self.applied, [("EQ-1", 1)])
+        stats = self.dispatcher.stats()
+        self.assertEqual((stats["duplicates"], stats["retried"], stats["processed"]), (1, 2, 1))
+
+
+class KafkaAdapterTests(unittest.TestCase):
+    def setUp(self):
+        self.broker = fake_kafka_broker_module.get("keyed-order", partitions=4)
+        self.broker.reset()
+        self._kafka_options = kafka_adapter_module.cfg.kafka_options
+        options = dict(self._kafka_options(), bootstrap_servers="fake://keyed-order", batch_records=7)
+        kafka_adapter_module.cfg.kafka_options = lambda: options
+        kafka_adapter_module.close()
+
+    def tearDown(self):
+        kafka_adapter_module.close()
+        kafka_adapter_module.cfg.kafka_options = self._kafka_options
+
+    def test_events_of_one_key_stay_in_order_on_one_partition(self):
+        payloads = [{"data": {"EquipmentID": "EQ-%d" % (n % 5), "n": n}} for n in range(60)]
+        self.assertTrue(kafka_adapter_module.publish_batch("mes/Equipment", payloads, timeout=5))
+
+        seen = {}
+        for record in self.broker.fetch("mes.Equipment"):
+            data = record.json()["data"]
+            partition, numbers = seen.setdefault(record.key, (record.partition, []))
+            self.assertEqual(record.partition, partition)
+            numbers.append(data["n"])
+        self.assertEqual(sorted(seen), ["EQ-%d" % i for i in range(5)])
+        for key, (_, numbers) in seen.items():
+            self.assertEqual(numbers, [n for n in range(60) if "EQ-%d" % (n % 5) == key])
+
+    def test_publish_batch_raises_when_the_broker_rejects_a_batch(self):
+        self.broker.fail_next(1)
+        with self.assertRaises(messaging_exception_module.MessagingException) as ctx:
+            kafka_adapter_module.publish_batch("mes/Equipment", [{"EquipmentID": "EQ-1"}], timeout=5)
+        self.assertEqual(ctx.exception.code, "KAFKA_ERROR")
+
+
+class MQTTPublisherTests(unittest.TestCase):
+    def setUp(self):
+        self.broker = mqtt_loopback_module.LoopbackBroker(topic_alias_maximum=4)
+        self.publisher = mqtt_adapter_module.Publisher(
+            lambda on_ack, on_lost: self.broker.connection("test-client", on_ack, on_lost),
+            window=8, reconnect_backoff=0,
+        )
+
+    def test_drop_resumes_the_session_and_resends_the_window_in_order(self):
+        self.broker.hold_acks()
+        for n in range(3):
+            self.publisher.publish("plant/line1", b"m%d" % n)
+        self.broker.drop("test-client")  # held PUBACKs are lost with the connection
+        self.broker.release_acks()
+        self.publisher.publish("plant/line1", b"m3")
+
+        messages = self.broker.messages("plant/line1")
+        self.assertEqual([m.payload for m in messages], [b"m0", b"m1", b"m2", b"m0", b"m1", b"m2", b"m3"])
+        self.assertEqual([m.dup for m in messages], [False, False, False, True, True, True, False])
+        self.assertTrue(self.publisher.flush(1))
+        stats = self.publisher.stats()
+        self.assertEqual((stats["connects"], stats["resumed"], stats["resent"]), (2, 1, 3))
+        self.assertEqual(self.broker.stats()["duplicates"], 3)
+
+    def test_topic_aliases_replace_repeated_topic_names(self):
+        for n in range(3):
+            self.publisher.publish("plant/line1", b"m%d" % n)
+        self.assertEqual(len(self.broker.messages("plant/line1")), 3)
+        self.assertEqual(self.broker.stats()["aliased"], 2)
+
+
+class OutboxTests(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "outbox.log")
+        self.store = outbox_module.LogOutboxStore(self.path)
+        self.sent = []
+        self.failing = set()
+        relay = outbox_module.OutboxRelay(self.store, self._publish_batch, batch_size=2)
+        self.outbox = outbox_module.Outbox(self.store, relay, relay_on_commit=False)
+
+    def _publish_batch(self, topic, payloads):
+        if topic in self.failing:
+            return False
+        self.sent.extend((topic, payload["n"]) for payload in payloads)
+        return True
+
+    def test_relay_publishes_in_append_order_and_marks_published(self):
+        for n in range(3):
+            self.outbox.append("mes/A", "A.Changed", {"n": n})
+        self.outbox.append("mes/B", "B.Changed", {"n": 9})
+        self.assertEqual(self.outbox.relay.drain(), 4)
+        self.assertEqual(self.sent, [("mes/A", 0), ("mes/A", 1), ("mes/A", 2), ("mes/B", 9)])
+        self.assertEqual(self.store.stats()["pending"], 0)
+        self.assertEqual(self.outbox.relay.drain(), 0)
+
+    def test_failed_topic_stays_pending_across_a_restart(self):
+        self.failing.add("mes/A")
+        self.outbox.append("mes/A", "A.Changed", {"n": 1}, dedupe_key="a1")
+        self.outbox.append("mes/B", "B.Changed", {"n": 2}, dedupe_key="b2")
+        self.outbox.relay.drain()
+        self.assertEqual(self.sent, [("mes/B", 2)])
+
+        reopened = outbox_module.LogOutboxStore(self.path)
+        self.assertEqual([m["dedupeKey"] for m in reopened.pending(10)], ["a1"])
+        self.failing.clear()
+        outbox_module.OutboxRelay(reopened, self._publish_batch).drain()
+        self.assertEqual(self.sent, [("mes/B", 2), ("mes/A", 1)])
+
+    def test_append_inside_a_unit_of_work_waits_for_the_commit(self):
+        with unit_of_work_module.UnitOfWork():
+            self.outbox.append("mes/A", "A.Changed", {"n": 1})
+            self.assertEqual(self.store.stats()["pending"], 0)
+        self.assertEqual(self.store.stats()["pending"], 1)
+
+        with self.assertRaises(ValueError):
+            with unit_of_work_module.UnitOfWork():
+                self.outbox.append("mes/A", "A.Changed", {"n": 2})
+                raise ValueError("write failed")
+        self.assertEqual([m["data"]["n"] for m in self.store.pending(10)], [1])
+
+
+class ConfigServiceTests(unittest.TestCase):
+    TAG = "[default]Test/ConfigService/Mode"
+
+    def setUp(self):
+        self.values = ["fast"]
+        self.loads = []
+
+    def tearDown(self):
+        config_service_module._settings.pop("test.mode", None)
+        config_service_module._by_tag.pop("test/configservice/mode", None)
+
+    def _loader(self):
+        self.loads.append(1)
+        value = self.values[0]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def _register(self, **options):
+        config_service_module.register("test.mode", self._loader, normalize=lambda value: str(value).upper(),
+                                       **options)
+
+    def test_value_is_loaded_once_and_hot_reloaded_from_its_tag(self):
+        self._register(tag=self.TAG)
+        self.assertEqual(config_service_module.get("test.mode"), "FAST")
+        self.assertEqual(config_service_module.get("test.mode"), "FAST")
+        self.assertEqual(len(self.loads), 1)
+
+        self.assertTrue(config_service_module.on_tag_change("[other]test/configservice/mode", "slow"))
+        self.assertEqual(config_service_module.get("test.mode"), "SLOW")
+        self.values[0] = "steady"
+        self.assertTrue(config_service_module.on_tag_change(self.TAG))
+        self.assertEqual(config_service_module.get("test.mode"), "STEADY")
+        self.assertIn(self.TAG, config_service_module.tags())
+
+    def test_failed_load_keeps_the_last_good_value(self):
+        self.values[0] = ValueError("tag unreadable")
+        self._register(default="SAFE")
+        self.assertEqual(config_service_module.get("test.mode"), "SAFE")
+        self.values[0] = "fast"
+        self.assertEqual(config_service_module.reload("test.mode"), {"test.mode": "FAST"})
+        self.values[0] = ValueError("tag unreadable")
+        self.assertEqual(config_service_module.reload("test.mode"), {"test.mode": "FAST"})
+
+    def test_expired_value_is_served_while_it_reloads_in_the_background(self):
+        self._register(max_age=0.01)
+        self.assertEqual(config_service_module.get("test.mode"), "FAST")
+        self.values[0] = "slow"
+        time.sleep(0.02)
+        self.assertEqual(config_service_module.get("test.mode"), "FAST")
+        deadline = time.time() + 5
+        while config_service_module.get("test.mode") != "SLOW" and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(config_service_module.get("test.mode"), "SLOW")
+
+
+class _DictCachePort(object):
+    def __init__(self, local=True):
+        self.entries = {}
+        self.local = local
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, value, ttl_seconds=60):
+        self.entries[key] = value
+
+    def invalidate(self, key=None):
+        self.entries.pop(key, None)
+
+    def is_local(self):
+        return self.local
+
+
+class _MaterialRepository(object):
+    def __init__(self, materials):
+        self.materials = materials
+        self.fetches = 0
+
+    def datasource_for(self, user_id):
+        return "ds1"
+
+    def fetch_materials(self, user_id):
+        self.fetches += 1
+        return list(self.materials)
+
+
+class CatalogProjectionTests(unittest.TestCase):
+    SNAPSHOT = "materials:u1"
+
+    def setUp(self):
+        self.port = _DictCachePort()
+        self.port.put(self.SNAPSHOT, [self._material(1, "Bolt"), self._material(2, "Nut")])
+        self.port.put("materials-search:u1", "index")
+        catalog_projection.take_patched_users()
+
+    def _material(self, material_id, name):
+        return material_entities.Material.from_record({"ID": material_id, "Name": name})
+
+    def _names(self):
+        return [m.name for m in self.port.get(self.SNAPSHOT)]
+
+    def test_committed_update_patches_the_snapshot_after_the_commit(self):
+        with unit_of_work_module.UnitOfWork() as uow:
+            cache_port = uow.cache(self.port)
+            catalog_projection.apply(cache_port, "u1", material_events.MaterialUpdated(
+                2, "Washer", self._material(2, "Washer")))
+            catalog_projection.apply(cache_port, "u1", material_events.MaterialDeleted(1, "tester"))
+            self.assertEqual(self._names(), ["Bolt", "Nut"])
+        self.assertEqual(self._names(), ["Washer"])
+        self.assertIsNone(self.port.get("materials-search:u1"))
+        self.assertEqual(catalog_projection.take_patched_users(), ["u1"])
+
+    def test_rollback_leaves_the_snapshot_untouched(self):
+        with self.assertRaises(ValueError):
+            with unit_of_work_module.UnitOfWork() as uow:
+                catalog_projection.apply(uow.cache(self.port), "u1", material_events.MaterialCreated(
+                    3, "Pin", self._material(3, "Pin")))
+                raise ValueError("write failed")
+        self.assertEqual(self._names(), ["Bolt", "Nut"])
+        self.assertEqual(catalog_projection.take_patched_users(), [])
+
+    def test_shared_cache_drops_the_snapshot_instead_of_patching_it(self):
+        self.port.local = False
+        catalog_projection.apply(self.port, "u1", material_events.MaterialCreated(3, "Pin", self._material(3, "Pin")))
+        self.assertIsNone(self.port.get(self.SNAPSHOT))
+        self.assertEqual(catalog_projection.take_patched_users(), [])
+
+
+    def test_other_users_refetch_rows_from_the_patched_datasource_snapshot(self):
+        repository = _MaterialRepository([self._material(1, "Bolt"), self._material(2, "Nut")])
+        self.assertEqual(len(material_query_handlers.handle_get_all_materials(
+            material_queries.GetAllMaterialsQuery("u1"), repository, self.port)), 2)
+        catalog_projection.apply(self.port, "u1", material_events.MaterialUpdated(
+            2, "Washer", self._material(2, "Washer")), catalog_projection.feed_key(repository, "u1"))
+        rows = material_query_handlers.handle_get_materials_by_id(
+            material_queries.GetMaterialsByIdQuery("u2", [2]), repository, self.port)
+        self.assertEqual([m.name for m in rows], ["Washer"])
+        self.assertEqual(repository.fetches, 1)
+
+
+class ChangeFeedTests(unittest.TestCase):
+    def setUp(self):
+        self.pushed = []
+        self.feed = change_feed_module.ChangeFeed(sender=self._send, max_rate_ms=300, lease_seconds=1, max_ids=3)
+
+    def tearDown(self):
+        self.feed.shutdown(5)
+
+    def _send(self, message_type, payload, session_id, page_id):
+        self.pushed.append((session_id, page_id, payload))
+
+    def _wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_deltas_are_merged_until_the_page_may_be_pushed_again(self):
+        self.feed.subscribe("s1", "catalog", ["ds"])
+        self.feed.publish("catalog", "ds", changed=[1])
+        self._wait_for(lambda: len(self.pushed) == 1)
+        self.feed.publish("catalog", "ds", added=[5])
+        self.feed.publish("catalog", "ds", removed=[5, 6])
+        self.feed.publish("catalog", "ds", added=[6], changed=[7])
+        self._wait_for(lambda: len(self.pushed) == 2)
+        payload = self.pushed[1][2]
+        self.assertEqual((payload["added"], sorted(payload["changed"]), payload["removed"]), ([], [6, 7], []))
+        self.assertFalse(payload["reset"])
+        self.assertEqual(payload["sequence"], 2)
+        self.feed.publish("catalog", "ds", added=[1, 2, 3, 4])
+        self._wait_for(lambda: len(self.pushed) == 3)
+        self.assertTrue(self.pushed[2][2]["reset"])
+
+    def test_pages_of_one_session_are_subscribed_separately(self):
+        self.feed.subscribe("s1", "catalog", ["ds"], page_id="p1")
+        self.feed.subscribe("s1", "catalog", ["ds"], page_id="p2")
+        self.assertEqual(sorted(self.feed.subscriptions("s1")), [("s1", "p1"), ("s1", "p2")])
+        self.assertEqual(self.feed.publish("catalog", "ds", changed=[1]), 2)
+        self._wait_for(lambda: len(self.pushed) == 2)
+        self.assertEqual(sorted(page for _, page, _ in self.pushed), ["p1", "p2"])
+        self.assertTrue(self.feed.unsubscribe("s1", page_id="p1"))
+        self.assertEqual(list(self.feed.subscriptions("s1")), [("s1", "p2")])
+        self.assertEqual(self.feed.publish("catalog", "other", changed=[1]), 0)
+        self.assertEqual(self.feed.publish("catalog", None, reset=True), 1)
+
+    def test_leases_that_are_not_renewed_expire(self):
+        self.feed.subscribe("s1", "catalog", ["ds"])
+        self.feed.subscribe("s2", "catalog")
+        self._wait_for(lambda: not self.feed.subscriptions())
+        self.assertEqual(self.feed.stats()["expired"], 2)
+        self.assertEqual(self.feed.publish("catalog", "ds", changed=[1]), 0)
+
+
+class _PlantRepository(object):
+    def update_equipment(self, record, user_id):
+        return {"ID": record.get("ID")}
+
+
+class PlantEquipmentAnnouncementTests(unittest.TestCase):
+    def setUp(self):
+        self.published = []
+        self._publish = plant_command_handlers.feed.publish
+        plant_command_handlers.feed.publish = lambda model, key=None, **delta: self.published.append((key, delta))
+        self.port = _DictCachePort()
+
+    def tearDown(self):
+        plant_command_handlers.feed.publish = self._publish
+
+    def _update(self, department_id):
+        command = plant_commands.UpdateEquipmentCommand("u1", {"ID": 7, "Name": "Press", "DepartmentID": department_id})
+        plant_command_handlers.handle_update_equipment(command, _PlantRepository(), self.port)
+
+    def _cache_tree(self, department_id):
+        self.port.put("equipment:u1", plant_domain_services.PlantHierarchyIndex([
+            plant_entities.Equipment.from_record({"ID": 7, "Name": "Press", "DepartmentID": department_id})]))
+
+    def test_moving_equipment_removes_it_from_the_old_department(self):
+        self._cache_tree(1)
+        self._update(2)
+        self.assertEqual(self.published, [(1, {"removed": [7]}), (2, {"added": [7]})])
+
+    def test_update_within_the_department_is_a_change(self):
+        self._cache_tree(1)
+        self._update(1)
+        self.assertEqual(self.published, [(1, {"changed": [7]})])
+
+    def test_unknown_previous_department_resets_every_department(self):
+        self._update(2)
+        self.assertEqual(self.published, [(None, {"reset": True})])
+
+
 class SessionContextTests(unittest.TestCase):
     def test_current_uses_system_defaults(self):
         ctx = session_context_module.current()